@@ -11,754 +11,3363 @@ Design Brief v3 Excel workbook. It operates in 5 phases:
   Phase 4: Typography changes (contextual per-element adjustments)
   Phase 5: JavaScript changes (slide duration)
 
-Run:  python _apply_design_brief.py
+Token values, missing tokens, literal component values and JS constants
+are read from the workbook itself (see load_brief); the phase functions
+keep the selector knowledge the workbook cannot express. A missing token
+is added to the :root of each page block that uses it, as the per-page
+token graph (definitions, var() uses, token -> token references) shows. Phases record
+offset edits against the unmodified stylesheet (EditBuffer), which is
+materialized once; overlapping edits are reported as conflicts.
+
+The output is verified against assertions derived from the brief (old
+colors gone from the :root blocks, no :root token left at the brief's
+current value, var() references resolving within their page block,
+balanced braces) in one tokenizer pass; the script exits non-zero when
+one fails, so CI can gate on it. Token values tuned by hand are left
+alone and listed; --override-tokens sets them to the brief's values.
+
+Re-runs are incremental: .brief-cache/manifest.json (one per stylesheet)
+records each PAGE: block's input/output hash, and only blocks edited since
+the last run (or all of them, when the brief or this script changed) are
+transformed. That is safe because the phases are idempotent: no rule's
+output matches another rule's input, which --check-idempotent verifies by
+running the phases on their own output. --jobs N transforms the blocks in
+N worker processes; --check-parallel verifies that its output is
+byte-identical to a serial run.
+
+--profile times every phase and rule (matches, tracemalloc bytes, string
+copies) and writes the trace to .brief-cache/profile.json. --stream
+rewrites a stylesheet of any size in bounded chunks of whole rules
+(--css selects another stylesheet, e.g. a multi-tenant bundle).
+--check-patterns times the precompiled Phase 3 patterns on inputs built
+to make them backtrack. --consolidate writes one shared :root layer and
+merges page-scoped rules that only differ in their page. --dry-run writes
+nothing: it lists every edit per rule (page block, selector, old -> new)
+and prints a unified diff, or writes it to a patch file. --tokens reports
+the token graph: undefined references, unused tokens, cycles and the
+values tokens resolve to in each page block.
+
+Run:  python _apply_design_brief.py [--brief reference/<workbook>.xlsx] [--full] [--jobs N]
+                                    [--profile] [--stream] [--css <stylesheet>]
+                                    [--consolidate] [--check-patterns] [--dry-run [PATCH]]
+                                    [--check-idempotent] [--check-parallel] [--tokens [PAGE]]
+                                    [--override-tokens]
 """
 
-import re
+import argparse
+import bisect
+import contextlib
+import hashlib
+import io
+import json
 import os
+import re
+import sys
+import time
+import tracemalloc
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from _page_markup import load_page_markup, may_share_element, rule_removal
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CSS_PATH = os.path.join(BASE_DIR, 'assets', 'shared-styles.css')
 JS_PATH  = os.path.join(BASE_DIR, 'assets', 'shared-scripts.js')
 
 
-def count_replacements(old_css, new_css, label):
-    """Report how many lines changed between two CSS strings."""
-    old_lines = old_css.splitlines()
-    new_lines = new_css.splitlines()
-    diff = 0
-    for a, b in zip(old_lines, new_lines):
-        if a != b:
-            diff += 1
-    diff += abs(len(new_lines) - len(old_lines))
-    print(f"  {label}: {diff} lines changed")
-    return diff
+# ─────────────────────────────────────────────────────────────────
+# PROFILING
+# ─────────────────────────────────────────────────────────────────
+# Phases report through span()/note(), which cost nothing until a Profiler
+# is installed (--profile). A span times one phase or one rule of a phase;
+# note() adds match, string-copy and changed-line counts to the innermost
+# open span, and closing a span folds its counts into its parent.
+PROFILE_PATH = os.path.join(BASE_DIR, '.brief-cache', 'profile.json')
+
+_profiler = None
+
+
+class Profiler:
+    """Wall time, matches, allocations and string copies per phase and rule.
+
+    With `memory`, tracemalloc records the peak bytes each span allocated
+    above what was live when it opened (nested spans share one trace).
+    """
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.records = []
+        self._stack = []
+
+    def __enter__(self):
+        global _profiler
+        self._previous = _profiler
+        _profiler = self
+        if self.memory:
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc):
+        global _profiler
+        if self.memory:
+            tracemalloc.stop()
+        _profiler = self._previous
+
+    def _peak(self):
+        _, peak = tracemalloc.get_traced_memory()
+        for frame in self._stack:
+            frame['high'] = max(frame['high'], peak)
+        tracemalloc.reset_peak()
+
+    @contextlib.contextmanager
+    def span(self, phase, rule=None):
+        if phase is None and self._stack:
+            phase = self._stack[-1]['phase']
+        frame = {'phase': phase, 'rule': rule, 'matches': 0, 'copies': 0, 'lines': 0}
+        if self.memory:
+            self._peak()
+            frame['low'] = frame['high'] = tracemalloc.get_traced_memory()[0]
+        self._stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield frame
+        finally:
+            wall = time.perf_counter() - start
+            if self.memory:
+                self._peak()
+            self._stack.pop()
+            record = {key: frame[key] for key in ('phase', 'rule', 'matches', 'copies', 'lines')}
+            record['block'] = None
+            record['wall_s'] = wall
+            record['alloc_bytes'] = frame['high'] - frame['low'] if self.memory else None
+            self.records.append(record)
+            if self._stack:
+                parent = self._stack[-1]
+                for key in ('matches', 'copies', 'lines'):
+                    parent[key] += frame[key]
+
+    def note(self, matches=0, copies=0, lines=0):
+        if self._stack:
+            frame = self._stack[-1]
+            frame['matches'] += matches
+            frame['copies'] += copies
+            frame['lines'] += lines
+
+    def _totals(self, records):
+        """Sum records per (phase, rule), e.g. across page blocks."""
+        totals = {}
+        for r in records:
+            key = (r['phase'], r['rule'])
+            if key not in totals:
+                totals[key] = dict(r, block=None)
+                continue
+            total = totals[key]
+            for field in ('matches', 'copies', 'lines', 'wall_s'):
+                total[field] += r[field]
+            if r['alloc_bytes'] is not None:
+                total['alloc_bytes'] = max(total['alloc_bytes'], r['alloc_bytes'])
+        return list(totals.values())
+
+    def phases(self):
+        return self._totals(r for r in self.records if r['rule'] is None)
+
+    def hot_rules(self, limit=None):
+        rules = self._totals(r for r in self.records if r['rule'] is not None)
+        rules.sort(key=lambda r: r['wall_s'], reverse=True)
+        return rules[:limit]
+
+    def report(self, limit=15):
+        def row(label, r):
+            alloc = '-' if r['alloc_bytes'] is None else f"{r['alloc_bytes'] / 1024:.0f} KB"
+            return (f"  {label:44.44s} {r['wall_s'] * 1000:8.2f} ms {r['matches']:6d} "
+                    f"{alloc:>10s} {r['copies']:4d} {r['lines']:6d}")
+
+        header = f"  {'':44s} {'wall':>11s} {'match':>6s} {'alloc':>10s} {'copy':>4s} {'lines':>6s}"
+        print("\n-- Profile: phases --")
+        print(header)
+        for r in self.phases():
+            print(row(r['phase'], r))
+        print(f"\n-- Profile: hottest {limit} rules --")
+        print(header)
+        for r in self.hot_rules(limit):
+            print(row(f"{r['phase']} / {r['rule']}", r))
+
+    def write(self, path=PROFILE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'memory': self.memory,
+                'phases': self.phases(),
+                'hot_rules': self.hot_rules(),
+                'records': self.records,
+            }, f, indent=1)
+
+
+def span(phase, rule=None):
+    """Profile a phase (rule=None) or one rule within it; no-op unless profiling.
+
+    phase=None profiles `rule` under whichever phase is currently open.
+    """
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.span(phase, rule)
+
+
+def note(matches=0, copies=0, lines=0):
+    if _profiler is not None:
+        _profiler.note(matches, copies, lines)
+
+
+def profiled_phase(fn):
+    """Run a phase function inside its own profiling span."""
+    def wrapper(*args, **kwargs):
+        with span(fn.__name__):
+            return fn(*args, **kwargs)
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+
+
+def changed_lines(text, edits):
+    """Lines of `text` that `edits` touch, plus lines they add.
+
+    Worked out from the edit offsets alone (newline counts between edits),
+    so no copy of either version is split into lines.
+    """
+    count = added = 0
+    line = 0
+    last = -1
+    pos = 0
+    for start, end, new, *_ in sorted(edits, key=lambda e: (e[0], e[1])):
+        line += text.count('\n', pos, start)
+        first = line
+        removed = text.count('\n', start, end)
+        line += removed
+        pos = end
+        count += line - max(first, last + 1) + 1 if line > last else 0
+        last = line
+        added += new.count('\n') - removed
+    return count + max(added, 0)
+
+
+def report_changes(label, text, edits):
+    """Print and profile the changed-line count of a phase's edits."""
+    lines = changed_lines(text, edits)
+    note(lines=lines)
+    print(f"  {label}: {lines} lines changed")
+    return lines
 
 
 # ─────────────────────────────────────────────────────────────────
-# PHASE 1: :root token replacements
+# CSS RULE INDEX
 # ─────────────────────────────────────────────────────────────────
-def apply_root_token_replacements(css):
-    """Simple str.replace() for all :root token values across all 7 blocks."""
-    print("\n== Phase 1: :root Token Replacements ==")
-    before = css
-
-    # Brand Colors
-    replacements = {
-        # Orange
-        '--orange-primary: #E65100':  '--orange-primary: #EC6303',
-        '--orange-light: #FF7D2E':    '--orange-light: #F39014',
-        '--orange-dark: #BF360C':     '--orange-dark: #E77900',
-        # Blue
-        '--blue-primary: #1565C0':    '--blue-primary: #23679A',
-        '--blue-light: #42A5F5':      '--blue-light: #3D87B8',
-        '--blue-lighter: #E3F2FD':    '--blue-lighter: #E8F2FA',
-        '--blue-dark: #0D47A1':       '--blue-dark: #154785',
-        # Purple → Navy
-        '--purple-primary: #7B1FA2':  '--purple-primary: #0B286D',
-        '--purple-light: #AB47BC':    '--purple-light: #154785',
-        '--purple-lighter: #F3E5F5':  '--purple-lighter: #E8EEF7',
-        '--purple-dark: #6A1B9A':     '--purple-dark: #081E52',
-        # Yellow
-        '--yellow-primary: #F9A825':  '--yellow-primary: #F9B02C',
-        # Gray Scale (cool undertone rebuild)
-        '--gray-50: #FAFAFA':   '--gray-50: #FAFBFC',
-        '--gray-100: #F5F5F5':  '--gray-100: #F2F4F6',
-        '--gray-200: #EEEEEE':  '--gray-200: #E5E8EB',
-        '--gray-300: #E0E0E0':  '--gray-300: #D1D5DB',
-        '--gray-400: #BDBDBD':  '--gray-400: #B0B6BE',
-        '--gray-500: #9E9E9E':  '--gray-500: #8B929B',
-        '--gray-600: #757575':  '--gray-600: #6B7280',
-        '--gray-700: #616161':  '--gray-700: #53585A',
-        '--gray-800: #424242':  '--gray-800: #3D4249',
-        '--gray-900: #212121':  '--gray-900: #1F2328',
-    }
+# Offsets are str indices into the parsed stylesheet. A declaration spans
+# `start`..`end`, where `end` sits just past its ';' (or at `value_end`
+# for a final declaration without one).
+Decl = namedtuple('Decl', 'prop value start end value_start value_end')
+CssRule = namedtuple('CssRule', 'selectors media page start body_start body_end decls')
+
+PAGE_SCOPE_RE = re.compile(r'\.page-([a-z][\w-]*)')
+
+
+# Structural tokens: comments and strings are matched whole so braces and
+# semicolons inside them are never mistaken for structure.
+_CSS_TOKEN_RE = re.compile(r'/\*.*?(?:\*/|\Z)|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|[{};]', re.S)
+_DECL_TOKEN_RE = re.compile(r'/\*.*?(?:\*/|\Z)|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|[():;]', re.S)
+
+
+def _parse_declarations(css, start, end):
+    """Split a rule body into Decl spans (parens/strings/comments aware)."""
+    decls = []
+    decl_start = None
+    colon = -1
+    depth = 0
+
+    def close(stop, terminated):
+        value_end = stop
+        while value_end > decl_start and css[value_end - 1].isspace():
+            value_end -= 1
+        if colon < 0:
+            return
+        value_start = colon + 1
+        while value_start < value_end and css[value_start].isspace():
+            value_start += 1
+        decls.append(Decl(
+            css[decl_start:colon].strip(), css[value_start:value_end],
+            decl_start, stop + 1 if terminated else value_end,
+            value_start, value_end,
+        ))
+
+    pos = start
+    for m in _DECL_TOKEN_RE.finditer(css, start, end):
+        tok = m.group()
+        if decl_start is None:
+            gap = css[pos:m.start()]
+            if gap.strip():
+                decl_start = pos + len(gap) - len(gap.lstrip())
+            elif tok[0] in '/;':
+                pos = m.end()
+                continue
+            else:
+                decl_start = m.start()
+        if tok == '(':
+            depth += 1
+        elif tok == ')':
+            depth -= 1
+        elif tok == ':' and colon < 0 and depth == 0:
+            colon = m.start()
+        elif tok == ';' and depth == 0:
+            close(m.start(), True)
+            decl_start, colon = None, -1
+        pos = m.end()
+    if decl_start is None and css[pos:end].strip():
+        decl_start = pos + len(css[pos:end]) - len(css[pos:end].lstrip())
+    if decl_start is not None:
+        close(end, False)
+    return tuple(decls)
+
+
+def parse_css_rules(css):
+    """Parse a stylesheet once into a flat list of CssRule entries.
+
+    Each rule records its comma-split selector list, the enclosing @media
+    query (None at top level), its .page-* scope (None for :root and other
+    unscoped rules) and the declaration spans. Rules nested in @keyframes
+    carry the keyframes prelude as `media` so they never look top-level.
+    """
+    rules = []
+    stack = []          # open at-rule preludes
+    prelude_start = 0
+    rule = None         # (selectors, page, start, body_start) of the open rule
+    for m in _CSS_TOKEN_RE.finditer(css):
+        tok = m.group()
+        if tok[0] in '/"\'':
+            if rule is None and not css[prelude_start:m.start()].strip():
+                prelude_start = m.end()
+            continue
+        if rule is not None:
+            if tok == '}':
+                selectors, page, start, body_start = rule
+                rules.append(CssRule(
+                    selectors, stack[-1] if stack else None, page,
+                    start, body_start, m.start(),
+                    _parse_declarations(css, body_start, m.start()),
+                ))
+                rule = None
+                prelude_start = m.end()
+            continue
+        raw = css[prelude_start:m.start()]
+        prelude = raw.strip()
+        if tok == '{':
+            if prelude.startswith('@'):
+                stack.append(prelude)
+            else:
+                page = PAGE_SCOPE_RE.search(prelude)
+                rule = (
+                    tuple(s.strip() for s in prelude.split(',') if s.strip()),
+                    page.group(1) if page else None,
+                    prelude_start + len(raw) - len(raw.lstrip()),
+                    m.end(),
+                )
+        elif tok == '}':
+            if stack:
+                stack.pop()
+        # ';' outside a rule ends a statement at-rule (@import, @charset).
+        prelude_start = m.end()
+    return rules
+
+
+class RuleIndex:
+    """Rules plus (property, value) and property → [(rule, decl)] lookups.
+
+    Built once per stylesheet so phases can ask for e.g. every
+    `font-size: 32px` in a heading rule outside @media in O(matches)
+    instead of re-scanning the file.
+    """
+
+    def __init__(self, css):
+        self.css = css
+        with span(None, 'index'):
+            self.rules = parse_css_rules(css)
+            self.by_decl = {}
+            self.by_prop = {}
+            for rule in self.rules:
+                for decl in rule.decls:
+                    self.by_decl.setdefault((decl.prop, decl.value), []).append((rule, decl))
+                    self.by_prop.setdefault(decl.prop, []).append((rule, decl))
+
+    def find(self, prop, value, selector=None, media=None, page=None):
+        """Yield (rule, decl) for `prop: value` filtered by rule context.
+
+        selector: callable(selector_text) -> bool, true for any selector
+                  of the rule's list.
+        media:    True = inside @media only, False = outside only,
+                  None = either.
+        page:     restrict to one .page-* scope.
+        """
+        for rule, decl in self.by_decl.get((prop, value), ()):
+            if media is not None and (rule.media is not None) != media:
+                continue
+            if page is not None and rule.page != page:
+                continue
+            if selector is not None and not any(selector(s) for s in rule.selectors):
+                continue
+            yield rule, decl
+
+
+def canonical_value(value):
+    """`value` with its optional whitespace normalized: one space between
+    words, ', ' between arguments, none inside parentheses."""
+    value = re.sub(r'\s+', ' ', value.strip())
+    value = re.sub(r' ?, ?', ', ', value)
+    return re.sub(r'\( | \)', lambda m: m.group(0).strip(), value)
+
+
+def decl_of(rule, prop):
+    """Last declaration of `prop` in `rule` (the one that wins), or None."""
+    for decl in reversed(rule.decls):
+        if decl.prop == prop:
+            return decl
+    return None
+
+
+def insert_after(css, decl, text):
+    """Edit that adds a `prop: value;` right after `decl`, in its format.
+
+    Expanded rules get a new line at the same indent; compact one-line
+    rules get the declaration inline.
+    """
+    line_start = css.rfind('\n', 0, decl.start) + 1
+    indent = css[line_start:decl.start]
+    if decl.end == decl.value_end:
+        # Final declaration without ';' — terminate it first.
+        return (decl.end, decl.end, '; ' + text.rstrip(';'))
+    if not indent.strip() and css[decl.end:decl.end + 1] in ('\n', '\r'):
+        return (decl.end, decl.end, '\n' + indent + text)
+    return (decl.end, decl.end, ' ' + text)
+
+
+def splice(text, edits):
+    """Apply (start, end, replacement) edits in one pass.
+
+    Edits must not overlap; inserts at the same offset keep their order.
+    """
+    if not edits:
+        return text
+    note(copies=1)
+    out = []
+    pos = 0
+    for start, end, new in sorted(edits, key=lambda e: (e[0], e[1])):
+        if start < pos:
+            raise ValueError(f'overlapping edits at offset {start}')
+        out.append(text[pos:start])
+        out.append(new)
+        pos = end
+    out.append(text[pos:])
+    return ''.join(out)
 
-    for old, new in replacements.items():
-        css = css.replace(old, new)
-
-    # Shadows — expanded format (4 blocks: engagieren, startseite, hilfe-finden, fuer-kommunen)
-    shadow_expanded = {
-        '--shadow-sm: 0 1px 2px rgba(0,0,0,0.05);':
-            '--shadow-sm: 0 1px 3px rgba(31,35,40,0.06);',
-        '--shadow-md: 0 4px 6px -1px rgba(0,0,0,0.1), 0 2px 4px -1px rgba(0,0,0,0.06);':
-            '--shadow-md: 0 4px 12px rgba(31,35,40,0.08);',
-        '--shadow-lg: 0 10px 15px -3px rgba(0,0,0,0.1), 0 4px 6px -2px rgba(0,0,0,0.05);':
-            '--shadow-lg: 0 8px 24px rgba(31,35,40,0.10);',
-        '--shadow-xl: 0 20px 25px -5px rgba(0,0,0,0.1), 0 10px 10px -5px rgba(0,0,0,0.04);':
-            '--shadow-xl: 0 16px 40px rgba(31,35,40,0.12);',
-    }
-    for old, new in shadow_expanded.items():
-        css = css.replace(old, new)
-
-    # Shadows — compact format (3 blocks: ueber-uns, kontakt, muenchen)
-    shadow_compact = {
-        '--shadow-sm: 0 1px 2px rgba(0,0,0,0.05)':
-            '--shadow-sm: 0 1px 3px rgba(31,35,40,0.06)',
-        '--shadow-md: 0 4px 6px -1px rgba(0,0,0,0.1)':
-            '--shadow-md: 0 4px 12px rgba(31,35,40,0.08)',
-        '--shadow-lg: 0 10px 15px -3px rgba(0,0,0,0.1)':
-            '--shadow-lg: 0 8px 24px rgba(31,35,40,0.10)',
-        '--shadow-xl: 0 20px 25px -5px rgba(0,0,0,0.1)':
-            '--shadow-xl: 0 16px 40px rgba(31,35,40,0.12)',
-        # Also fix shadow-2xl (only in compact blocks)
-        '--shadow-2xl: 0 25px 50px -12px rgba(0,0,0,0.25)':
-            '--shadow-2xl: 0 25px 50px -12px rgba(31,35,40,0.25)',
-    }
-    for old, new in shadow_compact.items():
-        css = css.replace(old, new)
 
-    # Radius
-    css = css.replace('--radius-xl: 24px', '--radius-xl: 20px')
+# ─────────────────────────────────────────────────────────────────
+# EDIT BUFFER
+# ─────────────────────────────────────────────────────────────────
+# Phases don't rewrite the stylesheet one after another. They all read
+# the same immutable source (and share one RuleIndex of it) and record
+# (start, end, replacement) edits in source offsets; the buffer is spliced
+# into text exactly once. No phase matches text another phase writes, so
+# reading the source instead of the previous phase's output is the same
+# transformation without a full copy per phase and rule.
+Edit = namedtuple('Edit', 'start end new seq owner')
+
+
+class EditBuffer:
+    """Piece table of edits against an immutable source string.
+
+    Edits are trimmed to the characters they actually change. Overlapping
+    edits from different owners are conflicts: the edit added first (the
+    earlier phase) is kept, the other is dropped and listed in
+    `conflicts`. The same edit recorded twice is applied once.
+    """
+
+    def __init__(self, source, index=None):
+        self.source = source
+        self.edits = []
+        self.conflicts = []
+        self._index = index
+        self._tokens = None
+
+    @property
+    def index(self):
+        """RuleIndex of the source, built on first use."""
+        if self._index is None:
+            self._index = RuleIndex(self.source)
+        return self._index
+
+    @property
+    def tokens(self):
+        """TokenGraph of the source, built on first use from the index."""
+        if self._tokens is None:
+            self._tokens = TokenGraph(self.source, self.index)
+        return self._tokens
+
+    def add(self, start, end, new, owner=None):
+        """Record one edit; returns it, or None if it changes nothing."""
+        old = self.source[start:end]
+        if old == new:
+            return None
+        n = min(len(old), len(new))
+        head = 0
+        while head < n and old[head] == new[head]:
+            head += 1
+        tail = 0
+        while tail < n - head and old[-1 - tail] == new[-1 - tail]:
+            tail += 1
+        edit = Edit(start + head, end - tail, new[head:len(new) - tail], len(self.edits), owner)
+        self.edits.append(edit)
+        return edit
+
+    def add_all(self, edits, owner=None):
+        """Record (start, end, new) edits; returns the ones that change text."""
+        added = []
+        for start, end, new in edits:
+            edit = self.add(start, end, new, owner)
+            if edit is not None:
+                added.append(edit)
+        return added
+
+    def resolve(self):
+        """Non-conflicting edits in source order; fills `conflicts`."""
+        kept = []
+        self.conflicts = []
+        for edit in sorted(self.edits, key=lambda e: (e.start, e.end, e.seq)):
+            # Kept edits don't overlap, so the last one reaches furthest.
+            while kept and kept[-1].end > edit.start and edit.end > kept[-1].start:
+                last = kept[-1]
+                if last[:3] == edit[:3]:
+                    edit = None
+                elif last.seq < edit.seq:
+                    self.conflicts.append((last, edit))
+                    edit = None
+                else:
+                    self.conflicts.append((edit, kept.pop()))
+                    continue
+                break
+            if edit is not None:
+                kept.append(edit)
+        return kept
+
+    def text(self):
+        """Materialize the edited text (one copy of the source)."""
+        return splice(self.source, [(e.start, e.end, e.new) for e in self.resolve()])
+
+    def report_conflicts(self):
+        for kept, dropped in self.conflicts:
+            line = self.source.count('\n', 0, dropped.start) + 1
+            print(f"  WARNING: line {line}: {dropped.owner} overlaps {kept.owner}; "
+                  f"{dropped.owner} not applied")
+
+
+def rewrite(buf, pattern, repl, phase, rule):
+    """re.sub() over the buffer's source, recorded as edits of one rule.
+
+    `repl` is a template or a function of the match, as for re.sub().
+    Returns the edits that change text.
+    """
+    with span(phase, rule):
+        expand = repl if callable(repl) else (lambda m: m.expand(repl))
+        added = buf.add_all(((m.start(), m.end(), expand(m))
+                             for m in re.finditer(pattern, buf.source)), f'{phase} / {rule}')
+        note(matches=len(added), lines=changed_lines(buf.source, added))
+        return added
 
-    # Transitions (use regex with word boundary to avoid double-replacing)
-    css = re.sub(r'--transition-normal: 250ms ease;', '--transition-normal: 250ms ease-out;', css)
-    css = re.sub(r'--transition-slow: 350ms ease;', '--transition-slow: 400ms ease-out;', css)
 
-    count_replacements(before, css, "Token replacements")
-    return css
+# ─────────────────────────────────────────────────────────────────
+# DESIGN BRIEF RULE SET
+# ─────────────────────────────────────────────────────────────────
+# The workbook is read with zipfile + ElementTree (no Office, no network)
+# and compiled into a JSON-serialisable rule set:
+#
+#   tokens        {'id', 'name', 'old', 'new'}          :root value changes
+#   new_tokens    {'id', 'name', 'new'}                 tokens marked missing
+#   declarations  {'id', 'component', 'state', 'selector', 'property',
+#                  'media', 'old', 'new'}               selector-scoped edits
+#   js            {'id', 'name', 'old', 'new'}          top-level JS constants
+#   unparsed      {'id', 'property', 'old', 'new', 'problem'}
+#                                                       rows that are prose, not CSS
+#
+# Rule ids are '<sheet>!<cell>' of the NEW value, so every change can be
+# traced back to the workbook. Sheets are read by position, which keeps the
+# German (1_Typografie, 2_Farben, …) and English workbooks interchangeable.
+BRIEF_PATH = os.path.join(BASE_DIR, 'reference', 'Design_Brief_Helferportal_FILLED_v3.xlsx')
+BRIEF_CACHE_DIR = os.path.join(BASE_DIR, '.brief-cache')
+# Bump when compile_brief() output changes so stale caches are ignored.
+RULESET_VERSION = 3
+
+_XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_XLSX_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_CELL_REF_RE = re.compile(r'([A-Z]+)(\d+)')
+_CSS_PROPERTY_RE = re.compile(r'-?[a-z][a-z0-9-]*')
+# A trailing note such as '9999px (Pill)'.
+_BRIEF_NOTE_RE = re.compile(r'\s+\([A-Z][^()]*\)$')
+# Prose in a value cell: ellipses, '~250px', capitalised words, and
+# 'to'/'top'/… outside a function ('0.9 to 0.95', '64px top, 32px bottom').
+_BRIEF_PROSE_RE = re.compile(r'\.\.\.|…|~|\b[A-Z][a-z]|\b(?:to|top|bottom|left|right)\b(?![^(]*\))')
+
+# Workbook labels → stylesheet selectors. Rows without an entry are kept in
+# the rule set (selector None) but only the phases that know them apply them.
+BRIEF_SELECTORS = {
+    'Button Primary': '.btn-primary',
+    'Button Secondary': '.btn-secondary',
+    'Button Ghost': '.btn-ghost',
+    'Quick Action Card': '.quick-action-card',
+    'City Card': '.city-card',
+    'Tab Button': '.tab-btn',
+    'FAQ Item': '.faq-item',
+    'FAQ Question': '.faq-question',
+    'FAQ Answer': '.faq-answer',
+    'Input Field': '.form-input',
+    'Textarea': '.form-textarea',
+    'Select / Dropdown': '.form-select',
+    'Hero Slider (Homepage)': '.hero-slider',
+    'Hero Mini (Subpages)': '.hero-mini',
+    'Header Bar': '.header',
+    'Nav Button': '.nav-btn',
+    'Logo': '.logo-icon',
+    'Mega Menu': '.mega-menu',
+    'Footer': '.footer',
+}
+BRIEF_STATES = {
+    'Default': '',
+    'Closed': '',
+    'Hover': ':hover',
+    'Focus': ':focus',
+    'Active': ':active',
+    'Disabled': ':disabled',
+    'Error': '.error',
+    'Open': '.open',
+}
+BRIEF_PROPERTIES = {
+    'text-color': 'color',
+}
+# Component rows that are script tunables rather than CSS.
+BRIEF_JS_CONSTANTS = {
+    'slide-duration': 'slideDuration',
+}
+# Changes the workbook implies but does not list, keyed by the token row
+# they are derived from; each is added only when that row is in the brief.
+BRIEF_SUPPLEMENT_TOKENS = {
+    # "All shadows now reference the new gray base" — 2xl has no row.
+    '--shadow-xl': {'id': 'supplement:shadow-2xl', 'name': '--shadow-2xl',
+                    'old': '0 25px 50px -12px rgba(0,0,0,0.25)',
+                    'new': '0 25px 50px -12px rgba(31,35,40,0.25)'},
+    # Warning row: "brand gold/amber #f9b02c (was #F9A825)" is yellow-primary.
+    '--warning': {'id': 'supplement:yellow-primary', 'name': '--yellow-primary',
+                  'old': '#F9A825', 'new': '#F9B02C'},
+}
+
+
+def read_xlsx_sheets(path):
+    """Return [(sheet_name, [(row_number, {column: text})])] in tab order."""
+    with zipfile.ZipFile(path) as zf:
+        names = set(zf.namelist())
+        shared = []
+        if 'xl/sharedStrings.xml' in names:
+            root = ET.fromstring(zf.read('xl/sharedStrings.xml'))
+            for si in root.iter(_XLSX_NS + 'si'):
+                shared.append(''.join(t.text or '' for t in si.iter(_XLSX_NS + 't')))
+        rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+        targets = {rel.get('Id'): rel.get('Target') for rel in rels}
+        workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+        sheets = []
+        for sheet in workbook.iter(_XLSX_NS + 'sheet'):
+            target = targets[sheet.get(_XLSX_REL_NS + 'id')].lstrip('/')
+            if not target.startswith('xl/'):
+                target = 'xl/' + target
+            rows = []
+            for row in ET.fromstring(zf.read(target)).iter(_XLSX_NS + 'row'):
+                cells = {}
+                for c in row.iter(_XLSX_NS + 'c'):
+                    kind = c.get('t')
+                    if kind == 'inlineStr':
+                        text = ''.join(t.text or '' for t in c.iter(_XLSX_NS + 't'))
+                    else:
+                        v = c.find(_XLSX_NS + 'v')
+                        text = v.text if v is not None and v.text else ''
+                        if kind == 's' and text:
+                            text = shared[int(text)]
+                    text = text.strip()
+                    if text:
+                        cells[_CELL_REF_RE.match(c.get('r')).group(1)] = text
+                if cells:
+                    rows.append((int(row.get('r')), cells))
+            sheets.append((sheet.get('name'), rows))
+    return sheets
+
+
+def _brief_value(text):
+    """Normalise a workbook cell; None for empty/'— (missing)' markers."""
+    if not text or text.startswith('—') or text == '-':
+        return None
+    return text
+
+
+def _brief_css_value(text, token_names):
+    """(value, problem) for a value cell: the CSS value with a trailing note
+    dropped, or a problem string when the cell is prose rather than CSS.
+    A bare token name ('shadow-lg') stands for its var() reference."""
+    if text is None:
+        return None, None
+    value = _BRIEF_NOTE_RE.sub('', text)
+    if '--' + value in token_names:
+        return f'var(--{value})', None
+    if _BRIEF_PROSE_RE.search(value):
+        return None, f"'{text}' is not a CSS value"
+    return value, None
+
+
+def _brief_declarations(prop, old, new, token_names):
+    """Parse one component row into [(property, old, new)] or a problem.
+
+    A row without a property may list whole declarations as its NEW value
+    ('opacity: 0.5; border-color: #E5E8EB'); each becomes a row of its own.
+    """
+    if not _CSS_PROPERTY_RE.fullmatch(prop):
+        decls = [d.partition(':') for d in new.split(';') if d.strip()]
+        if old is None and decls and all(colon and _CSS_PROPERTY_RE.fullmatch(p.strip())
+                                         for p, colon, _ in decls):
+            return [(p.strip(), None, v.strip()) for p, _, v in decls], None
+        return [], f"property '{prop}' is not a CSS property"
+    old_value, problem = _brief_css_value(old, token_names)
+    if problem is None:
+        new_value, problem = _brief_css_value(new, token_names)
+    if problem is not None:
+        return [], problem
+    return ([] if old_value == new_value else [(prop, old_value, new_value)]), None
+
+
+def _brief_changes(rows, old_col, new_col, first_row=4):
+    """Yield (row, cells, old, new) for rows whose NEW differs from current."""
+    for number, cells in rows:
+        if number < first_row:
+            continue
+        new = _brief_value(cells.get(new_col))
+        if new is None or new == cells.get(old_col):
+            continue
+        yield number, cells, _brief_value(cells.get(old_col)), new
+
+
+def compile_brief(sheets):
+    """Compile read_xlsx_sheets() output into a rule set (see above)."""
+    ruleset = {'tokens': [], 'new_tokens': [], 'declarations': [], 'js': [], 'unparsed': []}
+    token_names = set()
+    typography, colors, spacing, components = (rows for _, rows in sheets[:4])
+    colors_name, spacing_name = sheets[1][0], sheets[2][0]
+
+    # Colors and spacing/radius/shadow/transition tokens: one row per token.
+    for sheet_name, rows, to_token in (
+        (colors_name, colors, lambda label: '--' + label.lower().replace(' ', '-')),
+        (spacing_name, spacing, lambda label: '--' + label),
+    ):
+        token_names.update(to_token(cells['A']) for number, cells in rows
+                           if number >= 4 and 'A' in cells)
+        for number, cells, old, new in _brief_changes(rows, 'C', 'D'):
+            rule_id = f'{sheet_name}!D{number}'
+            name = to_token(cells['A'])
+            if old is None:
+                ruleset['new_tokens'].append({'id': rule_id, 'name': name, 'new': new})
+            else:
+                ruleset['tokens'].append({'id': rule_id, 'name': name, 'old': old, 'new': new})
+    listed = {t['name'] for t in ruleset['tokens'] + ruleset['new_tokens']}
+    for source, token in BRIEF_SUPPLEMENT_TOKENS.items():
+        if source in listed:
+            ruleset['tokens'].append(token)
+
+    # Typography: element header rows, then desktop (C→D) / mobile (E→F).
+    element = None
+    for number, cells in typography:
+        if number < 4:
+            continue
+        if 'A' in cells:
+            element = cells['A']
+        if 'B' not in cells:
+            continue
+        for old_col, new_col, media in (('C', 'D', False), ('E', 'F', True)):
+            new = _brief_value(cells.get(new_col))
+            if new is None or new == cells.get(old_col):
+                continue
+            ruleset['declarations'].append({
+                'id': f'{sheets[0][0]}!{new_col}{number}',
+                'component': element, 'state': None,
+                'selector': BRIEF_SELECTORS.get(element),
+                'property': cells['B'], 'media': media,
+                'old': _brief_value(cells.get(old_col)), 'new': new,
+            })
+
+    # Components: component and state carry down until the next label.
+    component = state = None
+    for number, cells in components:
+        if number < 4:
+            continue
+        if 'A' in cells:
+            component, state = cells['A'], 'Default'
+        if 'B' in cells:
+            state = cells['B']
+        new = _brief_value(cells.get('E'))
+        if 'C' not in cells or new is None or new == cells.get('D'):
+            continue
+        rule_id = f'{sheets[3][0]}!E{number}'
+        old = _brief_value(cells.get('D'))
+        if cells['C'] in BRIEF_JS_CONSTANTS:
+            ruleset['js'].append({
+                'id': rule_id, 'name': BRIEF_JS_CONSTANTS[cells['C']],
+                'old': old and old.removesuffix('ms'), 'new': new.removesuffix('ms'),
+            })
+            continue
+        selector = BRIEF_SELECTORS.get(component)
+        suffix = BRIEF_STATES.get(state)
+        prop = BRIEF_PROPERTIES.get(cells['C'], cells['C'])
+        decls, problem = _brief_declarations(prop, old, new, token_names)
+        if problem is not None:
+            ruleset['unparsed'].append({'id': rule_id, 'property': prop, 'old': old, 'new': new,
+                                        'problem': problem})
+        for prop, old, new in decls:
+            ruleset['declarations'].append({
+                'id': rule_id, 'component': component, 'state': state,
+                'selector': None if selector is None or suffix is None else selector + suffix,
+                'property': prop, 'media': None, 'old': old, 'new': new,
+            })
+    return ruleset
+
+
+def report_brief(rules):
+    """Print one line for the workbook rows that are not CSS; returns
+    whether the rule set has any token or declaration rule at all.
+
+    The rows themselves are listed once, when load_brief() parses the
+    workbook; a cached rule set only repeats the count.
+    """
+    unparsed = rules.get('unparsed', ())
+    if unparsed:
+        print(f"  {len(unparsed)} workbook rows are not CSS and were skipped "
+              f"({', '.join(row['id'].rpartition('!')[2] for row in unparsed)})")
+    return bool(rules['tokens'] or rules['new_tokens'] or rules['declarations'])
+
+
+def load_brief(path=BRIEF_PATH, cache_dir=BRIEF_CACHE_DIR):
+    """Load the compiled rule set for `path`, parsing only on a cache miss.
+
+    The cache is keyed by the workbook's SHA-256 (and RULESET_VERSION), so
+    editing the workbook or the compiler invalidates it automatically.
+    """
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    cache_path = os.path.join(cache_dir, f'{digest}-v{RULESET_VERSION}.json') if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    ruleset = compile_brief(read_xlsx_sheets(path))
+    for row in ruleset['unparsed']:
+        print(f"  WARNING: {row['id']} {row['property']}: {row['problem']} — row skipped")
+    ruleset['source'] = os.path.basename(path)
+    ruleset['sha256'] = digest
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(ruleset, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, cache_path)
+    return ruleset
 
 
-def add_missing_tokens(css):
-    """Insert --purple-dark and --green-dark where missing."""
-    print("\n== Phase 1b: Add Missing Tokens ==")
-    before = css
-    added = 0
-
-    # --purple-dark is MISSING in expanded blocks: engagieren, startseite, hilfe-finden
-    # These blocks have --purple-lighter: #F3E5F5 (now #E8EEF7) but no --purple-dark
-    # After replacement, the marker is --purple-lighter: #E8EEF7
-    # We need to add --purple-dark: #081E52; after the purple-lighter line (in expanded format only)
-
-    # Pattern: find lines with --purple-lighter: #E8EEF7; that are NOT followed by --purple-dark
-    # In expanded blocks, each token is on its own line with proper indentation
-    lines = css.split('\n')
-    new_lines = []
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        new_lines.append(line)
-
-        # Check for expanded --purple-lighter line without --purple-dark following
-        stripped = line.strip()
-        if stripped == '--purple-lighter: #E8EEF7;' and '--purple-dark' not in line:
-            # Check next non-empty line doesn't already have --purple-dark
-            next_idx = i + 1
-            while next_idx < len(lines) and lines[next_idx].strip() == '':
-                next_idx += 1
-            if next_idx < len(lines) and '--purple-dark' not in lines[next_idx]:
-                # Get indentation from current line
-                indent = line[:len(line) - len(line.lstrip())]
-                new_lines.append(indent + '--purple-dark: #081E52;')
-                added += 1
-
-        # Check for expanded --green-lighter line without --green-dark following
-        # Only match expanded format: line has only this one token (strip check)
-        stripped = line.strip()
-        if stripped == '--green-lighter: #E8F5E9;' and '--green-dark' not in line:
-            next_idx = i + 1
-            while next_idx < len(lines) and lines[next_idx].strip() == '':
-                next_idx += 1
-            if next_idx < len(lines) and '--green-dark' not in lines[next_idx]:
-                indent = line[:len(line) - len(line.lstrip())]
-                new_lines.append(indent + '--green-dark: #1B5E20;')
-                added += 1
+# ─────────────────────────────────────────────────────────────────
+# TOKEN GRAPH
+# ─────────────────────────────────────────────────────────────────
+# Each page block is a token scope of its own: its :root defines the
+# custom properties its rules use, and the preamble (the shared :root
+# layer, once consolidated) is visible from all of them. Per scope the
+# graph holds every token's definitions, every var() use, and token →
+# token edges from values that reference other tokens. It is built once
+# per EditBuffer from the shared RuleIndex (EditBuffer.tokens); --tokens
+# caches its analysis of a stylesheet in .brief-cache/, keyed by the
+# stylesheet's hash.
+VAR_REF_RE = re.compile(r'var\(\s*(--[\w-]+)\s*(,)?')
+TOKEN_GRAPH_VERSION = 1
+
+TokenUse = namedtuple('TokenUse', 'name rule decl fallback')
+
+
+class TokenScope:
+    """Custom-property definitions and var() uses of one page block."""
+
+    def __init__(self, name):
+        self.name = name
+        self.root = None        # first top-level :root rule
+        self.defs = {}          # token -> [(rule, decl)], any rule
+        self.values = {}        # token -> value in a top-level :root (last wins)
+        self.uses = []          # TokenUse per var() reference
+        self.edges = {}         # token -> {tokens its values reference}
+
+
+class TokenGraph:
+    """Token definitions and var() uses per page scope of a stylesheet."""
+
+    def __init__(self, css, index):
+        self.css = css
+        self.blocks = [(0, PREAMBLE)]
+        for m in PAGE_BANNER_RE.finditer(css):
+            banner_end = css.find('*/', m.end())
+            scope = PAGE_BANNER_SCOPE_RE.search(
+                css, m.end(), banner_end if banner_end >= 0 else len(css))
+            self.blocks.append((m.start(), scope.group(1) if scope else f'block-{len(self.blocks)}'))
+        self._starts = [start for start, _ in self.blocks]
+        self.scopes = {name: TokenScope(name) for _, name in self.blocks}
+
+        with span(None, 'token graph'):
+            for rule in index.rules:
+                scope = self.scopes[self.block_at(rule.start)]
+                root = rule.media is None and rule.selectors == (':root',)
+                if root and scope.root is None:
+                    scope.root = rule
+                for decl in rule.decls:
+                    custom = decl.prop.startswith('--')
+                    if custom:
+                        scope.defs.setdefault(decl.prop, []).append((rule, decl))
+                        if root:
+                            scope.values[decl.prop] = decl.value.strip()
+                    if 'var(' not in decl.value:
+                        continue
+                    for ref in VAR_REF_RE.finditer(decl.value):
+                        scope.uses.append(TokenUse(ref.group(1), rule, decl, bool(ref.group(2))))
+                        if custom:
+                            scope.edges.setdefault(decl.prop, set()).add(ref.group(1))
+
+    def block_at(self, offset):
+        """Name of the page block `offset` lies in."""
+        return self.blocks[bisect.bisect_right(self._starts, offset) - 1][1]
+
+    def defined(self, block, name):
+        """Whether `name` is defined in `block` or in the preamble."""
+        return name in self.scopes[block].defs or name in self.scopes[PREAMBLE].defs
+
+    def _edges(self, block, name):
+        scope = self.scopes[block]
+        if name not in scope.defs:
+            scope = self.scopes[PREAMBLE]
+        return scope.edges.get(name, ())
+
+    def undefined(self, block):
+        """Uses in `block` without a fallback that resolve nowhere."""
+        return [use for use in self.scopes[block].uses
+                if not use.fallback and not self.defined(block, use.name)]
+
+    def reachable(self, block):
+        """Tokens the rules of `block` use, directly or through other tokens."""
+        seen = set()
+        stack = [use.name for use in self.scopes[block].uses if not use.decl.prop.startswith('--')]
+        while stack:
+            name = stack.pop()
+            if name not in seen:
+                seen.add(name)
+                stack.extend(self._edges(block, name))
+        return seen
+
+    def unused(self, block):
+        """Tokens `block` defines that none of its rules use; the
+        preamble's count as used when any page block uses them."""
+        if block == PREAMBLE:
+            used = set().union(*(self.reachable(name) for name in self.scopes))
+        else:
+            used = self.reachable(block)
+        return [name for name in self.scopes[block].defs if name not in used]
+
+    def cycles(self, block):
+        """Reference cycles among the tokens visible in `block`, each as
+        [a, b, …, a]."""
+        names = set(self.scopes[block].defs) | set(self.scopes[PREAMBLE].defs)
+        found = []
+        state = {}                  # token -> 1 while on the path, 2 when done
+
+        def visit(name, path):
+            state[name] = 1
+            path.append(name)
+            for ref in sorted(self._edges(block, name)):
+                if ref not in names:
+                    continue
+                if state.get(ref) == 1:
+                    found.append(path[path.index(ref):] + [ref])
+                elif ref not in state:
+                    visit(ref, path)
+            path.pop()
+            state[name] = 2
+
+        for name in sorted(names):
+            if name not in state:
+                visit(name, [])
+        return found
+
+    def resolved(self, block):
+        """{token: value} for the :root tokens visible in `block`, with
+        var() references substituted (or their fallback, when the token is
+        undefined). A token in a cycle, or one referencing an undefined
+        token without fallback, resolves to None, as it would in CSS."""
+        values = dict(self.scopes[PREAMBLE].values)
+        values.update(self.scopes[block].values)
+        resolved = {}
+
+        def resolve(name, active):
+            if name in resolved:
+                return resolved[name]
+            if name not in values or name in active:
+                return None
+            active = active | {name}
+            resolved[name] = _substitute_vars(values[name], lambda ref: resolve(ref, active))
+            return resolved[name]
+
+        return {name: resolve(name, frozenset()) for name in values}
+
+
+def _substitute_vars(value, lookup):
+    """`value` with each var(--x[, fallback]) replaced by lookup('--x'), or
+    by its fallback when that is None; None if neither resolves."""
+    out = []
+    pos = 0
+    while True:
+        start = value.find('var(', pos)
+        if start < 0:
+            break
+        depth = 0
+        comma = None
+        for end in range(start + 3, len(value)):
+            c = value[end]
+            if c == '(':
+                depth += 1
+            elif c == ')':
+                depth -= 1
+                if not depth:
+                    break
+            elif c == ',' and depth == 1 and comma is None:
+                comma = end
+        else:
+            return None             # var( never closed
+        sub = lookup(value[start + 4:end if comma is None else comma].strip())
+        if sub is None and comma is not None:
+            sub = _substitute_vars(value[comma + 1:end].strip(), lookup)
+        if sub is None:
+            return None
+        out.append(value[pos:start])
+        out.append(sub)
+        pos = end + 1
+    out.append(value[pos:])
+    return ''.join(out)
+
+
+def analyze_tokens(graph):
+    """JSON-ready analysis of `graph`: per page block its token and use
+    counts, undefined references, unused tokens, cycles and resolved
+    values. Blocks that neither define nor use a token are left out."""
+    pages = {}
+    for name, scope in graph.scopes.items():
+        if not scope.defs and not scope.uses:
+            continue
+        pages[name] = {
+            'tokens': len(scope.defs),
+            'uses': len(scope.uses),
+            'undefined': [{'token': use.name,
+                           'line': graph.css.count('\n', 0, use.decl.start) + 1,
+                           'selector': ', '.join(use.rule.selectors),
+                           'property': use.decl.prop}
+                          for use in graph.undefined(name)],
+            'unused': graph.unused(name),
+            'cycles': graph.cycles(name),
+            'resolved': graph.resolved(name),
+        }
+    return {'version': TOKEN_GRAPH_VERSION, 'pages': pages}
+
+
+def load_token_analysis(css, cache_dir=BRIEF_CACHE_DIR):
+    """analyze_tokens() of `css`, building the graph only on a cache miss.
+
+    Returns (analysis, cache path or None). The cache is keyed by the
+    stylesheet's SHA-256 and TOKEN_GRAPH_VERSION, like load_brief's.
+    """
+    digest = hashlib.sha256(css.encode('utf-8')).hexdigest()
+    cache_path = (os.path.join(cache_dir, f'tokens-{digest}-v{TOKEN_GRAPH_VERSION}.json')
+                  if cache_dir else None)
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f), cache_path
+    analysis = analyze_tokens(TokenGraph(css, RuleIndex(css)))
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(analysis, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, cache_path)
+    return analysis, cache_path
+
+
+def report_tokens(css_path, page=None, cache_dir=BRIEF_CACHE_DIR):
+    """--tokens: print the token graph of a stylesheet; with `page`, that
+    block's resolved-value table too. Returns 1 when a reference resolves
+    nowhere or tokens form a cycle, else 0."""
+    with open(css_path, 'r', encoding='utf-8') as f:
+        css = f.read()
+    analysis, cache_path = load_token_analysis(css, cache_dir)
+    pages = analysis['pages']
+    print(f"== Token Graph: {os.path.relpath(css_path, BASE_DIR)} ==")
+    print(f"  {'block':14s} {'tokens':>6} {'uses':>6} {'undefined':>9} {'unused':>6} {'cycles':>6}")
+    for name, info in pages.items():
+        print(f"  {name:14s} {info['tokens']:6d} {info['uses']:6d} {len(info['undefined']):9d} "
+              f"{len(info['unused']):6d} {len(info['cycles']):6d}")
+
+    undefined = [(name, ref) for name, info in pages.items() for ref in info['undefined']]
+    if undefined:
+        print(f"\n  Undefined references ({len(undefined)}):")
+        for name, ref in undefined[:VERIFY_SHOW]:
+            print(f"    line {ref['line']:<6} {name:14s} var({ref['token']}) in "
+                  f"{_short(ref['selector'])} {{ {ref['property']} }}")
+        if len(undefined) > VERIFY_SHOW:
+            print(f"    … {len(undefined) - VERIFY_SHOW} more")
+    unused = [(name, info['unused']) for name, info in pages.items() if info['unused']]
+    if unused:
+        print("\n  Unused tokens:")
+        for name, tokens in unused:
+            print(f"    {name:14s} {', '.join(tokens)}")
+    cycles = [(name, cycle) for name, info in pages.items() for cycle in info['cycles']]
+    if cycles:
+        print(f"\n  Cycles ({len(cycles)}):")
+        for name, cycle in cycles:
+            print(f"    {name:14s} {' -> '.join(cycle)}")
+
+    # Tokens whose value differs between the pages that define them.
+    values = {}
+    for name, info in pages.items():
+        for token, value in info['resolved'].items():
+            values.setdefault(token, {}).setdefault(value, []).append(name)
+    drift = {token: by_value for token, by_value in values.items() if len(by_value) > 1}
+    if drift:
+        print(f"\n  Tokens resolving differently per page ({len(drift)}):")
+        for token, by_value in sorted(drift.items()):
+            print(f"    {token}")
+            for value, names in by_value.items():
+                print(f"      {_short(str(value)):{REPORT_VALUE_WIDTH}s}  {', '.join(names)}")
+
+    if page:
+        if page not in pages:
+            print(f"\n  WARNING: no page block {page!r} (blocks: {', '.join(pages)})")
+        else:
+            print(f"\n  Resolved values in {page}:")
+            for token, value in sorted(pages[page]['resolved'].items()):
+                print(f"    {token:28s} {value if value is not None else '(invalid: undefined or cyclic)'}")
+    if cache_path:
+        print(f"\n  Resolved-value tables per page: {os.path.relpath(cache_path, BASE_DIR)}")
+    return 1 if undefined or cycles else 0
 
-        i += 1
 
-    css = '\n'.join(new_lines)
-
-    # For compact blocks: add --green-dark after --green-lighter: #E8F5E9
-    # ueber-uns and kontakt have: --green-lighter: #E8F5E9;  (as part of inline)
-    # muenchen already has --green-dark: #1B5E20 — update its old value
-    css = css.replace('--green-dark: #1B5E20', '--green-dark: #1B5E20')  # no change needed, value stays
-
-    # Compact blocks: add --green-dark in the semicolon-separated format
-    # Pattern: --green-lighter: #E8F5E9;\n   (end of green group before yellow)
-    # In compact format it's: --green-lighter: #E8F5E9;
-    # followed by --yellow on same line typically
-    # We need to handle: "--green-lighter: #E8F5E9;" → "--green-lighter: #E8F5E9; --green-dark: #1B5E20;"
-    # BUT only when --green-dark is not already present on that line
-
-    lines = css.split('\n')
-    new_lines = []
-    for line in lines:
-        # Only add inline for COMPACT format (line has multiple tokens)
-        if '--green-lighter: #E8F5E9;' in line and '--green-dark' not in line:
-            if line.strip() != '--green-lighter: #E8F5E9;':  # Skip expanded-format lines
-                line = line.replace('--green-lighter: #E8F5E9;', '--green-lighter: #E8F5E9; --green-dark: #1B5E20;')
-                added += 1
-        new_lines.append(line)
-    css = '\n'.join(new_lines)
-
-    # Similarly add --purple-dark to compact blocks that are missing it
-    # ueber-uns already has --purple-dark: #6A1B9A (now #081E52) OK
-    # kontakt already has --purple-dark: #6A1B9A (now #081E52) OK
-    # muenchen already has --purple-dark: #6A1B9A (now #081E52) OK
-
-    print(f"  Added {added} missing tokens")
-    return css
+# ─────────────────────────────────────────────────────────────────
+# PHASE 1: :root token replacements
+# ─────────────────────────────────────────────────────────────────
+@profiled_phase
+def apply_root_token_replacements(buf, rules):
+    """Rewrite custom-property values from the brief's token map.
+
+    Matches declarations by property and value, so expanded and compact
+    :root blocks are handled alike and values other than the brief's
+    current one (already migrated or tuned by hand) are left alone;
+    verification lists the hand-tuned ones. With `override_tokens` in the
+    rule set (--override-tokens) a top-level :root gets the brief's value
+    whatever it held.
+    """
+    print("\n== Phase 1: :root Token Replacements ==")
+    index = buf.index
+    edits = []
+
+    def set_values(token, decls):
+        rule_id = f"{token['id']} {token['name']}"
+        with span('apply_root_token_replacements', rule_id):
+            added = buf.add_all(((decl.value_start, decl.value_end, token['new']) for decl in decls),
+                                f'apply_root_token_replacements / {rule_id}')
+            note(matches=len(added))
+            edits.extend(added)
+
+    override = rules.get('override_tokens', False)
+    for token in rules['tokens']:
+        old = token['old']
+        # Expanded blocks define shadows with a second layer; the brief
+        # lists the first layer as the current value.
+        set_values(token, [decl for rule, decl in index.by_prop.get(token['name'], ())
+                           if decl.value == old or decl.value.startswith(old + ',')
+                           or (override and rule.selectors == (':root',) and rule.media is None)])
+
+    # Tokens the brief calls missing may still exist in some blocks with a
+    # prototype value (compact blocks carry --purple-dark: #6A1B9A).
+    for token in rules['new_tokens']:
+        set_values(token, [decl for rule, decl in index.by_prop.get(token['name'], ())])
+
+    report_changes("Token replacements", buf.source, edits)
+
+
+@profiled_phase
+def add_missing_tokens(buf, rules):
+    """Define brief tokens a page block uses but does not define.
+
+    The token graph of the source lists the var() references that resolve
+    nowhere; references the other phases' edits write (#6A1B9A becomes
+    var(--purple-dark)) count as uses too, which is why this phase runs
+    after them. A missing brief token goes into the block's :root after
+    the last token of its family (--purple-*), or after the last
+    declaration, in the block's own expanded or compact format. Tokens no
+    rule of the block uses are not added.
+    """
+    print("\n== Missing Tokens ==")
+    css = buf.source
+    graph = buf.tokens
+    brief = {t['name']: t['new'] for t in rules['tokens'] + rules['new_tokens']}
+
+    missing = {}                    # block -> {token: None}, in use order
+    for block in graph.scopes:
+        for use in graph.undefined(block):
+            missing.setdefault(block, {})[use.name] = None
+    for edit in list(buf.edits):
+        if 'var(' not in edit.new:
+            continue
+        block = graph.block_at(edit.start)
+        for ref in VAR_REF_RE.finditer(edit.new):
+            if not ref.group(2) and not graph.defined(block, ref.group(1)):
+                missing.setdefault(block, {})[ref.group(1)] = None
+
+    edits = []
+    for block, names in missing.items():
+        root = graph.scopes[block].root
+        for name in brief:
+            if name not in names:
+                continue
+            if root is None or not root.decls:
+                # Text before the first banner is also where a --stream
+                # chunk that starts mid-block puts the rest of that block;
+                # its :root went out with an earlier chunk. Verification
+                # flags a reference that stays undefined either way.
+                if block != PREAMBLE:
+                    print(f"  WARNING: {block} uses var({name}) but has no :root to define it in")
+                continue
+            family = name[:name.rfind('-') + 1]
+            anchor = root.decls[-1]
+            if len(family) > 2:
+                anchor = next((decl for decl in reversed(root.decls)
+                               if decl.prop.startswith(family)), anchor)
+            edits.append(insert_after(css, anchor, f"{name}: {brief[name]};"))
+
+    edits = buf.add_all(edits, 'add_missing_tokens')
+    note(matches=len(edits), lines=len(edits))
+    print(f"  Added {len(edits)} missing tokens")
 
 
 # ─────────────────────────────────────────────────────────────────
 # PHASE 2: Global Safe Replacements
 # ─────────────────────────────────────────────────────────────────
-def apply_global_safe_replacements(css):
+GLOBAL_SAFE_REPLACEMENTS = {
+    # Button hover translateY
+    'translateY(-2px)': 'translateY(-1px)',
+    # Card hover translateY
+    'translateY(-4px)': 'translateY(-3px)',
+    # H1 font-size: 42px → 40px (all 4 instances)
+    'font-size: 42px': 'font-size: 40px',
+    # Hardcoded hex values
+    'background: #1B5E20;': 'background: var(--green-dark);',
+    'background: #6A1B9A;': 'background: var(--purple-dark);',
+}
+# One scan for all of them. The strings share no text, so the scan finds
+# what a replace per string would; edits are recorded against the source,
+# so a replacement is never rescanned (--check-idempotent checks that no
+# replacement writes another's input).
+GLOBAL_SAFE_RE = re.compile('|'.join(map(re.escape, GLOBAL_SAFE_REPLACEMENTS)))
+
+# H2 section headings: 32px → 28px
+# CAREFUL: not all 32px are H2 headings — some are step-numbers, timeline-year, etc.
+# We need contextual replacement, not global
+# Skip this here, handle in Phase 4
+
+
+@profiled_phase
+def apply_global_safe_replacements(buf):
     """Replace values that only appear in their intended context."""
     print("\n== Phase 2: Global Safe Replacements ==")
-    before = css
 
-    # Button hover translateY
-    css = css.replace('translateY(-2px)', 'translateY(-1px)')
+    edits = rewrite(buf, GLOBAL_SAFE_RE, lambda m: GLOBAL_SAFE_REPLACEMENTS[m.group(0)],
+                    'apply_global_safe_replacements', 'replacements')
 
-    # Card hover translateY
-    css = css.replace('translateY(-4px)', 'translateY(-3px)')
+    print(f"  Global safe replacements: {changed_lines(buf.source, edits)} lines changed")
 
-    # H1 font-size: 42px → 40px (all 4 instances)
-    css = css.replace('font-size: 42px', 'font-size: 40px')
 
-    # H2 section headings: 32px → 28px
-    # CAREFUL: not all 32px are H2 headings — some are step-numbers, timeline-year, etc.
-    # We need contextual replacement, not global
-    # Skip this here, handle in Phase 4
+# ─────────────────────────────────────────────────────────────────
+# PHASE 3 COMPONENT TABLE
+# ─────────────────────────────────────────────────────────────────
+# Phase 3 works on the RuleIndex, which parses expanded and compact
+# (one-line) blocks into the same rule/declaration model. A change names a
+# selector pattern (matched against each selector of a rule), a property
+# and its current and new value, and is applied as an edit of that value's
+# span (values compared by canonical_value, so spacing inside a value
+# doesn't matter); insertions use insert_after, which writes the block's
+# own format.
+# So one entry covers every page, and the rest of each rule stays byte for
+# byte as it was. Every pattern is compiled once, here;
+# check_component_patterns() (--check-patterns) times each one against a
+# backtracking-stress corpus and records the worst case on the entry.
+PAGE_SCOPE = r'\.page-[\w-]+ '
+
+
+class ComponentPattern:
+    """A precompiled Phase 3 pattern and its stress-test results."""
+
+    def __init__(self, name, pattern, sample):
+        self.name = name
+        self.regex = re.compile(pattern)
+        self.sample = sample
+        self.worst_s = None
+        self.worst_input = None
+        self.growth = None
+
+
+COMPONENT_PATTERNS = {}
+
+
+def component_pattern(name, pattern, sample):
+    """Register a pattern; `sample` (text it matches) seeds its stress corpus."""
+    if name in COMPONENT_PATTERNS:
+        raise ValueError(f'component pattern {name!r} registered twice')
+    COMPONENT_PATTERNS[name] = ComponentPattern(name, pattern, sample)
+    return COMPONENT_PATTERNS[name]
+
+
+component_pattern('buttons', PAGE_SCOPE + r'\.btn-(?:primary|secondary)', '.page-engagieren .btn-primary')
+component_pattern('btn-primary', PAGE_SCOPE + r'\.btn-primary', '.page-engagieren .btn-primary')
+component_pattern('btn-secondary', PAGE_SCOPE + r'\.btn-secondary', '.page-engagieren .btn-secondary')
+component_pattern('btn-secondary:hover', PAGE_SCOPE + r'\.btn-secondary:hover',
+                  '.page-engagieren .btn-secondary:hover')
+component_pattern('cards', PAGE_SCOPE + r'\.(?:quick-action|step)-card', '.page-startseite .step-card')
+component_pattern('faq-question', PAGE_SCOPE + r'\.faq-question', '.page-engagieren .faq-question')
+component_pattern('form fields', r'\.page-kontakt \.form-(?:input|select|textarea)',
+                  '.page-kontakt .form-input')
+component_pattern('form fields:focus', r'\.page-kontakt \.form-(?:input|select|textarea):focus',
+                  '.page-kontakt .form-input:focus')
+component_pattern('form textarea', r'\.page-kontakt \.form-textarea', '.page-kontakt .form-textarea')
+component_pattern('form states', r'\.page-kontakt \.form-input\.error', '.page-kontakt .form-input.error')
+component_pattern('hero slider', r'\.page-startseite \.(?:hero-slider|slide)', '.page-startseite .slide')
+component_pattern('slide', r'\.page-startseite \.slide-\d', '.page-startseite .slide-1')
+# A value pattern: the groups are kept, the two alphas replaced.
+component_pattern(
+    'slide gradient',
+    r'(linear-gradient\(135deg,\s*rgba\(\d+,\s*\d+,\s*\d+,\s*)0\.9(\)\s*0%,\s*'
+    r'rgba\(\d+,\s*\d+,\s*\d+,\s*)0\.95(\)\s*100%\))',
+    'linear-gradient(135deg, rgba(236, 99, 3, 0.9) 0%, rgba(243, 144, 20, 0.95) 100%)')
+component_pattern('nav-btn', PAGE_SCOPE + r'\.nav-btn', '.page-engagieren .nav-btn')
+component_pattern('logo-icon', PAGE_SCOPE + r'\.logo-icon', '.page-engagieren .logo-icon')
+component_pattern('footer', PAGE_SCOPE + r'\.footer', '.page-engagieren .footer')
+
+ComponentChange = namedtuple('ComponentChange', 'selector prop old new')
+ComponentInsert = namedtuple('ComponentInsert', 'selector prop value after before')
+
+# `old` is a value, or a value pattern whose match is expanded into `new`.
+COMPONENT_CHANGES = [
+    ComponentChange('buttons', 'padding', 'var(--space-md) var(--space-xl)', '14px 28px'),
+    ComponentChange('btn-primary', 'font-weight', '700', '600'),
+    ComponentChange('btn-secondary', 'border', '2px solid var(--gray-200)', '2px solid var(--gray-300)'),
+    ComponentChange('btn-secondary:hover', 'border-color', 'var(--gray-300)', 'var(--gray-400)'),
+    ComponentChange('faq-question', 'padding', 'var(--space-lg) var(--space-xl)', '20px 24px'),
+    ComponentChange('form fields', 'border', '2px solid var(--gray-200)', '1.5px solid var(--gray-300)'),
+    ComponentChange('form fields', 'border-radius', 'var(--radius-md)', '10px'),
+    ComponentChange('form fields:focus', 'border-color', 'var(--orange-primary)', 'var(--blue-primary)'),
+    ComponentChange('form fields:focus', 'box-shadow', '0 0 0 3px var(--orange-lighter)',
+                    '0 0 0 3px rgba(35,103,154,0.12)'),
+    ComponentChange('hero slider', 'min-height', '420px', '400px'),
+    ComponentChange('slide', 'background', 'slide gradient', r'\g<1>0.88\g<2>0.94\g<3>'),
+    ComponentChange('nav-btn', 'padding', 'var(--space-sm) var(--space-md)', '8px 14px'),
+    ComponentChange('nav-btn', 'border-radius', 'var(--radius-sm)', '8px'),
+    ComponentChange('logo-icon', 'width', '40px', '36px'),
+    ComponentChange('logo-icon', 'height', '40px', '36px'),
+    ComponentChange('logo-icon', 'border-radius', 'var(--radius-md)', '10px'),
+    ComponentChange('footer', 'padding', 'var(--space-3xl) var(--space-lg) var(--space-xl)',
+                    '56px var(--space-lg) var(--space-xl)'),
+]
+# Added to matching rules that don't set the property yet, after the
+# `after` declaration or before the `before` one.
+COMPONENT_INSERTS = [
+    ComponentInsert('btn-primary', 'box-shadow', '0 2px 8px rgba(0,0,0,0.12)', 'cursor', None),
+    ComponentInsert('cards', 'border', '1px solid rgba(31,35,40,0.06)', None, 'box-shadow'),
+]
+# Rules added after the kontakt textarea rule unless they follow it already.
+FORM_STATE_RULES = (
+    '.page-kontakt .form-input.error, .page-kontakt .form-select.error, .page-kontakt .form-textarea.error { border-color: #D32F2F; }',
+    '.page-kontakt .form-input:disabled, .page-kontakt .form-select:disabled, .page-kontakt .form-textarea:disabled { opacity: 0.5; background: var(--gray-50); cursor: not-allowed; }',
+)
+
+
+def _stress_inputs(sample, size):
+    """Inputs of about `size` chars that make body quantifiers backtrack."""
+    decl = 'color: red; '
+    return {
+        'whitespace body': f'{sample} {{' + ' ' * size + '}',
+        'whitespace before match': f'{sample} {{' + ' ' * size + 'box-shadow: none; }',
+        'long body': f'{sample} {{ ' + decl * (size // len(decl)) + '}',
+        'unterminated body': f'{sample} {{' + ' ' * size,
+        'repeated sample': (sample + ' ') * (size // (len(sample) + 1)) + '{ }',
+        'near-miss values': f'{sample} {{ background: linear-gradient(135deg, rgba('
+                            + '1, ' * (size // 3) + '0.9) }',
+    }
 
-    # Hardcoded hex values
-    css = css.replace('background: #1B5E20;', 'background: var(--green-dark);')
-    css = css.replace('background: #6A1B9A;', 'background: var(--purple-dark);')
 
-    count_replacements(before, css, "Global safe replacements")
-    return css
+def check_component_patterns(sizes=(2000, 16000), budget_s=0.01):
+    """Time every registered pattern on the stress corpus.
+
+    Records on each entry the worst time at the largest size, the input
+    that caused it and the growth factor from the smallest to the largest
+    size (about sizes[-1] / sizes[0] when linear). Returns the entries
+    whose worst case exceeds `budget_s`.
+    """
+    slow = []
+    for pattern in COMPONENT_PATTERNS.values():
+        pattern.worst_s, pattern.worst_input, pattern.growth = 0.0, None, 0.0
+        for label in _stress_inputs(pattern.sample, 1):
+            times = []
+            for size in sizes:
+                text = _stress_inputs(pattern.sample, size)[label]
+                start = time.perf_counter()
+                for _ in pattern.regex.finditer(text):
+                    pass
+                times.append(time.perf_counter() - start)
+            if times[-1] > pattern.worst_s:
+                pattern.worst_s, pattern.worst_input = times[-1], label
+            pattern.growth = max(pattern.growth, times[-1] / max(times[0], 1e-7))
+        if pattern.worst_s > budget_s:
+            slow.append(pattern)
+    return slow
+
+
+def report_component_patterns(sizes=(2000, 16000), budget_s=0.01):
+    """Print the worst-case table of check_component_patterns(); 1 if any is slow."""
+    slow = check_component_patterns(sizes, budget_s)
+    print(f"== Phase 3 patterns: worst case at {sizes[-1]} chars (budget {budget_s * 1000:.0f} ms) ==")
+    for p in sorted(COMPONENT_PATTERNS.values(), key=lambda p: -p.worst_s):
+        flag = '  SLOW' if p in slow else ''
+        print(f"  {p.name:24s} {p.worst_s * 1000:8.3f} ms  x{p.growth:6.1f}  {p.worst_input}{flag}")
+    if slow:
+        print(f"\nWARNING: {len(slow)} pattern(s) over budget: {', '.join(p.name for p in slow)}")
+        return 1
+    return 0
+
+
+def component_rules(index, name):
+    """Rules of `index` with a selector the named pattern matches in full."""
+    regex = COMPONENT_PATTERNS[name].regex
+    return [rule for rule in index.rules if any(regex.fullmatch(s) for s in rule.selectors)]
 
 
 # ─────────────────────────────────────────────────────────────────
 # PHASE 3: Component Changes
 # ─────────────────────────────────────────────────────────────────
-def apply_component_changes(css):
-    """Targeted regex replacements for specific components."""
+@profiled_phase
+def apply_component_changes(buf):
+    """Declaration edits for specific components from COMPONENT_CHANGES,
+    COMPONENT_INSERTS and the kontakt form states, located through the
+    shared index in expanded and compact blocks alike."""
     print("\n== Phase 3: Component Changes ==")
-    before = css
-    changes = 0
-
-    # --- BTN-PRIMARY: padding + font-weight + box-shadow ---
-    # Expanded blocks (engagieren, startseite, hilfe-finden, fuer-kommunen)
-    # Change padding from var(--space-md) var(--space-xl) to 14px 28px
-    # Change font-weight 700 → 600 (only in btn-primary, not btn-secondary which is already 600)
-
-    # Pattern: inside .page-XXX .btn-primary { ... } blocks
-    def update_btn_primary_expanded(match):
-        block = match.group(0)
-        # Update padding
-        block = block.replace(
-            'padding: var(--space-md) var(--space-xl);',
-            'padding: 14px 28px;'
-        )
-        # Update font-weight only if it's 700 (btn-primary specific)
-        block = block.replace('font-weight: 700;', 'font-weight: 600;')
-        # Add box-shadow after cursor: pointer; if not already present
-        if 'box-shadow: 0 2px 8px' not in block:
-            block = block.replace(
-                'cursor: pointer;',
-                'cursor: pointer;\n            box-shadow: 0 2px 8px rgba(0,0,0,0.12);'
-            )
-        return block
-
-    # Match expanded btn-primary blocks
-    css = re.sub(
-        r'(\.page-(?:engagieren|startseite|hilfe-finden|fuer-kommunen)\s+\.btn-primary\s*\{[^}]+\})',
-        update_btn_primary_expanded,
-        css
-    )
+    css = buf.source
+    index = buf.index
+    edits = []
+
+    canonical = {}
+
+    def selected(rule, name):
+        return any(COMPONENT_PATTERNS[name].regex.fullmatch(s) for s in rule.selectors)
+
+    def value_of(decl):
+        if decl.value not in canonical:
+            canonical[decl.value] = canonical_value(decl.value)
+        return canonical[decl.value]
+
+    def record(rule_id, found):
+        with span('apply_component_changes', rule_id):
+            added = buf.add_all(found, f'apply_component_changes / {rule_id}')
+            note(matches=len(added), lines=changed_lines(css, added))
+        edits.extend(added)
+
+    for change in COMPONENT_CHANGES:
+        pattern = COMPONENT_PATTERNS.get(change.old)
+        found = []
+        if pattern is None:
+            old = canonical_value(change.old)
+            for rule, decl in index.by_prop.get(change.prop, ()):
+                if value_of(decl) == old and selected(rule, change.selector):
+                    found.append((decl.value_start, decl.value_end, change.new))
+        else:
+            for rule, decl in index.by_prop.get(change.prop, ()):
+                m = pattern.regex.fullmatch(decl.value)
+                if m is not None and selected(rule, change.selector):
+                    found.append((decl.value_start, decl.value_end, m.expand(change.new)))
+        record(f'{change.selector} {change.prop}', found)
+
+    for insert in COMPONENT_INSERTS:
+        found = []
+        anchors = index.by_prop.get(insert.after or insert.before, ())
+        for rule in dict.fromkeys(rule for rule, decl in anchors if selected(rule, insert.selector)):
+            if decl_of(rule, insert.prop) is not None:
+                continue
+            props = [decl.prop for decl in rule.decls]
+            if insert.after in props:
+                anchor = rule.decls[props.index(insert.after)]
+            elif insert.before in props and props.index(insert.before) > 0:
+                anchor = rule.decls[props.index(insert.before) - 1]
+            else:
+                continue
+            found.append(insert_after(css, anchor, f'{insert.prop}: {insert.value};'))
+        record(f'{insert.selector} +{insert.prop}', found)
+
+    # Form error and disabled states go right after the textarea rule.
+    found = []
+    states = COMPONENT_PATTERNS['form states'].regex
+    for rule in component_rules(index, 'form textarea'):
+        if len(rule.selectors) > 1:
+            continue  # the rule shared with the other fields
+        at = index.rules.index(rule) + 1
+        following = index.rules[at] if at < len(index.rules) else None
+        if following is not None and any(states.fullmatch(s) for s in following.selectors):
+            continue
+        line_start = css.rfind('\n', 0, rule.start) + 1
+        indent = css[line_start:rule.start]
+        found.append((rule.body_end + 1, rule.body_end + 1,
+                       ''.join(f'\n{indent}{text}' for text in FORM_STATE_RULES)))
+    record('form states', found)
+
+    print(f"  Component changes: {changed_lines(css, edits)} lines changed")
+
+
+@profiled_phase
+def apply_brief_declarations(buf, rules):
+    """Apply selector-scoped brief rows to declarations still at their
+    current value.
+
+    A row applies to a declaration of its property whose value equals the
+    brief's current value (a literal, or var(--x) for a row naming token x),
+    in rules where some selector ends with the row's selector (e.g.
+    `.page-kontakt .form-input:focus` for `.form-input:focus`). Rows whose
+    declarations already hold the new value are counted as done; rows that
+    match neither value are counted once and left to Phases 3 and 4.
+    """
+    print("\n== Phase 3b: Brief Declaration Edits ==")
+    index = buf.index
+    edits = []
+    applied = done = unmatched = 0
+
+    for row in rules['declarations']:
+        if not row['selector'] or not row['old']:
+            continue
+        props = [row['property']]
+        if row['property'] == 'background-color':
+            props.append('background')
+        rule_id = f"{row['id']} {row['selector']} {row['property']}"
+        in_scope = lambda s, sel=row['selector']: s.endswith(sel)
+        with span('apply_brief_declarations', rule_id):
+            hits = [
+                (decl.value_start, decl.value_end, row['new'])
+                for prop in props
+                for rule, decl in index.find(prop, row['old'], media=row['media'], selector=in_scope)
+            ]
+            added = buf.add_all(hits, f'apply_brief_declarations / {rule_id}')
+            note(matches=len(added))
+        edits.extend(added)
+        if hits:
+            applied += 1
+        elif any(next(index.find(prop, row['new'], media=row['media'], selector=in_scope), None)
+                 for prop in props):
+            done += 1
+        else:
+            unmatched += 1
+
+    print(f"  {applied} brief rows applied, {done} already at the brief value, "
+          f"{unmatched} matched no declaration")
+    report_changes("Brief declaration edits", buf.source, edits)
 
-    # --- BTN-SECONDARY: border + padding ---
-    def update_btn_secondary_expanded(match):
-        block = match.group(0)
-        block = block.replace(
-            'padding: var(--space-md) var(--space-xl);',
-            'padding: 14px 28px;'
-        )
-        block = block.replace(
-            'border: 2px solid var(--gray-200);',
-            'border: 2px solid var(--gray-300);'
-        )
-        return block
-
-    css = re.sub(
-        r'(\.page-(?:engagieren|startseite|hilfe-finden|fuer-kommunen)\s+\.btn-secondary\s*\{[^}]+\})',
-        update_btn_secondary_expanded,
-        css
-    )
 
-    # btn-secondary hover: border-color → var(--gray-400)
-    css = re.sub(
-        r'(\.page-(?:engagieren|startseite|hilfe-finden|fuer-kommunen)\s+\.btn-secondary:hover\s*\{[^}]*)'
-        r'border-color:\s*var\(--gray-300\);',
-        r'\1border-color: var(--gray-400);',
-        css
+# ─────────────────────────────────────────────────────────────────
+# PHASE 4: Typography Changes
+# ─────────────────────────────────────────────────────────────────
+# Selector hints are tested against each selector of the rule that owns
+# the declaration, so a long rule can't push its own selector out of view
+# and a neighbouring rule's selector can't leak in.
+HEADING_HINTS = (
+    'section-header',
+    'section-title',
+    'cta-card h2',
+    'cta-section h2',
+    'mission-content h2',
+    'vorteile-header',
+    'staedte-header',
+    'tabs-header',
+    '-header h2',
+    '-header h3',
+    '-title h2',
+)
+# 32px is also used by non-heading elements (icons, years, step numbers)
+# and by hero H1s, which have their own mobile treatment below.
+NON_HEADING_HINTS = (
+    '.partner-logo',
+    '.timeline-year',
+    '.how-step-number',
+    'hero h1',
+    'hero-city h1',
+)
+BARE_HEADING_RE = re.compile(r'(?:^|[\s>+~])h[23]$')
+HERO_H1_RE = re.compile(r'\.hero(?:-city)? h1$')
+NAV_BTN_RE = re.compile(r'\.nav-btn$')
+BODY_PAGE_RE = re.compile(r'^body\.page-[\w-]+$')
+
+
+def _is_heading_rule(rule):
+    """True if the rule styles an H2/H3-style section heading."""
+    if any(hint in s for s in rule.selectors for hint in NON_HEADING_HINTS):
+        return False
+    return any(
+        any(hint in s for hint in HEADING_HINTS) or BARE_HEADING_RE.search(s)
+        for s in rule.selectors
     )
 
-    # --- CARDS: add border ---
-    # Find card base rules and add border: 1px solid rgba(31,35,40,0.06)
-    # Card classes: .quick-action-card, .step-card, .vorteile-card, .tab-panel cards, etc.
-    # Most have box-shadow: var(--shadow-sm/md) — add border alongside
-    # We'll target rules with 'border-radius: var(--radius-' and 'box-shadow: var(--shadow-'
-    # Actually, too many card types. Let's just add it to the major card containers.
-
-    # Quick action cards
-    css = re.sub(
-        r'(\.page-\w+\s+\.quick-action-card\s*\{[^}]*?)(\s*box-shadow:\s*var\(--shadow-)',
-        r'\1 border: 1px solid rgba(31,35,40,0.06);\2',
-        css
-    )
 
-    # Step cards
-    css = re.sub(
-        r'(\.page-\w+\s+\.step-card\s*\{[^}]*?)(\s*box-shadow:\s*var\(--shadow-)',
-        r'\1 border: 1px solid rgba(31,35,40,0.06);\2',
-        css
-    )
+@profiled_phase
+def apply_typography_changes(buf):
+    """Contextual typography adjustments per element type.
 
-    # --- FAQ: padding ---
-    # faq-question padding: var(--space-lg) var(--space-xl) → 20px 24px
-    css = css.replace(
-        'padding: var(--space-lg) var(--space-xl);',
-        'padding: 20px 24px;'
-    )
-    # Note: this could match faq-answer-inner too, which has: 0 var(--space-xl) var(--space-lg)
-    # That pattern is different so it won't match.
-
-    # --- FORMS (kontakt only) ---
-    # border: 2px solid var(--gray-200) → 1.5px solid var(--gray-300) for form inputs
-    css = css.replace(
-        '.page-kontakt .form-input, .page-kontakt .form-select, .page-kontakt .form-textarea { width: 100%; padding: var(--space-md); border: 2px solid var(--gray-200); border-radius: var(--radius-md);',
-        '.page-kontakt .form-input, .page-kontakt .form-select, .page-kontakt .form-textarea { width: 100%; padding: var(--space-md); border: 1.5px solid var(--gray-300); border-radius: 10px;'
-    )
+    Every change is located through the shared index and recorded as an
+    offset edit in the buffer.
+    """
+    print("\n== Phase 4: Typography Changes ==")
+    css = buf.source
+    index = buf.index
+    edits = []
+    owner = None
+
+    def add(edit):
+        edit = buf.add(*edit, owner)
+        if edit is not None:
+            edits.append(edit)
+
+    def set_value(decl, value):
+        add((decl.value_start, decl.value_end, value))
+
+    @contextlib.contextmanager
+    def section(rule):
+        nonlocal owner
+        owner = f'apply_typography_changes / {rule}'
+        with span('apply_typography_changes', rule):
+            first = len(edits)
+            yield
+            note(matches=len(edits) - first)
+
+    # --- H2 desktop: 32px → 28px, line-height 1.2 → 1.3 ---
+    with section('h2-desktop'):
+        headings = set()
+        # Desktop sizes only; @media sizes belong to the mobile scale.
+        for rule, decl in index.find('font-size', '32px', media=False):
+            if _is_heading_rule(rule):
+                set_value(decl, '28px')
+                headings.add(rule)
+        for rule, decl in index.find('font-size', '28px', media=False):
+            if _is_heading_rule(rule):
+                headings.add(rule)
+        for rule in headings:
+            line_height = decl_of(rule, 'line-height')
+            if line_height is not None and line_height.value == '1.2':
+                set_value(line_height, '1.3')
+
+    # --- Body line-height: 1.6 → 1.65, letter-spacing: 0.1px ---
+    # 7 body.page-* rules
+    with section('body line-height'):
+        for rule, decl in index.find('line-height', '1.6', selector=BODY_PAGE_RE.match, media=False):
+            set_value(decl, '1.65')
+            if decl_of(rule, 'letter-spacing') is None:
+                add(insert_after(css, decl, 'letter-spacing: 0.1px;'))
 
-    # Form focus: border-color and box-shadow
-    css = css.replace(
-        '.page-kontakt .form-input:focus, .page-kontakt .form-select:focus, .page-kontakt .form-textarea:focus { outline: none; border-color: var(--orange-primary); box-shadow: 0 0 0 3px var(--orange-lighter); }',
-        '.page-kontakt .form-input:focus, .page-kontakt .form-select:focus, .page-kontakt .form-textarea:focus { outline: none; border-color: var(--blue-primary); box-shadow: 0 0 0 3px rgba(35,103,154,0.12); }'
-    )
+    # --- Button letter-spacing: 0.3px ---
+    # Added after font-size: 15px in btn-primary/secondary rules
+    def is_button(selector):
+        return '.btn-primary' in selector or '.btn-secondary' in selector
 
-    # Add form error and disabled states after the form-textarea rule
-    form_error_disabled = """
-        .page-kontakt .form-input.error, .page-kontakt .form-select.error, .page-kontakt .form-textarea.error { border-color: #D32F2F; }
-        .page-kontakt .form-input:disabled, .page-kontakt .form-select:disabled, .page-kontakt .form-textarea:disabled { opacity: 0.5; background: var(--gray-50); cursor: not-allowed; }"""
-
-    if '.form-input.error' not in css:
-        css = css.replace(
-            '.page-kontakt .form-textarea { min-height: 150px; resize: vertical; }',
-            '.page-kontakt .form-textarea { min-height: 150px; resize: vertical; }' + form_error_disabled
-        )
-
-    # --- HERO SLIDER ---
-    # min-height: 420px → 400px
-    css = css.replace('min-height: 420px;', 'min-height: 400px;')
-
-    # Gradient opacity: 0.9 → 0.88, 0.95 → 0.94
-    css = re.sub(
-        r'(\.page-startseite\s+\.slide-\d\s*\{\s*background:\s*linear-gradient\(135deg,\s*rgba\(\d+,\s*\d+,\s*\d+,\s*)0\.9(\)\s*0%,\s*rgba\(\d+,\s*\d+,\s*\d+,\s*)0\.95(\)\s*100%\))',
-        r'\g<1>0.88\g<2>0.94\g<3>',
-        css
-    )
+    with section('button letter-spacing'):
+        for rule, decl in index.find('font-size', '15px', selector=is_button):
+            if decl_of(rule, 'letter-spacing') is None:
+                add(insert_after(css, decl, 'letter-spacing: 0.3px;'))
 
-    # --- NAVIGATION ---
-    # nav-btn border-radius: var(--radius-sm) → 8px, padding: var(--space-sm) var(--space-md) → 8px 14px
-    # Expanded blocks
-    def update_nav_btn_expanded(match):
-        block = match.group(0)
-        block = block.replace('border-radius: var(--radius-sm);', 'border-radius: 8px;')
-        block = block.replace('padding: var(--space-sm) var(--space-md);', 'padding: 8px 14px;')
-        return block
-
-    css = re.sub(
-        r'(\.page-(?:engagieren|startseite|hilfe-finden|fuer-kommunen)\s+\.nav-btn\s*\{[^}]+\})',
-        update_nav_btn_expanded,
-        css
-    )
+    # --- Nav link letter-spacing: 0.2px ---
+    # Added after font-size: 14px in .nav-btn rules (NOT .nav-mehr-btn)
+    with section('nav letter-spacing'):
+        for rule, decl in index.find('font-size', '14px', selector=NAV_BTN_RE.search):
+            if decl_of(rule, 'letter-spacing') is None:
+                add(insert_after(css, decl, 'letter-spacing: 0.2px;'))
+
+    # --- Mobile H1: 32px → 24px, line-height 1.3 ---
+    # Hero H1s inside @media blocks were skipped by the heading pass above.
+    with section('hero h1 mobile'):
+        for rule, decl in index.find('font-size', '32px', selector=HERO_H1_RE.search, media=True):
+            set_value(decl, '24px')
+            line_height = decl_of(rule, 'line-height')
+            if line_height is None:
+                add(insert_after(css, decl, 'line-height: 1.3;'))
+            elif line_height.value != '1.3':
+                set_value(line_height, '1.3')
+
+    # Still open from the brief (need per-selector review first):
+    # H2 mobile: 24px → 21px, H3 mobile: 18px → 17px,
+    # H4 desktop: 18px → 16px + weight 700 → 600.
+
+    report_changes("Typography changes", css, edits)
 
-    # Compact blocks: nav-btn with inline format
-    # Pattern: padding: var(--space-sm) var(--space-md); border-radius: var(--radius-sm);
-    for page in ['ueber-uns', 'kontakt', 'muenchen']:
-        old_nav = f'.page-{page} .nav-btn {{ display: inline-flex; align-items: center; gap: var(--space-xs); padding: var(--space-sm) var(--space-md); border-radius: var(--radius-sm);'
-        new_nav = f'.page-{page} .nav-btn {{ display: inline-flex; align-items: center; gap: var(--space-xs); padding: 8px 14px; border-radius: 8px;'
-        css = css.replace(old_nav, new_nav)
-
-    # Logo icon: 40px → 36px, border-radius → 10px
-    # Expanded blocks
-    def update_logo_icon_expanded(match):
-        block = match.group(0)
-        block = block.replace('width: 40px;', 'width: 36px;')
-        block = block.replace('height: 40px;', 'height: 36px;')
-        block = block.replace('border-radius: var(--radius-md);', 'border-radius: 10px;')
-        return block
-
-    css = re.sub(
-        r'(\.page-(?:engagieren|startseite|hilfe-finden|fuer-kommunen)\s+\.logo-icon\s*\{[^}]+\})',
-        update_logo_icon_expanded,
-        css
-    )
 
-    # Compact blocks logo-icon
-    for page in ['ueber-uns', 'kontakt', 'muenchen']:
-        css = css.replace(
-            f'.page-{page} .logo-icon {{ width: 40px; height: 40px; background: linear-gradient(135deg, var(--orange-primary), var(--orange-light)); border-radius: var(--radius-md);',
-            f'.page-{page} .logo-icon {{ width: 36px; height: 36px; background: linear-gradient(135deg, var(--orange-primary), var(--orange-light)); border-radius: 10px;'
-        )
-
-    # --- FOOTER ---
-    # padding-top: var(--space-3xl) → 56px
-    # Expanded footer blocks
-    def update_footer_expanded(match):
-        block = match.group(0)
-        block = block.replace(
-            'padding: var(--space-3xl) var(--space-lg) var(--space-xl);',
-            'padding: 56px var(--space-lg) var(--space-xl);'
-        )
-        return block
-
-    css = re.sub(
-        r'(\.page-(?:engagieren|startseite|hilfe-finden|fuer-kommunen)\s+\.footer\s*\{[^}]+\})',
-        update_footer_expanded,
-        css
-    )
+# ─────────────────────────────────────────────────────────────────
+# JAVASCRIPT INDEX
+# ─────────────────────────────────────────────────────────────────
+# One tokenizer pass over the script finds every `const`/`let`/`var`
+# declaration with its value span, wherever it is nested, and the members
+# of object literals assigned to them as dotted names
+# (`const slider = { duration: 6000 }` → slider.duration). Phase 5 looks
+# its constants up here, so formatting of the declaration doesn't matter.
+JsToken = namedtuple('JsToken', 'kind text start end nl')
+JsConstant = namedtuple('JsConstant', 'name value start end')
+
+_JS_TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<name>[A-Za-z_$][\w$]*)
+  | (?P<number>0[xXoObB][\da-fA-F_]+n?|(?:\d[\d_]*\.?[\d_]*|\.\d[\d_]*)(?:[eE][+-]?\d+)?n?)
+  | (?P<string>'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*")
+  | (?P<punct>=>|\.\.\.|\?\?=?|\?\.|\*\*=?|&&=?|\|\|=?|[=!]==?|<<=?|>>>?=?|[<>]=?
+              |[-+*/%&|^]=?|\+\+|--|[{}()\[\];,.:?~!`])
+""", re.S | re.X)
+# A `/` after one of these starts a regex literal, otherwise it divides.
+_JS_REGEX_AFTER = {'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void',
+                   'throw', 'case', 'do', 'else', 'yield', 'await'}
+_JS_DECLARATIONS = {'const', 'let', 'var'}
+
+
+def _js_skip_regex(js, i):
+    """End of the regex literal starting at js[i] == '/'."""
+    i += 1
+    in_class = False
+    while i < len(js) and js[i] != '\n':
+        c = js[i]
+        if c == '\\':
+            i += 1
+        elif c == '[':
+            in_class = True
+        elif c == ']':
+            in_class = False
+        elif c == '/' and not in_class:
+            i += 1
+            while i < len(js) and (js[i].isalnum() or js[i] == '_'):
+                i += 1
+            return i
+        i += 1
+    return i
+
+
+def _js_skip_template(js, i):
+    """End of the template literal starting at js[i] == '`'."""
+    i += 1
+    while i < len(js):
+        c = js[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '`':
+            return i + 1
+        if js.startswith('${', i):
+            depth, i = 1, i + 2
+            while i < len(js) and depth:
+                m = _JS_TOKEN_RE.match(js, i)
+                if m is None:
+                    i += 1
+                    continue
+                if m.group('punct') == '`':
+                    i = _js_skip_template(js, i)
+                    continue
+                text = m.group(0)
+                depth += (text == '{') - (text == '}')
+                i = m.end()
+            continue
+        i += 1
+    return i
+
+
+def tokenize_js(js):
+    """[JsToken] of `js` without whitespace and comments; `nl` is whether
+    a line break precedes the token."""
+    tokens = []
+    i, nl = 0, False
+    while i < len(js):
+        m = _JS_TOKEN_RE.match(js, i)
+        if m is None:
+            tokens.append(JsToken('other', js[i], i, i + 1, nl))
+            i, nl = i + 1, False
+            continue
+        kind, text = m.lastgroup, m.group(0)
+        if kind in ('space', 'comment'):
+            nl = nl or '\n' in text
+            i = m.end()
+            continue
+        end = m.end()
+        if text == '`':
+            kind, end = 'template', _js_skip_template(js, i)
+        elif text in ('/', '/=') and (
+                not tokens
+                or (tokens[-1].kind == 'punct' and tokens[-1].text not in (')', ']', '}'))
+                or (tokens[-1].kind == 'name' and tokens[-1].text in _JS_REGEX_AFTER)):
+            kind, end = 'regex', _js_skip_regex(js, i)
+        tokens.append(JsToken(kind, js[i:end], i, end, nl))
+        i, nl = end, False
+    return tokens
+
+
+def _js_value_end(tokens, i):
+    """Index just past the expression starting at tokens[i]."""
+    depth = 0
+    for j in range(i, len(tokens)):
+        token = tokens[j]
+        if token.kind != 'punct':
+            if (depth == 0 and j > i and token.nl
+                    and (tokens[j - 1].kind != 'punct' or tokens[j - 1].text in (')', ']', '}'))):
+                return j  # automatic semicolon
+            continue
+        if token.text in ('(', '[', '{'):
+            depth += 1
+        elif token.text in (')', ']', '}'):
+            if depth == 0:
+                return j
+            depth -= 1
+        elif depth == 0 and token.text in (';', ','):
+            return j
+    return len(tokens)
+
+
+class JsIndex:
+    """Declarations and object-literal members of a script by name."""
+
+    def __init__(self, js):
+        self.js = js
+        self.tokens = tokenize_js(js)
+        self.constants = {}
+        tokens = self.tokens
+        for i in range(len(tokens) - 2):
+            if (tokens[i].kind == 'name' and tokens[i].text in _JS_DECLARATIONS
+                    and tokens[i + 1].kind == 'name' and tokens[i + 2].text == '='):
+                self._add(tokens[i + 1].text, i + 3)
+
+    def _add(self, name, i):
+        tokens = self.tokens
+        if i >= len(tokens):
+            return len(tokens)
+        end = _js_value_end(tokens, i)
+        if end > i:
+            start, stop = tokens[i].start, tokens[end - 1].end
+            self.constants.setdefault(name, []).append(
+                JsConstant(name, self.js[start:stop], start, stop))
+        if tokens[i].text == '{' and tokens[i].kind == 'punct':
+            self._add_members(name, i)
+        return end
+
+    def _add_members(self, prefix, i):
+        """Record the `key: value` members of the object literal at tokens[i]."""
+        tokens = self.tokens
+        j = i + 1
+        while j < len(tokens) and tokens[j].text != '}':
+            key = tokens[j]
+            if (key.kind in ('name', 'string', 'number') and j + 1 < len(tokens)
+                    and tokens[j + 1].text == ':'):
+                name = key.text.strip('\'"') if key.kind == 'string' else key.text
+                j = self._add(f'{prefix}.{name}', j + 2)
+            else:
+                j = _js_value_end(tokens, j)
+            if j < len(tokens) and tokens[j].text == ',':
+                j += 1
+
+    def find(self, name):
+        """[JsConstant] declared as `name` (dotted for object members)."""
+        return self.constants.get(name, [])
+
+
+def js_literal(value):
+    """(text, quote) of a JS value: a string literal's contents and its
+    quote character, anything else as written with quote ''."""
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '\'"':
+        return value[1:-1], value[0]
+    return value, ''
 
-    # Compact footer blocks
-    for page in ['ueber-uns', 'kontakt', 'muenchen']:
-        css = css.replace(
-            f'.page-{page} .footer {{ background: var(--gray-900); color: var(--white); padding: var(--space-3xl) var(--space-lg) var(--space-xl); }}',
-            f'.page-{page} .footer {{ background: var(--gray-900); color: var(--white); padding: 56px var(--space-lg) var(--space-xl); }}'
-        )
 
-    count_replacements(before, css, "Component changes")
-    return css
+# ─────────────────────────────────────────────────────────────────
+# PHASE 5: JavaScript Changes
+# ─────────────────────────────────────────────────────────────────
+@profiled_phase
+def apply_js_changes(buf, rules):
+    """Update constants in shared-scripts.js (slide duration) through a
+    JsIndex of its declarations."""
+    print("\n== Phase 5: JavaScript Changes ==")
+    with span('apply_js_changes', 'JsIndex'):
+        index = JsIndex(buf.source)
+        note(matches=sum(len(found) for found in index.constants.values()))
+    for change in rules['js']:
+        name, old, new = change['name'], change['old'], change['new']
+        with span('apply_js_changes', f"{change['id']} {name}"):
+            found = index.find(name)
+            note(matches=len(found))
+        values = {js_literal(c.value)[0] for c in found}
+        if not found:
+            print(f"  WARNING: {name} declaration not found!")
+        elif len(values) > 1:
+            print(f"  WARNING: {name} is declared {len(found)} times with different values; left unchanged")
+        elif values == {new}:
+            print(f"  {name}: already {new} OK")
+        elif values != {old}:
+            print(f"  WARNING: {name} is {values.pop()}, brief expects {old}; left unchanged")
+        else:
+            for constant in found:
+                quote = js_literal(constant.value)[1]
+                buf.add(constant.start, constant.end, f'{quote}{new}{quote}', f'apply_js_changes / {name}')
+            note(lines=len(found))
+            print(f"  {name}: {old} -> {new} OK")
 
 
 # ─────────────────────────────────────────────────────────────────
-# PHASE 4: Typography Changes
+# PAGE BLOCKS + INCREMENTAL MANIFEST
 # ─────────────────────────────────────────────────────────────────
-def apply_typography_changes(css):
-    """Contextual typography adjustments per element type."""
-    print("\n== Phase 4: Typography Changes ==")
-    before = css
-
-    # --- H2 desktop: 32px → 28px ---
-    # We need to be selective. The 32px values that ARE H2 section headings:
-    # Lines with patterns like: section-header h2, .vorteile-header h2, heading h2, etc.
-    # Also direct ".page-xxx .section h2 { font-size: 32px }" patterns
-    # For the expanded blocks, font-size: 32px appears in section title contexts
-    # For compact blocks, it's inline
-
-    # Context-aware: replace font-size: 32px only in rules that are clearly H2/heading contexts
-    # Match: .page-XXX .XXX-header h2/h3 { ... font-size: 32px ... }
-    # Match: .page-XXX .section-title { ... font-size: 32px ... }
-    # Match standalone expanded lines where the previous selector suggests heading context
-
-    # Let's identify the specific line numbers from our analysis:
-    # Line 1067: engagieren CTA h2 → 28px OK
-    # Line 2318: startseite section header → 28px OK
-    # Line 3708: hilfe-finden section header → 28px OK
-    # Line 4497, 4535: fuer-kommunen section headers → 28px OK
-    # Line 4918: fuer-kommunen section header → 28px OK
-    # Line 5271: fuer-kommunen responsive (inside @media) → handle in mobile
-    # Line 5559: ueber-uns .mission-content h2 → 28px OK
-    # Line 5576: ueber-uns .section-header h3 → 28px OK
-    # Line 5609: ueber-uns .partner-logo font-size: 32px → NOT a heading, skip
-    # Line 5621: ueber-uns .cta-card h2 → 28px OK
-    # Line 5656: ueber-uns .timeline-year → NOT a heading, skip
-    # Line 5671: ueber-uns responsive hero h1 → NOT H2, skip
-    # Line 5883: kontakt .section-header h3 → 28px OK
-    # Line 5925: kontakt responsive hero h1 → NOT H2, skip
-    # Line 6106: muenchen .how-step-number → NOT a heading, skip
-    # Line 6203: muenchen responsive hero h1 → NOT H2, skip
-
-    # Strategy: use regex to match heading-context selectors containing font-size: 32px
-
-    # For expanded blocks: find font-size: 32px on its own line, check previous lines for heading selector
-    lines = css.split('\n')
-    new_lines = []
-    # Track open selector context
-    for i, line in enumerate(lines):
-        modified = False
-
-        if 'font-size: 32px' in line:
-            # Check if this is a heading context by looking at preceding selector
-            # Look back up to 15 lines for the opening selector
-            context = '\n'.join(lines[max(0, i-15):i+1])
-
-            # Skip known non-heading contexts
-            skip_patterns = [
-                '.partner-logo',
-                '.timeline-year',
-                '.how-step-number',
-                'hero h1',
-                '.hero h1',
-                'hero-city h1',
-            ]
-            should_skip = any(p in context for p in skip_patterns)
-
-            # Identify heading contexts
-            heading_patterns = [
-                'section-header',
-                'section-title',
-                'cta-card h2',
-                'cta-section h2',
-                'mission-content h2',
-                'vorteile-header',
-                'staedte-header',
-                'tabs-header',
-                '-header h2',
-                '-header h3',
-                '-title h2',
-                'h2 {',
-                'h3 {',
-            ]
-            is_heading = any(p in context for p in heading_patterns)
-
-            if is_heading and not should_skip:
-                line = line.replace('font-size: 32px', 'font-size: 28px')
-                modified = True
-
-        new_lines.append(line)
-
-    css = '\n'.join(new_lines)
-
-    # Also update line-height: 1.2 -> 1.3 for H2 heading contexts
-    # Use line-by-line: if a line has font-size: 28px AND line-height: 1.2 (compact), fix it
-    # For expanded blocks, line-height: 1.2 is on a separate line near font-size: 28px
-    lines = css.split('\n')
-    new_lines = []
-    for i, line in enumerate(lines):
-        # Compact format: both on same line
-        if 'font-size: 28px' in line and 'line-height: 1.2' in line:
-            line = line.replace('line-height: 1.2', 'line-height: 1.3')
-        # Expanded format: line-height: 1.2 on its own line, near a font-size: 28px line
-        elif 'line-height: 1.2' in line:
-            # Look nearby (within 5 lines) for font-size: 28px
-            context = '\n'.join(lines[max(0, i-5):min(len(lines), i+5)])
-            if 'font-size: 28px' in context:
-                # Make sure this is a heading context, not hero h1
-                heading_ctx = '\n'.join(lines[max(0, i-15):i+1])
-                skip = any(p in heading_ctx for p in ['.partner-logo', '.timeline-year', '.how-step-number', 'hero h1', 'hero-city h1'])
-                heading = any(p in heading_ctx for p in ['section-header', 'cta-card', 'mission-content', '-header h2', '-header h3'])
-                if heading and not skip:
-                    line = line.replace('line-height: 1.2', 'line-height: 1.3')
-        new_lines.append(line)
-    css = '\n'.join(new_lines)
-
-    # --- Body line-height: 1.6 → 1.65 ---
-    # 7 body.page-* rules
-    for page in ['engagieren', 'startseite', 'hilfe-finden', 'fuer-kommunen', 'ueber-uns', 'kontakt', 'muenchen']:
-        # Expanded format
-        css = css.replace(
-            f'body.page-{page} {{\n            font-family: var(--font-body);\n            color: var(--gray-900);\n            background: var(--gray-50);\n            line-height: 1.6;',
-            f'body.page-{page} {{\n            font-family: var(--font-body);\n            color: var(--gray-900);\n            background: var(--gray-50);\n            line-height: 1.65;\n            letter-spacing: 0.1px;'
-        )
-        # Compact format
-        css = css.replace(
-            f'body.page-{page} {{ font-family: var(--font-body); color: var(--gray-900); background: var(--gray-50); line-height: 1.6;',
-            f'body.page-{page} {{ font-family: var(--font-body); color: var(--gray-900); background: var(--gray-50); line-height: 1.65; letter-spacing: 0.1px;'
-        )
+# The manifest records, per page block, the hash of the text a run read
+# and the hash of the text it wrote, plus one digest of the rule set and
+# of this script. A block whose current text still hashes to its recorded
+# output under the same digest is exactly what the last run produced and
+# is skipped: the phases are idempotent (see --check-idempotent), so
+# running them again could only rewrite it to itself. Each stylesheet has
+# its own manifest, so a repeated --css run is as cheap as one on
+# shared-styles.css.
+MANIFEST_PATH = os.path.join(BRIEF_CACHE_DIR, 'manifest.json')
+MANIFEST_VERSION = 1
+
+PAGE_BANNER_RE = re.compile(r'/\* =+[ \t]*\r?\n[ \t]*PAGE: ')
+PAGE_BANNER_SCOPE_RE = re.compile(r'Scoped to body\.page-([\w-]+)')
+PREAMBLE = '_preamble'
+
+
+def split_page_blocks(css):
+    """Split the stylesheet at its `PAGE:` banner comments.
+
+    Returns [(name, text)] in file order with ''.join(texts) == css. Text
+    before the first banner is PREAMBLE (omitted when empty); each page
+    block is named after the `Scoped to body.page-<name>` banner line.
+    """
+    starts = [m.start() for m in PAGE_BANNER_RE.finditer(css)]
+    bounds = [0] + starts + [len(css)]
+    blocks = []
+    for i, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        text = css[start:end]
+        if i == 0:
+            if text:
+                blocks.append((PREAMBLE, text))
+            continue
+        banner_end = text.find('*/')
+        scope = PAGE_BANNER_SCOPE_RE.search(text, 0, banner_end if banner_end >= 0 else len(text))
+        blocks.append((scope.group(1) if scope else f'block-{i}', text))
+    return blocks
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def rules_digest(rules):
+    """Digest of the compiled rule set and of the phase code applying it."""
+    h = hashlib.sha256(json.dumps(rules, sort_keys=True).encode('utf-8'))
+    with open(os.path.abspath(__file__), 'rb') as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+
+def manifest_path(css_path):
+    """Manifest of `css_path`: MANIFEST_PATH for shared-styles.css, else
+    one named after a hash of the stylesheet's path."""
+    css_path = os.path.abspath(css_path)
+    if css_path == os.path.abspath(CSS_PATH):
+        return MANIFEST_PATH
+    key = hashlib.sha256(css_path.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(BRIEF_CACHE_DIR, f'manifest-{key}.json')
+
+
+def load_manifest(path=MANIFEST_PATH):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if manifest.get('version') == MANIFEST_VERSION else {}
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def plan_css_phases(css, rules):
+    """EditBuffer with the edits of phases 1-4 over `css` recorded."""
+    buf = EditBuffer(css)
+    apply_root_token_replacements(buf, rules)
+    apply_global_safe_replacements(buf)
+    apply_component_changes(buf)
+    apply_brief_declarations(buf, rules)
+    apply_typography_changes(buf)
+    # Last: it defines the tokens the other phases' output uses.
+    add_missing_tokens(buf, rules)
+    return buf
+
+
+def run_css_phases(css, rules):
+    """Phases 1-4 over a stylesheet or any run of whole page blocks.
+
+    The phases record edits against `css`; the result is built once.
+    Returns (css, lines) with `lines` the changed_lines() of the edits.
+    """
+    buf = plan_css_phases(css, rules)
+    edits = buf.resolve()
+    buf.report_conflicts()
+    return splice(css, [edit[:3] for edit in edits]), changed_lines(css, edits)
+
+
+def plan_js_phase(js, rules):
+    """EditBuffer with the Phase 5 edits over shared-scripts.js recorded."""
+    buf = EditBuffer(js)
+    apply_js_changes(buf, rules)
+    return buf
+
+
+def run_js_phase(js, rules):
+    """Phase 5 over shared-scripts.js."""
+    buf = plan_js_phase(js, rules)
+    js = buf.text()
+    buf.report_conflicts()
+    return js
 
-    # --- Button letter-spacing: 0.3px ---
-    # Add letter-spacing: 0.3px after font-size: 15px in btn-primary/secondary blocks
-    # Use line-by-line approach to avoid regex backtracking
-    lines = css.split('\n')
-    new_lines = []
-    for i, line in enumerate(lines):
-        new_lines.append(line)
-        if line.strip() == 'font-size: 15px;' and 'letter-spacing' not in line:
-            # Check context for btn-primary or btn-secondary selector (expanded blocks only)
-            context = '\n'.join(lines[max(0, i-12):i+1])
-            if '.btn-primary' in context or '.btn-secondary' in context:
-                indent = line[:len(line) - len(line.lstrip())]
-                new_lines.append(indent + 'letter-spacing: 0.3px;')
-    css = '\n'.join(new_lines)
 
-    # --- Nav link letter-spacing: 0.2px ---
-    # Add letter-spacing: 0.2px after font-size: 14px in nav-btn blocks (expanded only)
-    lines = css.split('\n')
-    new_lines = []
-    for i, line in enumerate(lines):
-        new_lines.append(line)
-        # Only match expanded lines (font-size: 14px on its own line, not compact)
-        if line.strip() == 'font-size: 14px;' and 'letter-spacing' not in line:
-            context = '\n'.join(lines[max(0, i-12):i+1])
-            # Match .nav-btn but NOT .nav-mehr-btn
-            if re.search(r'\.nav-btn\s*\{', context) and '.nav-mehr-btn' not in context:
-                indent = line[:len(line) - len(line.lstrip())]
-                new_lines.append(indent + 'letter-spacing: 0.2px;')
-    css = '\n'.join(new_lines)
-    # Compact blocks: add letter-spacing after font-size: 14px in nav-btn
-    for page in ['ueber-uns', 'kontakt', 'muenchen']:
-        css = css.replace(
-            f'.page-{page} .nav-btn {{ display: inline-flex; align-items: center; gap: var(--space-xs); padding: 8px 14px; border-radius: 8px; font-family: var(--font-body); font-weight: 600; font-size: 14px;',
-            f'.page-{page} .nav-btn {{ display: inline-flex; align-items: center; gap: var(--space-xs); padding: 8px 14px; border-radius: 8px; font-family: var(--font-body); font-weight: 600; font-size: 14px; letter-spacing: 0.2px;'
-        )
-
-    # --- Mobile typography changes (inside @media blocks) ---
-    # H1 mobile: find hero H1 rules inside @media (max-width: 768px) blocks
-    # These show as: .page-xxx .hero h1 { font-size: 28px } or similar
-    # Change 28px → 24px for mobile H1, add line-height: 1.3
-
-    # H2 mobile: 24px → 21px (in @media blocks)
-    # H3 mobile: 18px → 17px (in @media blocks)
-
-    # H4 desktop: 18px → 16px, weight 700 → 600 (only H4 rules)
-    # We'll handle these carefully
-
-    # For mobile H1 in @media blocks:
-    # Pattern: inside @media, .page-xxx .hero h1 or hero-city h1 with font-size
-    # Actually let's look at specific patterns:
-    # .page-muenchen .hero-city h1 { font-size: 42px } is desktop (line 6188)
-    # @media block has: .page-muenchen .hero-city h1 { font-size: 32px } (line 6203)
-    # Similarly: .page-ueber-uns .hero h1 { font-size: 32px } in @media (line 5671)
-    # .page-kontakt .hero h1 { font-size: 32px } in @media (line 5925)
-
-    # These 32px in @media are mobile H1 values → change to 24px
-    # BUT we already changed some 32px → 28px in Phase 4 heading context...
-    # We need to handle the ones that are hero H1 mobile specifically
-    # The hero h1 ones were SKIPPED above (skip_patterns has 'hero h1')
-    # So they're still 32px. Let's change them now to 24px.
-
-    # For compact blocks in @media sections, the pattern is:
-    # .page-xxx .hero h1 { font-size: 32px; }
-    for page in ['ueber-uns', 'kontakt']:
-        css = css.replace(
-            f'.page-{page} .hero h1 {{ font-size: 32px;',
-            f'.page-{page} .hero h1 {{ font-size: 24px; line-height: 1.3;'
-        )
-    css = css.replace(
-        '.page-muenchen .hero-city h1 { font-size: 32px;',
-        '.page-muenchen .hero-city h1 { font-size: 24px; line-height: 1.3;'
-    )
+def _transform_block(text, rules, memory=None):
+    """Process-pool worker: run the phases on one block, capturing its log.
+
+    Unless `memory` is None the block is profiled in the worker and its
+    records are returned with the output.
+    """
+    log = io.StringIO()
+    records = None
+    with contextlib.redirect_stdout(log):
+        if memory is None:
+            out, lines = run_css_phases(text, rules)
+        else:
+            with Profiler(memory) as profiler:
+                out, lines = run_css_phases(text, rules)
+            records = profiler.records
+    return out, lines, log.getvalue(), records
+
+
+def _needs_transform(recorded, name, text):
+    """True unless `text` is what the last run wrote for block `name`."""
+    return name not in recorded or recorded[name]['output'] != content_hash(text)
+
+
+def transform_css_blocks(css, rules, previous=None, jobs=1):
+    """Run the CSS phases over the page blocks that need it.
+
+    `previous` is the manifest's block list from the last run under the
+    same rules digest (None forces every block). Every phase scopes its
+    patterns within rules, so whole blocks transform exactly as they would
+    inside the full file. Serially, dirty blocks are joined and run through
+    the phases in one go; with jobs > 1 each block runs in its own worker
+    process and the results are reassembled in file order.
+
+    Returns (css, block_entries, dirty_names, lines) with `lines` the
+    changed_lines() of the phases' edits.
+    """
+    blocks = split_page_blocks(css)
+    recorded = {entry['name']: entry for entry in previous or ()}
+    dirty = [(name, text) for name, text in blocks if _needs_transform(recorded, name, text)]
+    results = {}
+    lines = 0
+    if jobs > 1 and len(dirty) > 1:
+        memory = None if _profiler is None else _profiler.memory
+        with ProcessPoolExecutor(max_workers=min(jobs, len(dirty))) as pool:
+            outputs = list(pool.map(_transform_block, [text for _, text in dirty],
+                                    [rules] * len(dirty), [memory] * len(dirty)))
+        for (name, text), (out, block_lines, log, records) in zip(dirty, outputs):
+            print(f"\n-- block {name} --", end='')
+            print(log, end='')
+            results[name] = (text, out)
+            lines += block_lines
+            for record in records or ():
+                record['block'] = name
+                _profiler.records.append(record)
+    elif dirty:
+        out, lines = run_css_phases(''.join(text for _, text in dirty), rules)
+        out_blocks = split_page_blocks(out)
+        if [name for name, _ in out_blocks] != [name for name, _ in dirty]:
+            raise RuntimeError('phases changed the PAGE: block structure')
+        for (name, text), (_, out) in zip(dirty, out_blocks):
+            results[name] = (text, out)
+
+    texts = []
+    entries = []
+    for name, text in blocks:
+        if name in results:
+            text, out = results[name]
+            entries.append({'name': name, 'input': content_hash(text), 'output': content_hash(out)})
+            texts.append(out)
+        else:
+            entries.append(recorded[name])
+            texts.append(text)
+    return ''.join(texts), entries, [name for name, _ in dirty], lines
+
+
+def plan_css_blocks(css, rules, previous=None):
+    """The edits transform_css_blocks would make, as offsets into `css`.
+
+    The dirty blocks are joined and planned in one go, as in a serial run,
+    and the edits shifted back to where each block sits in `css` (phases
+    edit within rules, so no edit crosses a block). Returns (edits, index,
+    dirty_names) with `index` the RuleIndex the edits can be looked up in.
+    """
+    recorded = {entry['name']: entry for entry in previous or ()}
+    dirty = []
+    shifts = []     # (start in the joined text, start in css)
+    joined = pos = 0
+    for name, text in split_page_blocks(css):
+        if _needs_transform(recorded, name, text):
+            dirty.append((name, text))
+            shifts.append((joined, pos))
+            joined += len(text)
+        pos += len(text)
+    if not dirty:
+        return [], None, []
+
+    buf = plan_css_phases(''.join(text for _, text in dirty), rules)
+    edits = buf.resolve()
+    buf.report_conflicts()
+    if joined == len(css):
+        return edits, buf.index, [name for name, _ in dirty]
+    starts = [start for start, _ in shifts]
+    shifted = []
+    for edit in edits:
+        start, origin = shifts[bisect.bisect_right(starts, edit.start) - 1]
+        shift = origin - start
+        shifted.append(edit._replace(start=edit.start + shift, end=edit.end + shift))
+    return shifted, RuleIndex(css), [name for name, _ in dirty]
+
+
+def report_parallel(css_path, rules, jobs=2):
+    """--check-parallel: transform every block serially and in `jobs`
+    worker processes; 1 unless both outputs are byte-identical.
+
+    A phase that came to depend on state outside its block (or on module
+    state a worker does not share) shows up here as a differing block.
+    """
+    print(f"\n== Parallel Parity (--jobs {jobs}) ==")
+    with open(css_path, 'r', encoding='utf-8') as f:
+        css = f.read()
+    with contextlib.redirect_stdout(io.StringIO()):
+        serial, serial_blocks, *_ = transform_css_blocks(css, rules)
+        parallel, parallel_blocks, *_ = transform_css_blocks(css, rules, jobs=jobs)
+    differ = [a['name'] for a, b in zip(serial_blocks, parallel_blocks) if a != b]
+    if serial == parallel:
+        print(f"  OK serial and parallel output identical ({len(serial_blocks)} page blocks, "
+              f"{len(serial)} chars)")
+        return 0
+    print(f"  FAIL serial and parallel output differ"
+          + (f" in {', '.join(differ)}" if differ else ""))
+    return 1
+
 
-    # For expanded blocks, mobile H1 is inside @media with multi-line format
-    # Patterns like:  font-size: 28px; (mobile hero h1 in engagieren, hilfe-finden, etc.)
-    # Actually let me search for these specifically
-    # In expanded @media blocks, hero H1 mobile might be 28px or other sizes
-    # Let's check the actual @media sections for expanded blocks
+# ─────────────────────────────────────────────────────────────────
+# STREAMING
+# ─────────────────────────────────────────────────────────────────
+# --stream never holds the whole stylesheet: it reads a bounded window,
+# cuts it where brace depth returns to zero (after a top-level rule,
+# @media block or `;` statement) and runs the phases on each run of whole
+# rules. Every phase matches within single rules, so the chunked result
+# equals the in-memory one; a top-level @media block is never split, so
+# its rules keep their context.
+STREAM_WINDOW = 1 << 20
+STREAM_READ_SIZE = 1 << 16
+
+
+def iter_css_chunks(f, window=STREAM_WINDOW):
+    """Yield runs of whole top-level CSS constructs read from text file `f`.
+
+    A chunk is cut once the unread buffer reaches `window` chars (or one
+    read, if that is larger), so it is bounded by the window plus the
+    largest construct; ''.join(chunks) equals the file's text. CSS strings cannot
+    span lines, so tokens are only consumed up to the last newline read;
+    a comment still open there waits for the next read.
+    """
+    buf = ''
+    scan = 0
+    depth = 0
+    cut = 0
+    while True:
+        data = f.read(STREAM_READ_SIZE)
+        buf += data
+        limit = buf.rfind('\n') + 1 if data else len(buf)
+        for m in _CSS_TOKEN_RE.finditer(buf, scan, max(limit, scan)):
+            token = m.group(0)
+            if data and token.startswith('/*') and (len(token) < 4 or not token.endswith('*/')):
+                break
+            if token == '{':
+                depth += 1
+            elif token == '}':
+                depth = max(depth - 1, 0)
+                if depth == 0:
+                    cut = m.end()
+            elif token == ';' and depth == 0:
+                cut = m.end()
+            scan = m.end()
+        else:
+            scan = max(scan, limit)
+
+        if cut and (len(buf) >= window or not data):
+            yield buf[:cut]
+            buf = buf[cut:]
+            scan -= cut
+            cut = 0
+        if not data:
+            if buf:
+                yield buf
+            return
+
+
+def stream_css(in_path, out_path, rules, window=STREAM_WINDOW, review=None, validator=None):
+    """Run phases 1-4 chunk by chunk from `in_path` into `out_path`.
+
+    Phase logs are per chunk, so only warnings are passed through. With
+    `out_path` None nothing is written; each chunk's edits still go to
+    `review` (a FileReview) and its output to `validator`, if given.
+    Returns a stats dict with chunk, char and changed-line totals.
+    """
+    stats = {'chunks': 0, 'changed': 0, 'largest': 0, 'chars_in': 0, 'chars_out': 0,
+             'lines': 0}
+    with open(in_path, 'r', encoding='utf-8') as src, \
+            (open(out_path, 'w', encoding='utf-8') if out_path else contextlib.nullcontext()) as out:
+        for chunk in iter_css_chunks(src, window):
+            log = io.StringIO()
+            with contextlib.redirect_stdout(log):
+                buf = plan_css_phases(chunk, rules)
+                edits = buf.resolve()
+                new = splice(chunk, [edit[:3] for edit in edits])
+                buf.report_conflicts()
+            for line in log.getvalue().splitlines():
+                if 'WARNING' in line:
+                    print(line)
+            if out is not None:
+                out.write(new)
+            if review is not None:
+                review.feed(chunk, edits, buf.index)
+            if validator is not None:
+                validator.feed(new)
+
+            stats['chunks'] += 1
+            stats['largest'] = max(stats['largest'], len(chunk))
+            stats['chars_in'] += len(chunk)
+            stats['chars_out'] += len(new)
+            if new != chunk:
+                stats['changed'] += 1
+                stats['lines'] += changed_lines(chunk, edits)
+    return stats
+
+
+# ─────────────────────────────────────────────────────────────────
+# DRY RUN
+# ─────────────────────────────────────────────────────────────────
+# --dry-run writes nothing. The unified diff and the per-rule report are
+# worked out from the resolved edits: only the lines an edit touches and
+# their context are split out of the source, so a one-line token change
+# in a 300 KB stylesheet costs a few lines, not a difflib pass over both
+# versions. Text is fed in file order, in one piece or chunk by chunk
+# (--stream); a line cut between chunks waits for the rest of it.
+DIFF_CONTEXT = 3
+REPORT_VALUE_WIDTH = 60
+
+Change = namedtuple('Change', 'line block selector old new')
+
+_WORD_RE = re.compile(r'[^\s;:,{}()\[\]=]')
+
+
+def _split_lines(text):
+    """Lines of `text` with their '\\n' (the last one may lack it)."""
+    lines = text.split('\n')
+    last = lines.pop()
+    return [line + '\n' for line in lines] + ([last] if last else [])
+
+
+def _diff_line(prefix, line):
+    if line.endswith('\n'):
+        return prefix + line
+    return prefix + line + '\n\\ No newline at end of file\n'
+
+
+def _diff_range(start, count):
+    """`start,count` of a hunk header (1-based; start is the line before
+    an empty range)."""
+    if count == 1:
+        return str(start)
+    return f'{start - 1 if not count else start},{count}'
+
+
+def _short(text):
+    text = ' '.join(text.split())
+    return text if len(text) <= REPORT_VALUE_WIDTH else text[:REPORT_VALUE_WIDTH - 1] + '…'
+
+
+class FileReview:
+    """Unified diff and per-rule change list of one file's edits.
+
+    feed() takes consecutive pieces of the file with their resolved edits
+    (source order, offsets into the piece) and, for a stylesheet, the
+    piece's RuleIndex to name the rule and declaration each edit touches.
+    Hunks are written to `out` as soon as their trailing context is known.
+    """
+
+    def __init__(self, path, out, context=DIFF_CONTEXT, block=PREAMBLE):
+        self.path = path
+        self.out = out
+        self.context = context
+        self.changes = {}       # owner -> [Change]
+        self.edits = 0
+        self.lines = 0          # changed lines, as changed_lines() counts them
+        self.hunks = 0
+        self._block = block
+        self._read = 1          # line number the next piece starts on
+        self._carry = ''        # unfinished last line of the previous piece
+        self._carry_edits = []
+        self._old = self._new = 1
+        self._lead = []         # unchanged lines before the next hunk
+        self._hunk = None       # [old start, new start, old count, new count, lines]
+        self._pending = []      # unchanged lines after the open hunk's last change
+
+    # -- report ------------------------------------------------------
+
+    def _describe(self, text, index, starts, edit):
+        """(selector, old, new) of an edit: the declaration it changes, or
+        the text around it."""
+        start, end, new = edit[:3]
+        rule = None
+        if index is not None:
+            i = bisect.bisect_right(starts, start) - 1
+            if i >= 0 and start <= index.rules[i].body_end:
+                rule = index.rules[i]
+        selector = ', '.join(rule.selectors) if rule else ''
+        for decl in rule.decls if rule else ():
+            if decl.value_start <= start and end <= decl.value_end:
+                value = text[decl.value_start:decl.value_end]
+                changed = text[decl.value_start:start] + new + text[end:decl.value_end]
+                return selector, f'{decl.prop}: {value}', f'{decl.prop}: {changed}'
+        if start == end or not new:
+            return selector, text[start:end], new
+        # Widen a trimmed edit ('5' -> '6') to the word it sits in.
+        left, right = start, end
+        while left > 0 and _WORD_RE.match(text, left - 1):
+            left -= 1
+        while right < len(text) and _WORD_RE.match(text, right):
+            right += 1
+        return (selector, text[left:right],
+                text[left:start] + new + text[end:right])
+
+    def _record(self, text, edits, index):
+        blocks = [(0, self._block)]
+        for m in PAGE_BANNER_RE.finditer(text):
+            banner_end = text.find('*/', m.end())
+            scope = PAGE_BANNER_SCOPE_RE.search(
+                text, m.end(), banner_end if banner_end >= 0 else len(text))
+            blocks.append((m.start(), scope.group(1) if scope else f'block-{len(blocks)}'))
+        block_starts = [start for start, _ in blocks]
+        rule_starts = [rule.start for rule in index.rules] if index is not None else None
+
+        line, pos = self._read, 0
+        for edit in edits:
+            line += text.count('\n', pos, edit.start)
+            pos = edit.start
+            block = blocks[bisect.bisect_right(block_starts, edit.start) - 1][1]
+            selector, old, new = self._describe(text, index, rule_starts, edit)
+            self.changes.setdefault(edit.owner or '?', []).append(
+                Change(line, block, selector, old, new))
+        self._read = line + text.count('\n', pos)
+        self._block = blocks[-1][1]
+        self.edits += len(edits)
+        self.lines += changed_lines(text, edits)
+
+    def print_report(self):
+        print(f"\n  {self.path}: {self.edits} edits by {len(self.changes)} rules, "
+              f"{self.lines} lines changed, {self.hunks} hunks")
+        for owner, changes in self.changes.items():
+            print(f"  [{owner}]")
+            for change in changes:
+                where = f"    line {change.line:<6} {change.block:14s} "
+                if change.selector:
+                    where += _short(change.selector) + '  '
+                if not change.old:
+                    print(f"{where}+ {_short(change.new)}")
+                elif not change.new:
+                    print(f"{where}- {_short(change.old)}")
+                else:
+                    print(f"{where}{_short(change.old)} → {_short(change.new)}")
+
+    # -- diff --------------------------------------------------------
+
+    def feed(self, text, edits, index=None):
+        """Add the next piece of the file and its edits (Edit tuples)."""
+        self._record(text, edits, index)
+        shift = len(self._carry)
+        text = self._carry + text
+        edits = self._carry_edits + [(s + shift, e + shift, new) for s, e, new, *_ in edits]
+        # Edits on the unfinished last line wait for the rest of it.
+        cut = text.rfind('\n') + 1
+        i = len(edits)
+        while i and (edits[i - 1][0] >= cut or edits[i - 1][1] > cut):
+            i -= 1
+            if edits[i][0] < cut:
+                cut = text.rfind('\n', 0, edits[i][0]) + 1
+        self._carry = text[cut:]
+        self._carry_edits = [(s - cut, e - cut, new) for s, e, new in edits[i:]]
+        self._diff(text, edits[:i], cut)
+
+    def close(self):
+        """Diff the last line and write the final hunk."""
+        self._diff(self._carry, self._carry_edits, len(self._carry))
+        self._carry, self._carry_edits = '', []
+        if self._hunk is not None:
+            self._write_hunk(self._pending[:self.context])
+
+    def _diff(self, text, edits, stop):
+        """Diff text[:stop] (whole lines) under its sorted edits."""
+        pos = 0
+        i = 0
+        while i < len(edits):
+            # Edits sharing a line form one change of whole lines.
+            start = text.rfind('\n', 0, edits[i][0]) + 1
+            parts = []
+            last = end = start
+            while i < len(edits) and (not parts or edits[i][0] < end):
+                s, e, new = edits[i]
+                parts += [text[last:s], new]
+                last = e
+                if e > s and text[e - 1] == '\n':
+                    end = e
+                else:
+                    end = text.find('\n', e, stop)
+                    end = stop if end < 0 else end + 1
+                i += 1
+            parts.append(text[last:end])
+            self._skip_text(text, pos, start)
+            self._change(_split_lines(text[start:end]), _split_lines(''.join(parts)))
+            pos = end
+        self._skip_text(text, pos, stop)
+
+    def _skip_text(self, text, start, stop):
+        """Pass the unchanged whole lines of text[start:stop]."""
+        if start >= stop:
+            return
+        limit = 2 * self.context
+        head_end = start
+        for _ in range(limit):
+            head_end = text.find('\n', head_end, stop) + 1
+            if not head_end:
+                head_end = stop
+                break
+        tail_start = stop - (text[stop - 1] == '\n')
+        for _ in range(self.context):
+            tail_start = text.rfind('\n', start, tail_start)
+            if tail_start < 0:
+                break
+        tail_start = start if tail_start < 0 else tail_start + 1
+        count = text.count('\n', start, stop) + (text[stop - 1] != '\n')
+        self._skip(count, _split_lines(text[start:head_end]), _split_lines(text[tail_start:stop]))
+
+    def _skip(self, count, head, tail):
+        """Pass `count` unchanged lines; `head`/`tail` are the first 2·context
+        and the last context of them."""
+        if self._hunk is not None:
+            if len(self._pending) + count <= 2 * self.context:
+                self._pending += head
+            else:
+                self._write_hunk((self._pending + head)[:self.context])
+                self._lead = (self._pending + tail)[-self.context:]
+                self._pending = []
+        else:
+            self._lead = (self._lead + tail)[-self.context:]
+        self._old += count
+        self._new += count
+
+    def _change(self, old, new):
+        same = 0
+        while same < min(len(old), len(new)) and old[same] == new[same]:
+            same += 1
+        if same:
+            self._skip(same, old[:same], old[:same])
+            old, new = old[same:], new[same:]
+        same = 0
+        while same < min(len(old), len(new)) and old[-1 - same] == new[-1 - same]:
+            same += 1
+        kept = old[len(old) - same:]
+        old, new = old[:len(old) - same], new[:len(new) - same]
+        if old or new:
+            if self._hunk is None:
+                lead = self._lead
+                self._hunk = [self._old - len(lead), self._new - len(lead),
+                              len(lead), len(lead), [_diff_line(' ', line) for line in lead]]
+            else:
+                self._add_context(self._pending)
+            self._pending = []
+            self._lead = []
+            hunk = self._hunk
+            hunk[4] += [_diff_line('-', line) for line in old]
+            hunk[4] += [_diff_line('+', line) for line in new]
+            hunk[2] += len(old)
+            hunk[3] += len(new)
+            self._old += len(old)
+            self._new += len(new)
+        if kept:
+            self._skip(same, kept, kept)
+
+    def _add_context(self, lines):
+        hunk = self._hunk
+        hunk[4] += [_diff_line(' ', line) for line in lines]
+        hunk[2] += len(lines)
+        hunk[3] += len(lines)
+
+    def _write_hunk(self, trailing):
+        self._add_context(trailing)
+        old_start, new_start, old_count, new_count, lines = self._hunk
+        if not self.hunks:
+            self.out.write(f'--- a/{self.path}\n+++ b/{self.path}\n')
+        self.out.write(f'@@ -{_diff_range(old_start, old_count)} '
+                       f'+{_diff_range(new_start, new_count)} @@\n')
+        self.out.writelines(lines)
+        self.hunks += 1
+        self._hunk = None
 
-    # The expanded blocks for engagieren, startseite, hilfe-finden, fuer-kommunen
-    # have @media blocks at their end sections
-    # startseite hero h1 mobile could be different
 
-    # For now, let's handle the known H2 mobile (24px → 21px) pattern
-    # In @media blocks, H2 headings that show font-size: 24px should become 21px
-    # This is tricky — 24px could be other things too
-    # Let's be very specific with selectors
+# ─────────────────────────────────────────────────────────────────
+# IDEMPOTENCY
+# ─────────────────────────────────────────────────────────────────
+# Every phase reads the unmodified source, so within one run no rule sees
+# another rule's output; across runs it does. Each rewrite therefore has a
+# precondition (the value it matches) and a postcondition (the value it
+# writes), and a run is idempotent when no postcondition meets a
+# precondition. The rewrites given as data (brief tokens and rows, the
+# Phase 3 table, the Phase 2 strings) are checked for such chains up front;
+# --check-idempotent proves the whole pipeline, selector logic and inserts
+# included, by running the phases on their own output.
+RuleEffect = namedtuple('RuleEffect', 'rule prop old new')
+
+
+def rule_effects(rules):
+    """RuleEffect of every literal rewrite; `prop` None for Phase 2 strings."""
+    for token in rules['tokens']:
+        yield RuleEffect(f"{token['id']} {token['name']}", token['name'], token['old'], token['new'])
+    for row in rules['declarations']:
+        if row['selector'] and row['old']:
+            yield RuleEffect(f"{row['id']} {row['selector']} {row['property']}",
+                             row['property'], row['old'], row['new'])
+    for change in COMPONENT_CHANGES:
+        if change.old not in COMPONENT_PATTERNS:
+            yield RuleEffect(f'{change.selector} {change.prop}', change.prop, change.old, change.new)
+    for old, new in GLOBAL_SAFE_REPLACEMENTS.items():
+        yield RuleEffect(f'global {old}', None, old, new)
+
+
+def rule_chains(effects):
+    """(a, b) pairs where rule b matches what rule a writes.
+
+    Selector scopes are ignored, so a pair is a run that *may* keep
+    changing, not one that does.
+    """
+    effects = list(effects)
+    by_old = {}
+    for effect in effects:
+        if effect.prop is not None:
+            by_old.setdefault((effect.prop, canonical_value(effect.old)), []).append(effect)
+    strings = [effect for effect in effects if effect.prop is None]
+    chains = []
+    for a in effects:
+        if a.prop is not None:
+            chains += [(a, b) for b in by_old.get((a.prop, canonical_value(a.new)), ())]
+        written = a.new if a.prop is None else f'{a.prop}: {a.new}'
+        chains += [(a, b) for b in strings if b.old in written]
+    return chains
+
+
+def report_rule_chains(rules):
+    """Print a WARNING per chained rule pair; returns the pairs."""
+    chains = rule_chains(rule_effects(rules))
+    for a, b in chains:
+        print(f"  WARNING: {a.rule} writes '{a.new}', which {b.rule} rewrites again "
+              f"— a second run may change it")
+    return chains
+
+
+def check_idempotent(css, js, rules, css_name, js_name):
+    """Run the phases on their own output: run(run(x)) must equal run(x).
+
+    Returns a FileReview per file listing every edit a second run would
+    still make (none when the pipeline is idempotent on this input).
+    """
+    css_review = FileReview(css_name, io.StringIO())
+    js_review = FileReview(js_name, io.StringIO(), block=os.path.basename(js_name))
+    with contextlib.redirect_stdout(io.StringIO()):
+        output, _ = run_css_phases(css, rules)
+        buf = plan_css_phases(output, rules)
+        css_review.feed(output, buf.resolve(), buf.index)
+        output = run_js_phase(js, rules)
+        buf = plan_js_phase(output, rules)
+        js_review.feed(output, buf.resolve())
+    for review in (css_review, js_review):
+        review.close()
+    return css_review, js_review
+
+
+def report_idempotency(css_path, rules):
+    """--check-idempotent: print rule chains and second-run edits; 1 if any."""
+    print("\n== Idempotency ==")
+    with open(css_path, 'r', encoding='utf-8') as f:
+        css = f.read()
+    with open(JS_PATH, 'r', encoding='utf-8') as f:
+        js = f.read()
+    chains = report_rule_chains(rules)
+    reviews = check_idempotent(css, js, rules,
+                               os.path.relpath(css_path, BASE_DIR).replace(os.sep, '/'),
+                               os.path.relpath(JS_PATH, BASE_DIR).replace(os.sep, '/'))
+    edits = sum(review.edits for review in reviews)
+    if edits:
+        print("  Second run would still change:")
+        for review in reviews:
+            if review.edits:
+                review.print_report()
+    else:
+        print("  OK run(run(x)) == run(x) for the stylesheet and the script")
+    print(f"  {len(chains)} chained rule pairs, {edits} second-run edits")
+    return 1 if edits or chains else 0
 
-    # H3 mobile: 18px → 17px
-    # H4: 18px → 16px is also 18px, need context
-    # These are getting very specific, let's handle them via line-level context
 
-    count_replacements(before, css, "Typography changes")
+# ─────────────────────────────────────────────────────────────────
+# CONSOLIDATION
+# ─────────────────────────────────────────────────────────────────
+# --consolidate rewrites the stylesheet as one shared token layer plus the
+# page blocks. :root is global, so the per-page copies were already one
+# layer in effect: the last definition of each token wins everywhere, and
+# that is the value the shared layer keeps. Earlier, different values
+# never applied and are reported as divergences.
+#
+# Page-scoped rules that differ only in their .page-* scope are merged
+# into the first copy's selector list. Each page has one body class, so
+# moving a copy earlier can only change the cascade against the rules of
+# its own page (or unscoped ones) it jumps over. A copy stays put when one
+# of those shares a property family, could tie on specificity and could
+# match the same element of that page (see _page_markup.py). Merging repeats
+# until nothing moves, since a merge can clear the way for another.
+TOKEN_LAYER_BANNER = """/* ================================================================
+   SHARED TOKENS
+   One :root for every page (consolidated from the page blocks)
+   ================================================================ */
+"""
+_PROP_FAMILIES = {
+    'line-height': 'font',
+    'top': 'inset', 'right': 'inset', 'bottom': 'inset', 'left': 'inset',
+    'row-gap': 'gap', 'column-gap': 'gap',
+    'align': 'place', 'justify': 'place',
+    'columns': 'column',
+}
+_SPEC_ID_RE = re.compile(r'#[\w-]+')
+_SPEC_CLASS_RE = re.compile(
+    r'\.[\w-]+|\[[^\]]*\]|(?<!:):(?!before\b|after\b|first-line\b|first-letter\b)[\w-]+')
+_SPEC_TYPE_RE = re.compile(
+    r'(?:^|(?<=[\s>+~]))[a-zA-Z][\w-]*|::[\w-]+|(?<!:):(?:before|after|first-line|first-letter)\b')
+
+
+def _prop_family(prop):
+    """Shorthand family of a property (`border-radius` → `border`)."""
+    prop = prop.lower()
+    if prop.startswith('--'):
+        return prop
+    prop = re.sub(r'^-[a-z]+-', '', prop)
+    head = prop.split('-')[0]
+    return _PROP_FAMILIES.get(prop, _PROP_FAMILIES.get(head, head))
+
+
+def selector_specificity(selector):
+    """(ids, classes, types) of `selector`, or None when it has functional
+    pseudo-classes, whose specificity this does not model."""
+    if '(' in selector:
+        return None
+    return (len(_SPEC_ID_RE.findall(selector)), len(_SPEC_CLASS_RE.findall(selector)),
+            len(_SPEC_TYPE_RE.findall(selector)))
+
+
+def rule_pages(rule):
+    """The .page-* scopes named by a rule's selectors."""
+    return {page for s in rule.selectors for page in PAGE_SCOPE_RE.findall(s)}
+
+
+Cascade = namedtuple('Cascade', 'families important selectors')
+
+
+def rule_cascade(rule):
+    """Property families, !important and (selector, pages, specificity)
+    of a rule: what _may_reorder compares."""
+    return Cascade(
+        frozenset(_prop_family(d.prop) for d in rule.decls),
+        any(d.value.endswith('!important') for d in rule.decls),
+        tuple((s, set(PAGE_SCOPE_RE.findall(s)), selector_specificity(s)) for s in rule.selectors),
+    )
+
+
+def _may_reorder(a, b, page, markup):
+    """Whether swapping two rules (as Cascade) could change what `page` renders."""
+    if not a.families & b.families:
+        return False
+    important = a.important or b.important
+    for selector_a, pages_a, spec_a in a.selectors:
+        if page not in pages_a:
+            continue
+        for selector_b, pages_b, spec_b in b.selectors:
+            if pages_b and page not in pages_b:
+                continue
+            tie = important or spec_a is None or spec_b is None or spec_a == spec_b
+            if tie and may_share_element(markup, page, selector_a, selector_b):
+                return True
+    return False
+
+
+def _block_of(block_starts, offset):
+    """Name of the page block containing `offset` ([(name, start)] sorted)."""
+    i = bisect.bisect_right([start for _, start in block_starts], offset) - 1
+    return block_starts[i][0] if i >= 0 else PREAMBLE
+
+
+def _root_layer(css, index):
+    """Edits that replace the top-level :root rules with one shared layer.
+
+    Returns (edits, stats); stats lists the tokens whose values diverged
+    between page blocks and the ones missing from some of them.
+    """
+    roots = [r for r in index.rules if r.selectors == (':root',) and r.media is None]
+    stats = {'roots': len(roots), 'tokens': 0, 'divergent': [], 'partial': []}
+    if len(roots) < 2:
+        return [], stats
+    block_starts, offset = [], 0
+    for name, text in split_page_blocks(css):
+        block_starts.append((name, offset))
+        offset += len(text)
+    defined = {}        # token -> [(page, value)] in file order
+    for rule in roots:
+        page = _block_of(block_starts, rule.start)
+        for decl in rule.decls:
+            defined.setdefault(decl.prop, []).append((page, decl.value))
+    final = {token: values[-1][1] for token, values in defined.items()}
+
+    # The first :root, with every token set to its final value and the
+    # tokens it lacks appended, becomes the layer.
+    first = roots[0]
+    layer_edits = [(d.value_start, d.value_end, final[d.prop])
+                   for d in first.decls if d.value != final[d.prop]]
+    missing = [token for token in defined if token not in {d.prop for d in first.decls}]
+    if missing and first.decls:
+        layer_edits.append(insert_after(
+            css, first.decls[-1], ' '.join(f'{t}: {final[t]};' for t in missing)))
+    line_start = css.rfind('\n', 0, first.start) + 1
+    layer_start = line_start if not css[line_start:first.start].strip() else first.start
+    layer = splice(css[layer_start:first.body_end + 1],
+                   [(start - layer_start, end - layer_start, new) for start, end, new in layer_edits])
+
+    banner = PAGE_BANNER_RE.search(css)
+    at = banner.start() if banner else layer_start
+    edits = [(at, at, TOKEN_LAYER_BANNER + '\n\n' + layer + '\n\n\n')]
+    edits.extend(rule_removal(css, rule) for rule in roots)
+
+    stats['tokens'] = len(defined)
+    for token, values in defined.items():
+        if len({value for _, value in values}) > 1:
+            stats['divergent'].append((token, values))
+        if len(values) < len(roots):
+            stats['partial'].append((token, [page for page, _ in values]))
+    return edits, stats
+
+
+def _page_rule_key(rule):
+    """Merge key of a page-scoped rule, or None.
+
+    Every selector must name exactly one page; the key is the rule with
+    the pages blanked out, so copies for other pages (or already merged
+    copies) compare equal.
+    """
+    if not rule.decls or rule.page is None:
+        return None
+    if rule.media is not None and not rule.media.startswith('@media'):
+        return None
+    if any(len(PAGE_SCOPE_RE.findall(s)) != 1 for s in rule.selectors):
+        return None
+    return (rule.media,
+            tuple(dict.fromkeys(PAGE_SCOPE_RE.sub('.page-*', s) for s in rule.selectors)),
+            tuple((d.prop, ' '.join(d.value.split())) for d in rule.decls))
+
+
+def _page_rule_merges(css, index, markup):
+    """Edits that merge identical page-scoped rules into their first copy.
+
+    Returns (edits, merged_rules, removed_copies, kept_copies).
+    """
+    groups = {}
+    by_page = {}        # page (None: unscoped) -> rule positions
+    for i, rule in enumerate(index.rules):
+        key = _page_rule_key(rule)
+        if key is not None:
+            groups.setdefault(key, []).append(i)
+        if rule.selectors != (':root',):
+            for page in rule_pages(rule) or (None,):
+                by_page.setdefault(page, []).append(i)
+
+    cascade = {}
+
+    def info(i):
+        if i not in cascade:
+            cascade[i] = rule_cascade(index.rules[i])
+        return cascade[i]
+
+    def blocked(target, i):
+        for page in rule_pages(index.rules[i]):
+            for scope in (page, None):
+                positions = by_page.get(scope, ())
+                for j in positions[bisect.bisect_right(positions, target):
+                                   bisect.bisect_left(positions, i)]:
+                    if _may_reorder(info(i), info(j), page, markup):
+                        return True
+        return False
+
+    edits = []
+    merged = removed = kept = 0
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        target = members[0]
+        moved = [i for i in members[1:] if not blocked(target, i)]
+        kept += len(members) - 1 - len(moved)
+        if not moved:
+            continue
+        first = index.rules[target]
+        selectors = list(first.selectors)
+        for i in moved:
+            selectors.extend(s for s in index.rules[i].selectors if s not in selectors)
+            edits.append(rule_removal(css, index.rules[i]))
+        prelude_end = first.body_start - 1
+        while css[prelude_end - 1].isspace():
+            prelude_end -= 1
+        line_start = css.rfind('\n', 0, first.start) + 1
+        indent = css[line_start:first.start]
+        expanded = '\n' in css[first.start:first.body_end] and not indent.strip()
+        edits.append((first.start, prelude_end,
+                      (',\n' + indent if expanded else ', ').join(selectors)))
+        merged += 1
+        removed += len(moved)
+    return edits, merged, removed, kept
+
+
+@profiled_phase
+def consolidate_css(css, markup=None):
+    """One shared :root layer and merged page-scoped duplicates.
+
+    `markup` (a PageMarkup) lets copies move past rules that cannot match
+    the same element; without it every overlap in property and specificity
+    keeps a copy in place. Prints the divergence report and returns the
+    consolidated stylesheet.
+    """
+    print("\n== Consolidation ==")
+    size = len(css)
+    with span(None, 'token layer'):
+        edits, stats = _root_layer(css, RuleIndex(css))
+        css = splice(css, edits)
+    merged = removed = kept = 0
+    with span(None, 'page rules'):
+        while True:
+            edits, m, r, kept = _page_rule_merges(css, RuleIndex(css), markup)
+            if not edits:
+                break
+            css = splice(css, edits)
+            merged, removed = merged + m, removed + r
+
+    if stats['roots'] > 1:
+        print(f"  :root blocks: {stats['roots']} -> 1 shared layer ({stats['tokens']} tokens)")
+    for token, values in stats['divergent']:
+        seen = {}
+        for page, value in values:
+            seen.setdefault(value, []).append(page)
+        variants = '; '.join(f"{value} ({', '.join(pages)})" for value, pages in seen.items())
+        print(f"  WARNING: {token} diverges: {variants} — keeping {values[-1][1]}")
+    for token, pages in stats['partial']:
+        print(f"  {token}: defined only in {', '.join(pages)} (now shared)")
+    print(f"  Page rules: {removed} copies merged into {merged} shared selectors"
+          + (f", {kept} kept in place (cascade order)" if kept else ""))
+    print(f"  Size: {size} -> {len(css)} chars")
     return css
 
 
 # ─────────────────────────────────────────────────────────────────
-# PHASE 5: JavaScript Changes
+# VERIFICATION
 # ─────────────────────────────────────────────────────────────────
-def apply_js_changes(js):
-    """Update slide duration in shared-scripts.js."""
-    print("\n== Phase 5: JavaScript Changes ==")
-    before = js
-    js = js.replace('const slideDuration = 5000;', 'const slideDuration = 6000;')
-    if before != js:
-        print("  slideDuration: 5000 -> 6000 OK")
-    else:
-        print("  WARNING: slideDuration replacement not found!")
-    return js
+# The output is checked against assertions derived from the brief, in one
+# tokenizer pass (over the whole stylesheet, or chunk by chunk when
+# streaming):
+#   old values    no brief token's prototype color is left in a :root
+#   token values  every :root defines each brief token it has once, and
+#                 not with the brief's current value
+#   var()         every reference resolves in its page block or in the
+#                 preamble shared by all of them (a fallback counts)
+#   structure     every `{` (rules, @media, …) is closed, and nothing more
+# What the brief asks for but no phase owns is listed as a note and does
+# not fail the run: a token value tuned by hand (neither the brief's
+# current nor its new value; --override-tokens replaces it), a prototype
+# color hard-coded in a rule, a reference only another block's :root
+# defines (every :root applies to the whole page).
+_VERIFY_TOKEN_RE = re.compile(r'/\*.*?(?:\*/|\Z)|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|[{}();]', re.S)
+_COMMENT_RE = re.compile(r'/\*.*?(?:\*/|\Z)', re.S)
+HEX_COLOR_RE = re.compile(r'#(?:[0-9a-fA-F]{6}|[0-9a-fA-F]{3})\b')
+VERIFY_CHECKS = ('old values', 'token values', 'var()', 'structure')
+# Failures and notes listed per check; the rest are counted.
+VERIFY_SHOW = 12
+
+Failure = namedtuple('Failure', 'check line block message')
+
+
+def _hex_key(color):
+    """Upper-case #RRGGBB form of a #rgb/#rrggbb color."""
+    digits = color.lstrip('#').upper()
+    return '#' + (''.join(c * 2 for c in digits) if len(digits) == 3 else digits)
+
+
+def _token_value(value):
+    return canonical_value(value).lower()
+
+
+class Validator:
+    """The brief's assertions over an output stylesheet.
+
+    feed() takes the stylesheet whole or as consecutive runs of whole
+    top-level constructs (what iter_css_chunks yields); finish() returns
+    the Failures and fills `notes`. Each declaration is looked at once,
+    when the tokenizer reaches its `;` or `}`.
+    """
+
+    def __init__(self, rules):
+        tokens = rules['tokens'] + rules['new_tokens']
+        new_colors = {_hex_key(t['new']) for t in tokens if HEX_COLOR_RE.fullmatch(t['new'])}
+        # Prototype colors another token now uses are not "left over".
+        self.old_colors = {}
+        for token in rules['tokens']:
+            if HEX_COLOR_RE.fullmatch(token['old']) and _hex_key(token['old']) not in new_colors:
+                self.old_colors.setdefault(_hex_key(token['old']), token['name'])
+        self.expected = {t['name']: t['new'] for t in tokens}
+        self.current = {t['name']: _token_value(t['old']) for t in rules['tokens']}
+        self.failures = []
+        self.notes = []
+        self._root_tokens = {}      # custom property -> first block whose :root defines it
+        self._unresolved = []       # (token, line, block) not defined in its block
+        self.stats = {'blocks': 0, 'roots': 0, 'tokens': 0, 'references': 0, 'at_rules': 0}
+        self._shared = set()        # custom properties of the preamble
+        self._block = PREAMBLE
+        self._scope = self._new_scope()
+        self._stack = []            # ('rule' | '@…', line) of open braces
+        self._root = False          # inside a top-level :root rule
+        self._parens = 0
+        self._line = 1
+
+    @staticmethod
+    def _new_scope():
+        return {'defined': set(), 'roots': 0, 'root_defs': {}, 'refs': []}
+
+    def _fail(self, check, line, message, block=None):
+        self.failures.append(Failure(check, line, block or self._block, message))
+
+    def _note(self, check, line, message, block=None):
+        self.notes.append(Failure(check, line, block or self._block, message))
+
+    def feed(self, css):
+        pos = 0                     # start of the current prelude/declaration
+        counted = 0                 # self._line is the line of offset `counted`
+
+        def line_at(offset):
+            nonlocal counted
+            self._line += css.count('\n', counted, offset)
+            counted = offset
+            return self._line
+
+        for m in _VERIFY_TOKEN_RE.finditer(css):
+            tok = m.group()
+            if tok[0] in '"\'':
+                continue
+            if tok[0] == '/':
+                if len(tok) < 4 or not tok.endswith('*/'):
+                    self._fail('structure', line_at(m.start()), 'comment never closed')
+                elif PAGE_BANNER_RE.match(tok):
+                    scope = PAGE_BANNER_SCOPE_RE.search(tok)
+                    self._end_block()
+                    self._block = scope.group(1) if scope else f'block-{self.stats["blocks"] + 1}'
+                continue
+            if tok == '(':
+                self._parens += 1
+            elif tok == ')':
+                self._parens = max(self._parens - 1, 0)
+            elif tok == ';':
+                if self._parens:
+                    continue
+                if self._stack and self._stack[-1][0] == 'rule':
+                    self._declaration(css[pos:m.start()], line_at(m.start()))
+                pos = m.end()
+            elif tok == '{':
+                prelude = _COMMENT_RE.sub('', css[pos:m.start()]).strip()
+                line = line_at(m.start())
+                if prelude.startswith('@'):
+                    self._stack.append((prelude.split(None, 1)[0], line))
+                    self.stats['at_rules'] += 1
+                else:
+                    self._root = prelude == ':root' and not self._stack
+                    self._scope['roots'] += self._root
+                    self._stack.append(('rule', line))
+                self._parens = 0
+                pos = m.end()
+            else:   # '}'
+                if self._stack and self._stack[-1][0] == 'rule' and css[pos:m.start()].strip():
+                    self._declaration(css[pos:m.start()], line_at(m.start()))
+                if self._stack:
+                    self._stack.pop()
+                else:
+                    self._fail('structure', line_at(m.start()), "'}' closes nothing")
+                self._root = False
+                self._parens = 0
+                pos = m.end()
+        line_at(len(css))
+
+    def _declaration(self, text, line):
+        if '/*' in text:
+            text = _COMMENT_RE.sub('', text)
+        prop, colon, value = text.partition(':')
+        if not colon:
+            return
+        prop, value = prop.strip(), value.strip()
+        scope = self._scope
+        if prop.startswith('--'):
+            scope['defined'].add(prop)
+            if self._root:
+                scope['root_defs'].setdefault(prop, []).append((value, line))
+        if 'var(' in value:
+            for ref in VAR_REF_RE.finditer(value):
+                if not ref.group(2):
+                    scope['refs'].append((ref.group(1), line))
+        if '#' in value:
+            for color in HEX_COLOR_RE.finditer(value):
+                token = self.old_colors.get(_hex_key(color.group()))
+                if token is not None:
+                    (self._fail if self._root else self._note)(
+                        'old values', line, f"{prop}: {color.group()} is the prototype {token}")
+
+    def _end_block(self):
+        """Check the finished page block's tokens and references."""
+        scope = self._scope
+        self.stats['blocks'] += 1
+        self.stats['roots'] += scope['roots']
+        if self._block == PREAMBLE:
+            self._shared = scope['defined']
+        root_defs = scope['root_defs']
+        for name, new in self.expected.items():
+            defs = root_defs.get(name, ())
+            if len(defs) > 1:
+                self._fail('token values', defs[1][1], f"{name} defined {len(defs)}x in :root")
+            for value, line in defs:
+                self.stats['tokens'] += 1
+                value_key = _token_value(value)
+                if value_key == _token_value(new):
+                    continue
+                current = self.current.get(name)
+                if current is None or value_key == current or value_key.startswith(current + ','):
+                    self._fail('token values', line, f"{name}: {value} (brief: {new})")
+                else:
+                    self._note('token values', line, f"{name}: {value} tuned by hand (brief: {new})")
+        for name in root_defs:
+            self._root_tokens.setdefault(name, self._block)
+        for name, line in scope['refs']:
+            self.stats['references'] += 1
+            if name not in scope['defined'] and name not in self._shared:
+                self._unresolved.append((name, line, self._block))
+        self._scope = self._new_scope()
+
+    def finish(self):
+        """End the last block and check that every brace was closed."""
+        self._end_block()
+        for name, line, block in self._unresolved:
+            if name in self._root_tokens:
+                self._note('var()', line, f"var({name}) resolves only through another block's "
+                                          f":root ({self._root_tokens[name]})", block)
+            else:
+                self._fail('var()', line, f"var({name}) is not defined in this block "
+                                          f"or the preamble", block)
+        self._unresolved = []
+        for kind, line in self._stack:
+            self._fail('structure', line, f"{'rule' if kind == 'rule' else kind} block never closed")
+        self._stack = []
+        return self.failures
+
+
+def report_validation(validator):
+    """Print the verification section; returns the number of failures."""
+    failures = validator.finish()
+    stats = validator.stats
+    print("\n-- Verification --")
+    summaries = {
+        'old values': f"no prototype color of the {len(validator.old_colors)} brief colors "
+                      f"left in a :root",
+        'token values': f"{stats['tokens']} brief token definitions in {stats['roots']} :root blocks",
+        'var()': f"{stats['references']} var() references resolve",
+        'structure': f"{stats['at_rules']} @-blocks and every rule balanced",
+    }
+    def show(found):
+        for failure in found[:VERIFY_SHOW]:
+            where = f"line {failure.line}" if failure.line else "-"
+            print(f"    {where:<11} {failure.block:14s} {failure.message}")
+        if len(found) > VERIFY_SHOW:
+            print(f"    … {len(found) - VERIFY_SHOW} more")
+
+    for check in VERIFY_CHECKS:
+        found = [f for f in failures if f.check == check]
+        if found:
+            print(f"  FAIL {check}: {len(found)} problems")
+            show(found)
+        else:
+            print(f"  OK {check}: {summaries[check]}")
+        notes = [n for n in validator.notes if n.check == check]
+        if notes:
+            print(f"  NOTE {check}: {len(notes)} left as they are")
+            show(notes)
+    print(f"  {stats['blocks']} page blocks, {stats['roots']} :root blocks")
+    return len(failures)
 
 
 # ─────────────────────────────────────────────────────────────────
 # MAIN
 # ─────────────────────────────────────────────────────────────────
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--brief', default=BRIEF_PATH,
+                        help='design brief workbook (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='re-parse the workbook instead of using .brief-cache/')
+    parser.add_argument('--full', action='store_true',
+                        help='transform every page block, ignoring the manifest')
+    parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                        help='transform page blocks in N worker processes')
+    parser.add_argument('--profile', nargs='?', const=PROFILE_PATH, metavar='TRACE',
+                        help='time, count and trace allocations per phase and rule; '
+                             'write the trace as JSON (default: .brief-cache/profile.json)')
+    parser.add_argument('--stream', action='store_true',
+                        help='process the stylesheet in bounded chunks of whole rules '
+                             '(no manifest, for very large bundles)')
+    parser.add_argument('--css', default=CSS_PATH,
+                        help='stylesheet to rewrite in place (default: %(default)s)')
+    parser.add_argument('--override-tokens', action='store_true',
+                        help="set every :root brief token to the brief's value, also where "
+                             "it was tuned by hand")
+    parser.add_argument('--consolidate', action='store_true',
+                        help='merge the :root blocks into one token layer and identical '
+                             'page-scoped rules into shared selectors')
+    parser.add_argument('--check-patterns', action='store_true',
+                        help='time every Phase 3 pattern on a backtracking-stress corpus '
+                             'and exit (non-zero when one is over budget)')
+    parser.add_argument('--dry-run', nargs='?', const='-', metavar='PATCH',
+                        help='write nothing; report every change per rule and print a '
+                             'unified diff (or write it to PATCH)')
+    parser.add_argument('--check-idempotent', action='store_true',
+                        help='run the phases on their own output and exit (non-zero when '
+                             'a second run would change anything)')
+    parser.add_argument('--check-parallel', action='store_true',
+                        help='transform the stylesheet serially and with --jobs workers (at '
+                             'least 2) and exit (non-zero unless the outputs are byte-identical)')
+    parser.add_argument('--tokens', nargs='?', const='', metavar='PAGE',
+                        help='report the token graph of the stylesheet (undefined references, '
+                             'unused tokens, cycles) and exit; with PAGE, print its resolved values')
+    args = parser.parse_args(argv)
+    if args.consolidate and args.stream:
+        parser.error('--consolidate needs the whole stylesheet; drop --stream')
+    if args.consolidate and args.dry_run:
+        parser.error('--dry-run reviews the brief edits only; drop --consolidate')
+    css_path = os.path.abspath(args.css)
+    dry_run = args.dry_run is not None
+
+    cache_dir = None if args.no_cache else BRIEF_CACHE_DIR
+
+    def brief():
+        # A wrong or unfilled workbook must not pass as "nothing to do".
+        rules = load_brief(args.brief, cache_dir=cache_dir)
+        if not report_brief(rules):
+            parser.error(f"{os.path.basename(args.brief)} yields no token or declaration "
+                         f"rules — is it the filled brief?")
+        # Part of the rule set, so the manifest digest and the --jobs
+        # workers see it.
+        return dict(rules, override_tokens=True) if args.override_tokens else rules
+
+    if args.check_patterns:
+        return report_component_patterns()
+    if args.check_idempotent:
+        return report_idempotency(css_path, brief())
+    if args.check_parallel:
+        return report_parallel(css_path, brief(), jobs=max(args.jobs, 2))
+    if args.tokens is not None:
+        return report_tokens(css_path, args.tokens, cache_dir=cache_dir)
+
     print("===================================================")
     print("  Applying Design Brief v3 to Helferportal CSS/JS")
     print("===================================================")
 
-    # Read files
-    with open(CSS_PATH, 'r', encoding='utf-8') as f:
-        css = f.read()
+    rules = brief()
+    brief_line = (f"Brief: {rules['source']} ({len(rules['tokens'])} tokens, "
+                  f"{len(rules['declarations'])} declaration rows, {len(rules['js'])} JS constants)")
+    report_rule_chains(rules)
+
     with open(JS_PATH, 'r', encoding='utf-8') as f:
         js = f.read()
-
-    original_css = css
     original_js = js
 
-    print(f"\nCSS file: {len(css)} chars, {css.count(chr(10))} lines")
-    print(f"JS file: {len(js)} chars, {js.count(chr(10))} lines")
-
-    # Apply phases
-    css = apply_root_token_replacements(css)
-    css = add_missing_tokens(css)
-    css = apply_global_safe_replacements(css)
-    css = apply_component_changes(css)
-    css = apply_typography_changes(css)
-    js = apply_js_changes(js)
-
-    # Write files
-    with open(CSS_PATH, 'w', encoding='utf-8') as f:
-        f.write(css)
-    with open(JS_PATH, 'w', encoding='utf-8') as f:
-        f.write(js)
+    validator = Validator(rules)
+
+    # A dry run plans the same edits and reviews them instead of writing.
+    patch = io.StringIO()
+    css_review = FileReview(os.path.relpath(css_path, BASE_DIR).replace(os.sep, '/'), patch)
+    js_review = FileReview(os.path.relpath(JS_PATH, BASE_DIR).replace(os.sep, '/'), patch,
+                           block=os.path.basename(JS_PATH))
+
+    def js_phase(js):
+        if not dry_run:
+            return run_js_phase(js, rules)
+        buf = plan_js_phase(js, rules)
+        edits = buf.resolve()
+        buf.report_conflicts()
+        js_review.feed(js, edits)
+        return splice(js, [edit[:3] for edit in edits])
+
+    if args.stream:
+        print(f"\nCSS file: {os.path.relpath(css_path, BASE_DIR)} (streamed, "
+              f"{STREAM_WINDOW // 1024} KB window)")
+        print(f"JS file: {len(js)} chars, {js.count(chr(10))} lines")
+        print(brief_line)
+        tmp_path = None if dry_run else css_path + '.tmp'
+        with Profiler() if args.profile else contextlib.nullcontext() as profiler:
+            stats = stream_css(css_path, tmp_path, rules,
+                               review=css_review if dry_run else None, validator=validator)
+            js = js_phase(js)
+        print(f"\nStreamed {stats['chunks']} chunks (largest {stats['largest']} chars)")
+        css_changed = stats['changed'] > 0
+        if not dry_run:
+            if css_changed:
+                os.replace(tmp_path, css_path)
+            else:
+                os.remove(tmp_path)
+        total_css_changes = stats['lines']
+        css_chars = (stats['chars_in'], stats['chars_out'])
+    else:
+        with open(css_path, 'r', encoding='utf-8') as f:
+            css = f.read()
+        original_css = css
+
+        print(f"\nCSS file: {len(css)} chars, {css.count(chr(10))} lines")
+        print(f"JS file: {len(js)} chars, {js.count(chr(10))} lines")
+        print(brief_line)
+
+        # Only blocks changed since the last run (or all, if the rules or
+        # the script changed) go through the phases.
+        digest = rules_digest(rules)
+        manifest_file = manifest_path(css_path)
+        manifest = {} if args.full else load_manifest(manifest_file)
+        if manifest.get('rules') != digest:
+            manifest = {}
+        with Profiler() if args.profile else contextlib.nullcontext() as profiler:
+            if dry_run:
+                edits, index, dirty = plan_css_blocks(css, rules, manifest.get('css'))
+                css_review.feed(css, edits, index)
+                css = splice(css, [edit[:3] for edit in edits])
+                blocks = split_page_blocks(css)
+                total_css_changes = css_review.lines
+            else:
+                css, blocks, dirty, total_css_changes = transform_css_blocks(
+                    css, rules, manifest.get('css'), jobs=args.jobs)
+            print(f"\nPage blocks: {len(dirty)}/{len(blocks)} transformed"
+                  + (f" ({', '.join(dirty)})" if dirty else " — all up to date"))
+
+            js_entry = manifest.get('js')
+            if js_entry is None or js_entry['output'] != content_hash(js):
+                js = js_phase(js)
+                js_entry = {'input': content_hash(original_js), 'output': content_hash(js)}
+
+            if args.consolidate:
+                css = consolidate_css(css, load_page_markup(js=js))
+                # Record the consolidated blocks as this run's output.
+                blocks = [{'name': name, 'input': content_hash(text), 'output': content_hash(text)}
+                          for name, text in split_page_blocks(css)]
+
+        # Write files (skipped when the content is unchanged)
+        css_changed = css != original_css
+        if not dry_run:
+            if css_changed:
+                with open(css_path, 'w', encoding='utf-8') as f:
+                    f.write(css)
+            new_manifest = {'version': MANIFEST_VERSION, 'rules': digest, 'css': blocks,
+                            'js': js_entry}
+            if new_manifest != manifest:
+                save_manifest(new_manifest, manifest_file)
+        css_chars = (len(original_css), len(css))
+        validator.feed(css)
+
+    if js != original_js and not dry_run:
+        with open(JS_PATH, 'w', encoding='utf-8') as f:
+            f.write(js)
+    if not css_changed and js == original_js:
+        print("Nothing changed — files left untouched.")
 
     # Summary
-    total_css_changes = sum(1 for a, b in zip(original_css.splitlines(), css.splitlines()) if a != b)
-    total_css_changes += abs(len(css.splitlines()) - len(original_css.splitlines()))
-
     print("\n===================================================")
     print(f"  TOTAL: ~{total_css_changes} CSS lines changed")
-    print(f"  CSS: {len(original_css)} -> {len(css)} chars")
+    print(f"  CSS: {css_chars[0]} -> {css_chars[1]} chars")
     print(f"  JS: {len(original_js)} -> {len(js)} chars")
     print("===================================================")
 
-    # Verification checks
-    print("\n-- Verification --")
-
-    # Check old hex values are gone
-    old_hexes = {
-        '#E65100': '--orange-primary',
-        '#1565C0': '--blue-primary',
-        '#7B1FA2': '--purple-primary',
-        '#FAFAFA': '--gray-50',
-        '#F5F5F5': '--gray-100',
-        '#EEEEEE': '--gray-200',
-        '#E0E0E0': '--gray-300',
-        '#BDBDBD': '--gray-400',
-        '#9E9E9E': '--gray-500',
-        '#757575': '--gray-600',
-        '#616161': '--gray-700',
-        '#424242': '--gray-800',
-        '#212121': '--gray-900',
-    }
-
-    remaining = []
-    for hex_val, name in old_hexes.items():
-        count = css.count(hex_val)
-        if count > 0:
-            remaining.append(f"  WARNING: {hex_val} ({name}) still appears {count}x")
-
-    if remaining:
-        print("  Old hex values remaining:")
-        for r in remaining:
-            print(r)
+    failures = report_validation(validator)
+
+    if profiler is not None:
+        profiler.report()
+        profiler.write(args.profile)
+        print(f"\nProfile trace written to {os.path.relpath(args.profile, BASE_DIR)}")
+
+    if dry_run:
+        css_review.close()
+        js_review.close()
+        print("\n-- Dry run: nothing written --")
+        css_review.print_report()
+        js_review.print_report()
+        if args.dry_run == '-':
+            print()
+            sys.stdout.write(patch.getvalue())
+        else:
+            with open(args.dry_run, 'w', encoding='utf-8', newline='') as f:
+                f.write(patch.getvalue())
+            print(f"\nDiff written to {args.dry_run} (apply with: git apply {args.dry_run})")
+    elif failures:
+        print("\nDone, but the output fails verification. Review with: git diff --stat")
     else:
-        print("  OK All old hex values replaced")
-
-    # Check :root block count
-    root_count = len(re.findall(r':root\s*\{', css))
-    print(f"  :root blocks found: {root_count} (expected 7)")
-
-    # Check new values present
-    new_checks = ['#EC6303', '#23679A', '#0B286D', '#FAFBFC', '#F2F4F6', '#1F2328']
-    for val in new_checks:
-        count = css.count(val)
-        print(f"  {val}: {count} occurrences")
-
-    print("\nDone! Review with: git diff --stat")
+        print("\nDone! Review with: git diff --stat")
+    return 1 if failures else 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
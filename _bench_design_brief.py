@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the design-brief applier on synthetic, scaled stylesheets
+
+The synthetic stylesheet is built from the real page blocks of
+assets/shared-styles.css, so it keeps their structure: expanded and compact
+blocks, one :root per block and the @media sections. It is rewound to the
+prototype: the :root values go back to the brief's "current" values, and
+the Phase 2, 3, 3b and 4 changes are undone (rewind_phases), so every
+phase has real edits to record; the JSON lists each phase's edit count.
+A scale factor S gives 7·S page blocks (cloned as .page-<name>-<n>), and
+S times the brief's token mappings, each defined in every :root block.
+
+The shared RuleIndex build, each phase (recording its edits into a fresh
+EditBuffer over the same source) and the final materialization are timed
+separately (best of --repeat) and measured again under tracemalloc for
+peak memory. Results go to a JSON
+file; --baseline compares against an earlier one and exits non-zero when a
+phase got slower than --tolerance allows.
+
+Run:  python _bench_design_brief.py [--scales 1 10 100] [--baseline old.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import re
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import _apply_design_brief as brief
+
+DEFAULT_OUTPUT = 'bench_results.json'
+
+
+# ─────────────────────────────────────────────────────────────────
+# SYNTHETIC INPUT
+# ─────────────────────────────────────────────────────────────────
+def rewind_tokens(css, rules):
+    """Put the brief's tokens back to their prototype ("current") values
+    and drop the tokens the brief adds. Every top-level :root definition
+    is rewound, also one tuned by hand (the stylesheet's shadows), so
+    Phase 1 has as much to do as on a fresh prototype."""
+    index = brief.RuleIndex(css)
+    edits = []
+    for token in rules['tokens']:
+        for rule, decl in index.by_prop.get(token['name'], ()):
+            root = rule.selectors == (':root',) and rule.media is None
+            if root or decl.value == token['new']:
+                edits.append((decl.value_start, decl.value_end, token['old']))
+    css = brief.splice(css, edits)
+    index = brief.RuleIndex(css)
+    return _remove_decls(css, [decl for token in rules['new_tokens']
+                               for rule, decl in index.by_prop.get(token['name'], ())
+                               if rule.selectors == (':root',)])
+
+
+def _set_values(css, found):
+    """splice() for [(decl, new value)], skipping a declaration seen twice."""
+    edits = {}
+    for decl, value in found:
+        edits.setdefault(decl.value_start, (decl.value_start, decl.value_end, value))
+    return brief.splice(css, list(edits.values()))
+
+
+def _remove_decls(css, decls):
+    """Drop declarations together with the whitespace in front of them."""
+    edits = {}
+    for decl in decls:
+        start = len(css[:decl.start].rstrip())
+        edits.setdefault(decl.start, (start, decl.end, ''))
+    return brief.splice(css, list(edits.values()))
+
+
+def rewind_phases(css, rules):
+    """Undo what Phases 2, 3, 3b and 4 write, last phase first.
+
+    Values the brief already had are rewound too (every `font-size: 40px`
+    becomes 42px), which only gives the phases more to do. The slide
+    gradient is a value pattern, not a literal, and is left as it is.
+    """
+    # Phase 4: headings, body, button and nav letter-spacing, hero H1s.
+    index = brief.RuleIndex(css)
+    found, removed = [], []
+    for rule, decl in index.find('font-size', '28px', media=False):
+        if brief._is_heading_rule(rule):
+            found.append((decl, '32px'))
+            line_height = brief.decl_of(rule, 'line-height')
+            if line_height is not None and line_height.value == '1.3':
+                found.append((line_height, '1.2'))
+    for rule, decl in index.find('line-height', '1.65', selector=brief.BODY_PAGE_RE.match,
+                                 media=False):
+        found.append((decl, '1.6'))
+        removed += [d for d in rule.decls if d.prop == 'letter-spacing' and d.value == '0.1px']
+    for rule, decl in index.find('font-size', '15px',
+                                 selector=lambda s: '.btn-primary' in s or '.btn-secondary' in s):
+        removed += [d for d in rule.decls if d.prop == 'letter-spacing' and d.value == '0.3px']
+    for rule, decl in index.find('font-size', '14px', selector=brief.NAV_BTN_RE.search):
+        removed += [d for d in rule.decls if d.prop == 'letter-spacing' and d.value == '0.2px']
+    for rule, decl in index.find('font-size', '24px', selector=brief.HERO_H1_RE.search, media=True):
+        found.append((decl, '32px'))
+    css = _remove_decls(_set_values(css, found), removed)
+
+    # Phase 3b: literal brief rows.
+    index = brief.RuleIndex(css)
+    found = []
+    for row in rules['declarations']:
+        if row['selector'] and row['old']:
+            for prop in (row['property'], 'background'):
+                found += [(decl, row['old']) for rule, decl in index.find(
+                    prop, row['new'], media=row['media'],
+                    selector=lambda s, sel=row['selector']: s.endswith(sel))]
+    css = _set_values(css, found)
+
+    # Phase 3: component values, inserted declarations and form states.
+    index = brief.RuleIndex(css)
+
+    def selected(rule, name):
+        return any(brief.COMPONENT_PATTERNS[name].regex.fullmatch(s) for s in rule.selectors)
+
+    found, removed = [], []
+    for change in brief.COMPONENT_CHANGES:
+        if change.old in brief.COMPONENT_PATTERNS:
+            continue
+        new = brief.canonical_value(change.new)
+        found += [(decl, change.old) for rule, decl in index.by_prop.get(change.prop, ())
+                  if brief.canonical_value(decl.value) == new and selected(rule, change.selector)]
+    for insert in brief.COMPONENT_INSERTS:
+        removed += [decl for rule, decl in index.by_prop.get(insert.prop, ())
+                    if decl.value == insert.value and selected(rule, insert.selector)]
+    css = _remove_decls(_set_values(css, found), removed)
+    for text in brief.FORM_STATE_RULES:
+        css = re.sub(r'\n[ \t]*' + re.escape(text), '', css)
+
+    # Phase 2: the global strings.
+    for old, new in brief.GLOBAL_SAFE_REPLACEMENTS.items():
+        css = css.replace(new, old)
+    return css
+
+
+def synthetic_tokens(count):
+    """`count` extra token mappings shaped like the brief's color rows."""
+    return [
+        {'id': f'bench!{i}', 'name': f'--bench-token-{i}',
+         'old': f'#{i % 0xFFFFFF:06X}', 'new': f'#{(i * 7919) % 0xFFFFFF:06X}'}
+        for i in range(count)
+    ]
+
+
+def _add_root_tokens(block, tokens):
+    """Append token definitions to the block's :root, in its own format."""
+    index = brief.RuleIndex(block)
+    edits = []
+    for rule in index.rules:
+        if rule.selectors == (':root',) and rule.decls:
+            text = ' '.join(f"{t['name']}: {t['old']};" for t in tokens)
+            edits.append(brief.insert_after(block, rule.decls[-1], text))
+    return brief.splice(block, edits)
+
+
+def build_stylesheet(scale, token_scale, rules):
+    """Return (css, rules) for a synthetic run at the given scale."""
+    with open(brief.CSS_PATH, 'r', encoding='utf-8') as f:
+        real = rewind_tokens(rewind_phases(f.read(), rules), rules)
+    blocks = brief.split_page_blocks(real)
+    preamble = ''.join(text for name, text in blocks if name == brief.PREAMBLE)
+    pages = [(name, text) for name, text in blocks if name != brief.PREAMBLE]
+
+    extra = synthetic_tokens(len(rules['tokens']) * (token_scale - 1))
+    if extra:
+        pages = [(name, _add_root_tokens(text, extra)) for name, text in pages]
+        rules = dict(rules, tokens=rules['tokens'] + extra)
+
+    parts = [preamble]
+    for copy in range(scale):
+        for name, text in pages:
+            if copy:
+                clone = f'{name}-{copy}'
+                text = text.replace(f'page-{name} ', f'page-{clone} ')
+                text = text.replace(f'page-{name}\n', f'page-{clone}\n')
+                text = text.replace(f'page-{name} {{', f'page-{clone} {{')
+            parts.append(text)
+    return ''.join(parts), rules
+
+
+def build_script(scale):
+    """The real script with the pre-brief slide duration, repeated `scale` times."""
+    with open(brief.JS_PATH, 'r', encoding='utf-8') as f:
+        js = f.read()
+    js = js.replace('const slideDuration = 6000;', 'const slideDuration = 5000;')
+    return js * scale
+
+
+# ─────────────────────────────────────────────────────────────────
+# MEASUREMENT
+# ─────────────────────────────────────────────────────────────────
+CSS_PHASES = [
+    ('apply_root_token_replacements', lambda b, r: brief.apply_root_token_replacements(b, r)),
+    ('apply_global_safe_replacements', lambda b, r: brief.apply_global_safe_replacements(b)),
+    ('apply_component_changes', lambda b, r: brief.apply_component_changes(b)),
+    ('apply_brief_declarations', lambda b, r: brief.apply_brief_declarations(b, r)),
+    ('apply_typography_changes', lambda b, r: brief.apply_typography_changes(b)),
+    ('add_missing_tokens', lambda b, r: brief.add_missing_tokens(b, r)),
+]
+
+
+def _quiet(fn, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args)
+
+
+def measure(fn, repeat):
+    """Best-of-`repeat` wall time, then one tracemalloc run for peak memory."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = _quiet(fn)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    try:
+        _quiet(fn)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return out, best, peak
+
+
+def run_scale(scale, token_scale, rules, repeat):
+    css, scaled_rules = build_stylesheet(scale, token_scale, rules)
+    js = build_script(scale)
+    result = {
+        'scale': scale,
+        'token_scale': token_scale,
+        'pages': sum(1 for name, _ in brief.split_page_blocks(css) if name != brief.PREAMBLE),
+        'token_mappings': len(scaled_rules['tokens']),
+        'css_bytes': len(css.encode('utf-8')),
+        'js_bytes': len(js.encode('utf-8')),
+        'phases': [],
+    }
+    print(f"\n== Scale {scale}x (tokens {token_scale}x): {result['pages']} pages, "
+          f"{result['token_mappings']} token mappings, {result['css_bytes'] / 1e6:.1f} MB CSS ==")
+
+    def step(name, size, fn, edits=None):
+        out, wall, peak = measure(fn, repeat)
+        entry = {
+            'phase': name,
+            'wall_s': round(wall, 6),
+            'peak_bytes': peak,
+            'mb_per_s': round(size / 1e6 / wall, 3) if wall else None,
+        }
+        if edits is not None:
+            entry['edits'] = edits(out)
+        result['phases'].append(entry)
+        rate = 'n/a' if entry['mb_per_s'] is None else f"{entry['mb_per_s']:.2f}"
+        print(f"  {name:32s} {wall * 1000:9.1f} ms  {peak / 1e6:8.1f} MB peak  "
+              f"{rate:>8s} MB/s" + (f"  {entry['edits']:7d} edits" if edits else ''))
+        return out
+
+    def run_phase(fn):
+        buf = brief.EditBuffer(css, index=index)
+        fn(buf, scaled_rules)
+        return buf
+
+    index = step('RuleIndex', result['css_bytes'], lambda: brief.RuleIndex(css))
+    for name, fn in CSS_PHASES:
+        step(name, result['css_bytes'], lambda: run_phase(fn), edits=lambda buf: len(buf.edits))
+
+    final = brief.EditBuffer(css, index=index)
+    for name, fn in CSS_PHASES:
+        _quiet(fn, final, scaled_rules)
+    step('materialize', result['css_bytes'], final.text)
+
+    def run_js():
+        buf = brief.EditBuffer(js)
+        brief.apply_js_changes(buf, scaled_rules)
+        buf.text()
+        return buf
+
+    step('apply_js_changes', result['js_bytes'], run_js, edits=lambda buf: len(buf.edits))
+    total = sum(p['wall_s'] for p in result['phases'])
+    result['total_wall_s'] = round(total, 6)
+    result['total_mb_per_s'] = round(result['css_bytes'] / 1e6 / total, 3) if total else None
+    print(f"  {'total':32s} {total * 1000:9.1f} ms")
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Print per-phase ratios against a baseline run; return the regressions."""
+    previous = {
+        (r['scale'], r['token_scale'], p['phase']): p['wall_s']
+        for r in baseline.get('results', ()) for p in r['phases']
+    }
+    regressions = []
+    print(f"\n== Compared with baseline ({baseline.get('created', '?')}) ==")
+    for r in results:
+        for p in r['phases']:
+            key = (r['scale'], r['token_scale'], p['phase'])
+            if key not in previous or not previous[key]:
+                continue
+            ratio = p['wall_s'] / previous[key]
+            flag = ''
+            if ratio > 1 + tolerance:
+                flag = '  REGRESSION'
+                regressions.append((key, ratio))
+            print(f"  {r['scale']:>4}x {p['phase']:32s} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10],
+                        help='page-count multipliers to run (default: 1 10)')
+    parser.add_argument('--token-scale', type=int, default=None,
+                        help='token-mapping multiplier (default: same as each scale)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timing runs per phase; the best is kept (default: 3)')
+    parser.add_argument('--brief', default=brief.BRIEF_PATH,
+                        help='design brief workbook (default: %(default)s)')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT,
+                        help='JSON results file (default: %(default)s)')
+    parser.add_argument('--baseline', help='earlier JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown vs. baseline before failing (default: 0.25)')
+    args = parser.parse_args(argv)
+
+    rules = brief.load_brief(args.brief)
+    results = [
+        run_scale(scale, args.token_scale or scale, rules, args.repeat)
+        for scale in args.scales
+    ]
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'brief': rules.get('source'),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} phase(s) slower than baseline by more than "
+                  f"{args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
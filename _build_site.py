@@ -0,0 +1,1504 @@
+# -*- coding: utf-8 -*-
+"""
+Build the deployable Helferportal site into dist/
+
+The HTML pages, CNAME and assets/ are copied into the output directory
+and rewritten there; the sources stay as the design brief applier left
+them. Stages:
+
+  css:  one stylesheet per page, assets/css/<page>.css, cut out of the
+        consolidated shared-styles.css by .page-* scope (unscoped rules
+        go to every page). The rules that can style the page's first
+        screen (header, menus, hero: everything up to the end of the first
+        <section>) are inlined as critical CSS and the page stylesheet is
+        loaded without blocking rendering. Selectors that no element of
+        the page (or that the script names) can match are pruned first.
+  js:   one script per page, assets/js/<page>.js, made of the modules of
+        shared-scripts.js (split at its // ==== banners) that find an
+        element on the page; pages that run the same modules share one
+        script, assets/js/bundle-<n>.js.
+  font: the Google Fonts families, subset to the characters and weights
+        the site uses, self-hosted from font files supplied in fonts/
+        (with fontTools); @font-face rules and preloads replace the
+        Google Fonts links.
+  min:  .min.css/.min.js for every stylesheet and script, which the pages
+        then load.
+  logo: PNG and WebP logos at 1× and 2× their rendered height (with
+        Pillow), loaded through <picture>/srcset instead of the
+        full-size PNGs.
+  img:  remote <img>s served from responsive JPEG/PNG and WebP copies of
+        originals saved in image-cache/ (with Pillow), with srcset,
+        sizes, width/height and lazy loading outside the hero;
+        image-variants.json maps each URL to its copies.
+  hash: every file under assets/ renamed to <name>.<hash>.<ext> and the
+        references in pages, stylesheets and scripts rewritten, so assets
+        can be served with immutable, year-long caching.
+  gz:   .gz (.br with the brotli module) siblings for the pages and the
+        text assets they load; sizes before and after go to
+        asset-sizes.json.
+
+Run:  python _build_site.py [--out dist] [--no-critical] [--no-prune] [--keep REGEX]
+                            [--no-split-js] [--fonts DIR] [--no-minify] [--no-logos]
+                            [--image-cache DIR] [--no-fingerprint]
+"""
+
+import argparse
+import bisect
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+from collections import namedtuple
+from html.parser import HTMLParser
+
+import _apply_design_brief as brief
+import _page_markup as page_markup
+
+DEFAULT_OUT = os.path.join(brief.BASE_DIR, 'dist')
+SHARED_CSS = 'assets/shared-styles.css'
+PAGE_CSS = 'assets/css/{page}.css'
+# Left in every output directory; only a directory holding it is replaced.
+BUILD_MARKER = '.site-build'
+
+
+# ─────────────────────────────────────────────────────────────────
+# SITE
+# ─────────────────────────────────────────────────────────────────
+def _within(path, folder):
+    """Whether `path` is `folder` or lies in it (both real paths)."""
+    return os.path.commonpath([path, folder]) == folder
+
+
+class Site:
+    """The output tree: site-relative path → content.
+
+    Content is str (written as UTF-8), bytes, or None for a file copied
+    unchanged from the source tree. `sources` holds, for files a stage
+    derived from another one (minified, renamed), the size of the file
+    they were made from.
+    """
+
+    def __init__(self, root=brief.BASE_DIR):
+        self.root = root
+        self.files = {}
+        self.sources = {}
+        self.markup = None
+
+    @classmethod
+    def load(cls, root=brief.BASE_DIR):
+        site = cls(root)
+        for name in sorted(os.listdir(root)):
+            if name.endswith('.html') or name == 'CNAME':
+                site.files[name] = None
+        for folder, _, names in os.walk(os.path.join(root, 'assets')):
+            for name in sorted(names):
+                rel = os.path.relpath(os.path.join(folder, name), root).replace(os.sep, '/')
+                site.files[rel] = None
+        site.markup = page_markup.load_page_markup(root, js=site.text('assets/shared-scripts.js'))
+        return site
+
+    def text(self, rel):
+        content = self.files[rel]
+        if content is None:
+            with open(os.path.join(self.root, rel), 'r', encoding='utf-8') as f:
+                return f.read()
+        return content.decode('utf-8') if isinstance(content, bytes) else content
+
+    def data(self, rel):
+        content = self.files[rel]
+        if content is None:
+            with open(os.path.join(self.root, rel), 'rb') as f:
+                return f.read()
+        return content if isinstance(content, bytes) else content.encode('utf-8')
+
+    def page_path(self, page):
+        """Site-relative path of a page's HTML file."""
+        return os.path.relpath(self.markup.pages[page], self.root).replace(os.sep, '/')
+
+    def pages(self):
+        return [self.page_path(page) for page in self.markup.pages]
+
+    def referenced(self):
+        """Files of the site the pages reference by /path, sorted."""
+        found = set()
+        for rel in self.pages():
+            for m in re.finditer(r'(?<=["\'(\s,])/([\w./-]+)', self.text(rel)):
+                if m.group(1) in self.files:
+                    found.add(m.group(1))
+        return sorted(found)
+
+    def check_out(self, out_dir, inputs=()):
+        """Why `out_dir` must not be replaced by a build, or None: it is,
+        holds or lies in the source tree's assets or one of `inputs`
+        (the site root may hold it), or it is a directory with files
+        that an earlier build did not write."""
+        out = os.path.realpath(out_dir)
+        root = os.path.realpath(self.root)
+        folders = [os.path.join(root, 'assets')] + [os.path.realpath(f) for f in inputs]
+        for folder in [root] + folders:
+            if _within(folder, out):
+                return f"{out_dir} holds the input directory {folder}"
+        for folder in folders:
+            if _within(out, folder):
+                return f"{out_dir} lies in the input directory {folder}"
+        if os.path.isdir(out) and os.listdir(out) and not os.path.isfile(os.path.join(out, BUILD_MARKER)):
+            return f"{out_dir} is not empty and has no {BUILD_MARKER} from an earlier build"
+        return None
+
+    def write(self, out_dir, inputs=()):
+        """Replace `out_dir` with the site; returns the number of files.
+        Raises ValueError when check_out refuses the directory."""
+        problem = self.check_out(out_dir, inputs)
+        if problem:
+            raise ValueError(f"refusing to replace {problem}")
+        if os.path.isdir(out_dir):
+            shutil.rmtree(out_dir)
+        os.makedirs(out_dir)
+        with open(os.path.join(out_dir, BUILD_MARKER), 'w', encoding='utf-8') as f:
+            f.write('Written by _build_site.py; the next build replaces this directory.\n')
+        for rel, content in self.files.items():
+            path = os.path.join(out_dir, *rel.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if content is None:
+                shutil.copyfile(os.path.join(self.root, rel), path)
+            elif isinstance(content, bytes):
+                with open(path, 'wb') as f:
+                    f.write(content)
+            else:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+        return len(self.files)
+
+
+# ─────────────────────────────────────────────────────────────────
+# PER-PAGE STYLESHEETS
+# ─────────────────────────────────────────────────────────────────
+# A page's stylesheet keeps the unscoped rules and the selectors that name
+# its own .page-* scope, in file order. No other page's selector can match
+# its elements (one body class per page), so the page renders exactly as
+# with the whole file. Consolidation runs first so the stylesheet holds
+# one :root layer with the values the last :root block used to win with.
+_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+_CSS_BLOCK_TOKEN_RE = re.compile(r'/\*.*?(?:\*/|\Z)|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|[{};]', re.S)
+
+
+def at_rule_blocks(css):
+    """Top-level @-blocks (@media, @keyframes, …) as (prelude, start, end).
+
+    `start` is at the '@', `end` just past the block's closing '}'.
+    """
+    blocks = []
+    depth = 0
+    prelude_start = 0
+    open_block = None
+    for m in _CSS_BLOCK_TOKEN_RE.finditer(css):
+        tok = m.group()
+        if tok[0] in '/"\'':
+            if depth == 0 and not css[prelude_start:m.start()].strip():
+                prelude_start = m.end()
+            continue
+        if tok == '{':
+            raw = css[prelude_start:m.start()]
+            if depth == 0 and raw.strip().startswith('@'):
+                open_block = (raw.strip(), prelude_start + len(raw) - len(raw.lstrip()))
+            depth += 1
+        elif tok == '}':
+            depth = max(depth - 1, 0)
+            if depth == 0 and open_block is not None:
+                blocks.append((open_block[0], open_block[1], m.end()))
+                open_block = None
+        if depth == 0 or tok != ';':
+            prelude_start = m.end()
+    return blocks
+
+
+def select_selectors(css, index, choose):
+    """Edits that keep, of each rule, the selectors `choose(rule)` returns.
+
+    Returning all of them leaves the rule as it is, none removes it. An
+    @-block left without rules is removed whole. Returns (edits, spans of
+    the removed @-blocks).
+    """
+    edits = []
+    removed = set()
+    for i, rule in enumerate(index.rules):
+        keep = choose(rule)
+        if not keep:
+            edits.append(page_markup.rule_removal(css, rule))
+            removed.add(i)
+        elif len(keep) < len(rule.selectors):
+            prelude = css[rule.start:rule.body_start - 1].rstrip()
+            line_start = css.rfind('\n', 0, rule.start) + 1
+            separator = ',\n' + css[line_start:rule.start] if '\n' in prelude else ', '
+            edits.append((rule.start, rule.start + len(prelude), separator.join(keep)))
+
+    starts = [rule.start for rule in index.rules]
+    dropped = []
+    for prelude, start, end in at_rule_blocks(css):
+        inside = range(bisect.bisect_left(starts, start), bisect.bisect_left(starts, end))
+        if inside and all(i in removed for i in inside):
+            edits = [e for e in edits if not start <= e[0] < end]
+            edits.append((start, end, ''))
+            dropped.append((start, end))
+    return edits, dropped
+
+
+def _tidy(css):
+    """Collapse the blank-line runs that removed rules leave behind."""
+    return re.sub(r'\n[ \t]*(?:\n[ \t]*)+\n', '\n\n', css)
+
+
+def page_stylesheet(css, page, index=None):
+    """The rules of `css` that can apply on `page`, trimmed to its selectors."""
+    index = index or brief.RuleIndex(css)
+
+    def own(rule):
+        if not brief.rule_pages(rule):
+            return rule.selectors
+        return [s for s in rule.selectors
+                if page in brief.PAGE_SCOPE_RE.findall(s) or not brief.PAGE_SCOPE_RE.search(s)]
+
+    edits, dropped = select_selectors(css, index, own)
+    starts = [rule.start for rule in index.rules]
+
+    # Other pages' comments (banners, section titles) go too.
+    blocks, offset = [], 0
+    for name, text in brief.split_page_blocks(css):
+        if name not in (page, brief.PREAMBLE):
+            blocks.append((offset, offset + len(text)))
+        offset += len(text)
+    for m in _COMMENT_RE.finditer(css):
+        if not any(lo <= m.start() < hi for lo, hi in blocks):
+            continue
+        if any(lo <= m.start() < hi for lo, hi in dropped):
+            continue
+        i = bisect.bisect_right(starts, m.start()) - 1
+        if i >= 0 and m.start() < index.rules[i].body_end:
+            continue
+        edits.append((m.start(), m.end(), ''))
+    return _tidy(brief.splice(css, edits))
+
+
+# ─────────────────────────────────────────────────────────────────
+# UNUSED SELECTORS
+# ─────────────────────────────────────────────────────────────────
+# A selector is kept while each of its compounds can match some element
+# of its page, or of any page when it names no .page-* scope
+# (page_markup.selector_compounds/element_matches: tags, ids and
+# classes of the HTML, plus every name the script uses as a string, such
+# as the classes it toggles). Attribute selectors, pseudo-classes and
+# combinators are not checked, so pruning can only keep too much. Rules
+# inside @keyframes are never touched. Selectors matching a --keep
+# pattern always stay.
+PRUNE_KEEP = (
+    r'\.(?:active|open|error)\b',     # state classes, error is for form validation
+)
+
+
+def prune_stylesheet(css, elements, dynamic, keep=PRUNE_KEEP):
+    """Drop the selectors of `css` that no element can match.
+
+    `elements` is {page: [Element]}. Returns (css, dropped selectors).
+    """
+    index = brief.RuleIndex(css)
+    everywhere = [element for page_elements in elements.values() for element in page_elements]
+    keep_re = re.compile('|'.join(f'(?:{k})' for k in keep)) if keep else None
+    matched = {}
+    dropped = []
+
+    def used(selector):
+        if selector not in matched:
+            scope = brief.PAGE_SCOPE_RE.findall(selector)
+            candidates = elements.get(scope[0], everywhere) if len(scope) == 1 else everywhere
+            matched[selector] = (
+                (keep_re is not None and keep_re.search(selector) is not None)
+                or all(any(page_markup.element_matches(element, compound, dynamic)
+                           for element in candidates)
+                       for compound in page_markup.selector_compounds(selector)))
+        return matched[selector]
+
+    def choose(rule):
+        if rule.media is not None and not rule.media.startswith('@media'):
+            return rule.selectors
+        kept = [s for s in rule.selectors if used(s)]
+        dropped.extend(s for s in rule.selectors if s not in kept)
+        return kept
+
+    edits, _ = select_selectors(css, index, choose)
+    return _tidy(brief.splice(css, edits)), dropped
+
+
+# ─────────────────────────────────────────────────────────────────
+# CRITICAL CSS
+# ─────────────────────────────────────────────────────────────────
+# A rule is critical when one of its selectors can match an element of
+# the page's first screen: the subject that element, and the compounds
+# before it its ancestors or earlier siblings (page_markup.chain_matches,
+# which is looser than the selector). `.footer a` is not critical although
+# the header has links, nor is the content of the mega menu and the other
+# containers the stylesheet hides until a script opens them. Of :root
+# only the custom properties those rules reference are inlined. The page
+# stylesheet that loads afterwards repeats every rule in the same order,
+# so once it has loaded the page renders exactly as with the stylesheet
+# alone.
+_KEYFRAMES_RE = re.compile(r'@keyframes\s+([\w-]+)')
+
+
+def hidden_elements(index, elements, parents):
+    """Elements the stylesheet hides until a script opens them: under
+    every media query that styles them the last static rule leaves
+    `display: none` or `visibility: hidden` (overlays, drawers, modals)."""
+    state = {}          # (element, media) -> {'display': ..., 'visibility': ...}
+    for rule in index.rules:
+        if rule.media is not None and not rule.media.startswith('@media'):
+            continue
+        decls = [d for d in rule.decls if d.prop in ('display', 'visibility')]
+        if not decls:
+            continue
+        chains = [page_markup.selector_chain(s) for s in rule.selectors]
+        for number in range(len(elements)):
+            if any(page_markup.chain_matches(chain, number, elements, parents) for chain in chains):
+                props = state.setdefault((number, rule.media), {})
+                for decl in decls:
+                    props[decl.prop] = decl.value.replace('!important', '').strip()
+    media = {}
+    for (number, query), props in state.items():
+        media.setdefault(number, {})[query] = (props.get('display') == 'none'
+                                               or props.get('visibility') == 'hidden')
+    return {number for number, queries in media.items()
+            if None in queries and all(queries.values())}
+
+
+def critical_tokens(rules):
+    """The custom properties the non-:root rules reference, followed
+    through the :root values that reference further tokens."""
+    edges = {}
+    pending = []
+    for rule in rules:
+        for decl in rule.decls:
+            refs = [m.group(1) for m in brief.VAR_REF_RE.finditer(decl.value)]
+            if rule.selectors == (':root',) and decl.prop.startswith('--'):
+                edges.setdefault(decl.prop, []).extend(refs)
+            else:
+                pending.extend(refs)
+    tokens = set()
+    while pending:
+        name = pending.pop()
+        if name not in tokens:
+            tokens.add(name)
+            pending.extend(edges.get(name, ()))
+    return tokens
+
+
+def _ancestors(number, parents):
+    number = parents[number]
+    while number >= 0:
+        yield number
+        number = parents[number]
+
+
+def critical_css(css, page, markup, index=None):
+    """The rules of a page stylesheet that can style its first screen."""
+    index = index or brief.RuleIndex(css)
+    elements, parents = markup.elements[page], markup.parents[page]
+    # The content of a hidden container is not on the first screen; the
+    # container itself is, so the rules hiding it are inlined.
+    hidden = hidden_elements(index, elements, parents)
+    fold = [number for number in range(markup.fold[page])
+            if not any(other in hidden for other in _ancestors(number, parents))]
+    matched = {}
+
+    def on_fold(selector):
+        # Ancestors and earlier siblings come first in the document, so
+        # an element on the fold has them on the fold too.
+        if selector not in matched:
+            chain = page_markup.selector_chain(selector)
+            matched[selector] = any(page_markup.chain_matches(chain, number, elements, parents,
+                                                              markup.dynamic)
+                                    for number in fold)
+        return matched[selector]
+    names = {}
+    for prelude, start, end in at_rule_blocks(css):
+        m = _KEYFRAMES_RE.match(prelude)
+        if m:
+            names[m.group(1)] = css[start:end]
+
+    rules = [rule for rule in index.rules
+             if (rule.media is None or rule.media.startswith('@media'))
+             and any(on_fold(s) for s in rule.selectors)]
+    tokens = critical_tokens(rules)
+
+    parts = []
+    media = None
+    used = set()
+    for rule in rules:
+        if rule.media != media:
+            if media is not None:
+                parts.append('}')
+            if rule.media is not None:
+                parts.append(rule.media + ' {')
+            media = rule.media
+        if rule.selectors == (':root',):
+            kept = [css[d.start:d.end] for d in rule.decls
+                    if not d.prop.startswith('--') or d.prop in tokens]
+            if kept:
+                parts.append(css[rule.start:rule.body_start] + ' '.join(kept) + '}')
+        else:
+            parts.append(css[rule.start:rule.body_end + 1])
+        for decl in rule.decls:
+            if decl.prop in ('animation', 'animation-name'):
+                used.update(name for name in names if re.search(rf'\b{re.escape(name)}\b', decl.value))
+    if media is not None:
+        parts.append('}')
+    parts.extend(names[name] for name in names if name in used)
+    return '\n'.join(parts)
+
+
+# ─────────────────────────────────────────────────────────────────
+# PER-PAGE SCRIPTS
+# ─────────────────────────────────────────────────────────────────
+# shared-scripts.js is a run of modules, each opened by a banner comment
+# (// ==== / // NAME / // ====). A module goes into a page's bundle,
+# when one of its gate lookups — the
+# document.getElementById/querySelector(All) calls at the module's
+# outermost level — can match an element of the page (compounds checked
+# as in pruning; of an attribute selector only that the page uses the
+# attribute somewhere), when it has no lookups, or
+# when a module already in the bundle uses a top-level name it declares.
+# A bundle is written once per module set: as assets/js/<page>.js for the
+# one page that runs it, as assets/js/bundle-<n>.js when several pages
+# do, so browsers cache one file for all of them.
+SHARED_JS = 'assets/shared-scripts.js'
+PAGE_JS = 'assets/js/{page}.js'
+BUNDLE_JS = 'assets/js/bundle-{number}.js'
+
+ScriptModule = namedtuple('ScriptModule', 'name text gates declares')
+
+_JS_BANNER_RE = re.compile(r'^// ={8,}\n((?://.*\n)+?)// ={8,}\n', re.M)
+_JS_LOOKUP_RE = re.compile(
+    r'^(?P<indent>[ \t]*).*?\bdocument\.(?:getElementById\((?P<q1>[\'"])(?P<id>[^\'"]+)(?P=q1)\)'
+    r'|querySelector(?:All)?\((?P<q2>[\'"])(?P<selector>[^\'"]+)(?P=q2)\))', re.M)
+_JS_DECLARATION_RE = re.compile(r'^(?:const|let|var|function)\s+(\w+)', re.M)
+
+
+def script_modules(js):
+    """[ScriptModule] of `js`, in order; text before the first banner and
+    a banner with no code after it (the file header) stay with the next
+    module."""
+    banners = list(_JS_BANNER_RE.finditer(js))
+    modules = []
+    start = 0
+    for i, banner in enumerate(banners):
+        end = banners[i + 1].start() if i + 1 < len(banners) else len(js)
+        if not js[banner.end():end].strip():
+            continue
+        text = js[start:end]
+        lookups = list(_JS_LOOKUP_RE.finditer(text))
+        outer = min((len(m.group('indent')) for m in lookups), default=0)
+        gates = [f"#{m.group('id')}" if m.group('id') else m.group('selector')
+                 for m in lookups if len(m.group('indent')) == outer]
+        name = banner.group(1).splitlines()[0][2:].strip()
+        modules.append(ScriptModule(name, text, gates, set(_JS_DECLARATION_RE.findall(text))))
+        start = end
+    if modules and start < len(js):
+        last = modules[-1]
+        modules[-1] = last._replace(text=last.text + js[start:])
+    return modules
+
+
+def page_modules(modules, elements, html):
+    """The modules the page `html`, made of `elements`, runs, in file order."""
+    def gate_matches(selector):
+        return any(
+            all(re.search(rf'\s{re.escape(name)}[\s=>]', html)
+                for name in re.findall(r'\[\s*([\w-]+)', part))
+            and all(any(page_markup.element_matches(element, compound) for element in elements)
+                    for compound in page_markup.selector_compounds(re.sub(r'\[[^\]]*\]', '', part)))
+            for part in selector.split(','))
+
+    chosen = {i for i, module in enumerate(modules)
+              if not module.gates or any(gate_matches(g) for g in module.gates)}
+    grown = True
+    while grown:
+        grown = False
+        used = ' '.join(modules[i].text for i in chosen)
+        for i, module in enumerate(modules):
+            if i not in chosen and any(re.search(rf'\b{name}\b', used) for name in module.declares):
+                chosen.add(i)
+                grown = True
+    return [module for i, module in enumerate(modules) if i in chosen]
+
+
+# ─────────────────────────────────────────────────────────────────
+# MINIFY
+# ─────────────────────────────────────────────────────────────────
+# Both minifiers copy strings (and JS template and regex literals) as they
+# are and only work on the text between them. CSS loses comments, the
+# whitespace around `{};,` and after a declaration's `:`, and the last
+# `;` of each rule; descendant combinators and the spaces calc() needs
+# around `+`/`-` are kept. JS keeps its line breaks, so automatic
+# semicolon insertion sees the same statements; it loses comments,
+# indentation and blank lines, and spaces that no identifier or `+ +`/
+# `- -` pair needs.
+_CSS_MIN_TOKEN_RE = re.compile(r'/\*.*?(?:\*/|\Z)|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'', re.S)
+
+
+# Text up to a `;` or `}` (not a `{`) is a declaration, not a prelude.
+_CSS_DECLARATION_RE = re.compile(r'[^{};]*(?=[;}])')
+_CSS_STRING_SLOT_RE = re.compile(r'\0(\d+)\0')
+
+
+def _minify_css_text(text):
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r' ?([{};,]) ?', r'\1', text)
+    text = _CSS_DECLARATION_RE.sub(lambda m: m.group().replace(': ', ':'), text)
+    return text.replace(';}', '}')
+
+
+def minify_css(css):
+    # Strings are set aside as \0<n>\0 slots, so one pass over the rest
+    # sees every rule whole and never touches a string; a comment becomes
+    # a space, which still separates two words and goes wherever a space
+    # can.
+    strings = []
+
+    def set_aside(m):
+        if m.group().startswith('/*'):
+            return ' '
+        strings.append(m.group())
+        return f'\0{len(strings) - 1}\0'
+
+    text = _minify_css_text(_CSS_MIN_TOKEN_RE.sub(set_aside, css)).strip()
+    return _CSS_STRING_SLOT_RE.sub(lambda m: strings[int(m.group(1))], text)
+
+
+_JS_REGEX_PREFIX = set('(,=:[!&|?{};+-*%<>~^')
+_JS_REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete',
+                      'void', 'throw', 'instanceof', 'yield', 'await'}
+
+
+def _js_literal_end(js, i):
+    """End of the string, template or regex literal starting at js[i]."""
+    quote = js[i]
+    j = i + 1
+    in_class = False
+    while j < len(js):
+        c = js[j]
+        if c == '\\':
+            j += 2
+            continue
+        if quote == '/':
+            if c == '[':
+                in_class = True
+            elif c == ']':
+                in_class = False
+            elif c == '/' and not in_class:
+                j += 1
+                while j < len(js) and (js[j].isalnum() or js[j] in '_$'):
+                    j += 1
+                return j
+            elif c == '\n':
+                return j
+        elif c == quote:
+            return j + 1
+        j += 1
+    return j
+
+
+def minify_js(js):
+    out = []
+    i = 0
+    pending = ''        # whitespace seen since the last token: '', ' ' or '\n'
+    last = ''           # last significant token text
+
+    def emit(text):
+        nonlocal pending, last
+        if pending and out:
+            prev = out[-1][-1]
+            nxt = text[0]
+            word = (prev.isalnum() or prev in '_$') and (nxt.isalnum() or nxt in '_$')
+            if pending == '\n':
+                out.append('\n')
+            elif word or (prev == nxt and prev in '+-'):
+                out.append(' ')
+        out.append(text)
+        pending = ''
+        last = text
+
+    while i < len(js):
+        c = js[i]
+        if c.isspace():
+            j = i
+            while j < len(js) and js[j].isspace():
+                j += 1
+            pending = '\n' if '\n' in js[i:j] or pending == '\n' else ' '
+            i = j
+        elif js.startswith('//', i):
+            i = js.find('\n', i)
+            i = len(js) if i < 0 else i
+        elif js.startswith('/*', i):
+            end = js.find('*/', i + 2)
+            end = len(js) if end < 0 else end + 2
+            if '\n' in js[i:end]:
+                pending = '\n'
+            elif not pending:
+                pending = ' '
+            i = end
+        elif c in '"\'`' or (c == '/' and (not last or last[-1] in _JS_REGEX_PREFIX
+                                          or last in _JS_REGEX_KEYWORDS)):
+            j = _js_literal_end(js, i)
+            emit(js[i:j])
+            i = j
+        elif c.isalnum() or c in '_$':
+            j = i
+            while j < len(js) and (js[j].isalnum() or js[j] in '_$'):
+                j += 1
+            emit(js[i:j])
+            i = j
+        else:
+            emit(c)
+            i += 1
+    return ''.join(out).strip() + '\n'
+
+
+# ─────────────────────────────────────────────────────────────────
+# PRECOMPRESSION
+# ─────────────────────────────────────────────────────────────────
+# .gz is always written (gzip, level 9, no timestamp, so builds are
+# byte-identical); .br only when the `brotli` module is installed.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PRECOMPRESS_SUFFIXES = ('.html', '.css', '.js', '.svg', '.json')
+SIZE_MANIFEST = 'asset-sizes.json'
+
+
+def precompress(data):
+    """{'gz': bytes, 'br': bytes (with brotli)} for `data`."""
+    out = {'gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        out['br'] = brotli.compress(data, quality=11)
+    return out
+
+
+# ─────────────────────────────────────────────────────────────────
+# SELF-HOSTED FONTS
+# ─────────────────────────────────────────────────────────────────
+# The Google Fonts <link>s are replaced by @font-face rules for font files
+# supplied in fonts/ (static or variable .ttf/.otf/.woff/.woff2, any file
+# names). Each family the link asks for is cut down to the weights the
+# stylesheet uses it with (preload_weights; of those, the ones the link
+# asks for) and to the characters the pages, script and stylesheet
+# contain, and written as
+# assets/fonts/<family>-<weight>.woff2 (.woff without the brotli module).
+# Needs fontTools; without it, or when a family has no files, the pages
+# keep loading Google Fonts.
+try:
+    from fontTools import subset as font_subset
+    from fontTools.ttLib import TTFont
+    from fontTools.varLib import instancer
+except ImportError:
+    TTFont = None
+
+FONT_SOURCE_DIR = os.path.join(brief.BASE_DIR, 'fonts')
+FONT_DIR = 'assets/fonts/'
+FONT_SUFFIXES = ('.ttf', '.otf', '.woff', '.woff2')
+# Always kept, so text the script builds at runtime still renders.
+FONT_BASE_TEXT = ''.join(map(chr, range(0x20, 0x7F))) + ' ÄÖÜäöüß„“‚‘–—…€·•→'
+FONT_WEIGHT_NAMES = {'normal': 400, 'bold': 700}
+
+GOOGLE_FONTS_RE = re.compile(
+    r'[ \t]*(?:<!-- Google Fonts -->|<link\b[^>]*\bhref="https://fonts\.(?:googleapis|gstatic)\.com'
+    r'[^"]*"[^>]*>)\n?')
+_GOOGLE_FAMILY_RE = re.compile(r'family=([^:&"]+)')
+_GOOGLE_WEIGHTS_RE = re.compile(r'family=([^:&"]+):wght@([\d;.]+)')
+
+
+class _TextCollector(HTMLParser):
+    """The text a page shows: character data outside <script>/<style> and
+    the attribute values browsers render."""
+
+    SHOWN_ATTRS = ('alt', 'title', 'placeholder', 'aria-label', 'value')
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self._skip += 1
+        self.parts.extend(value for name, value in attrs if name in self.SHOWN_ATTRS and value)
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style') and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def site_characters(site):
+    """Every character the fonts may have to render on the site."""
+    chars = set(FONT_BASE_TEXT)
+    for rel in site.pages():
+        collector = _TextCollector()
+        collector.feed(site.text(rel))
+        chars.update(''.join(collector.parts))
+    for rel in (SHARED_CSS, 'assets/shared-scripts.js'):
+        chars.update(c for c in site.text(rel) if ord(c) > 0x7E)
+    return {c for c in chars if c.isprintable() or c == ' '}
+
+
+def google_families(html):
+    """Font families the page's Google Fonts links ask for."""
+    return [m.group(1).replace('+', ' ')
+            for link in GOOGLE_FONTS_RE.findall(html) for m in _GOOGLE_FAMILY_RE.finditer(link)]
+
+
+def google_weights(html):
+    """{family: {weight, ...}} the page's Google Fonts links ask for;
+    families listed without weights are left out."""
+    found = {}
+    for link in GOOGLE_FONTS_RE.findall(html):
+        for m in _GOOGLE_WEIGHTS_RE.finditer(link):
+            found.setdefault(m.group(1).replace('+', ' '), set()).update(
+                int(w) for w in re.findall(r'\d+', m.group(2)))
+    return found
+
+
+def font_sources(source_dir=FONT_SOURCE_DIR):
+    """{family: [(weights, path)]} for the font files in `source_dir`;
+    weights is (lo, hi) — a single weight for a static font."""
+    found = {}
+    if TTFont is None or not os.path.isdir(source_dir):
+        return found
+    for name in sorted(os.listdir(source_dir)):
+        if not name.lower().endswith(FONT_SUFFIXES):
+            continue
+        path = os.path.join(source_dir, name)
+        with TTFont(path, lazy=True) as font:
+            family = font['name'].getBestFamilyName()
+            if 'fvar' in font:
+                axis = next((a for a in font['fvar'].axes if a.axisTag == 'wght'), None)
+                if axis is None:
+                    continue
+                weights = (round(axis.minValue), round(axis.maxValue))
+            else:
+                weight = font['OS/2'].usWeightClass
+                weights = (weight, weight)
+        found.setdefault(family, []).append((weights, path))
+    return found
+
+
+def subset_font(path, weight, text, flavor):
+    """`path` at `weight`, cut down to the glyphs for `text`, as bytes."""
+    font = TTFont(path)
+    if 'fvar' in font:
+        font = instancer.instantiateVariableFont(font, {'wght': weight})
+    options = font_subset.Options()
+    options.flavor = flavor
+    options.layout_features = ['*']
+    options.name_IDs = ['*']
+    options.notdef_outline = True
+    subsetter = font_subset.Subsetter(options)
+    subsetter.populate(text=text)
+    subsetter.subset(font)
+    out = io.BytesIO()
+    font.flavor = flavor
+    font.save(out)
+    return out.getvalue()
+
+
+def font_slug(family):
+    return re.sub(r'[^a-z0-9]+', '-', family.lower()).strip('-')
+
+
+def font_face_css(faces):
+    """@font-face rules for [(family, weight, rel)]."""
+    return ''.join(
+        f"@font-face {{ font-family: '{family}'; font-style: normal; font-weight: {weight}; "
+        f"font-display: swap; src: url(\"/{rel}\") format(\"{rel.rpartition('.')[2]}\"); }}\n"
+        for family, weight, rel in faces)
+
+
+def preload_weights(css, families):
+    """{family: [weight, ...]}: the weights each family is used with, most
+    worth preloading first: the weight the family gets on <html>/<body>,
+    then by how many rules set it with it.
+
+    A font-weight without a font-family in its rule goes to the family
+    another rule gives the same selector, else to the <html>/<body>
+    family the element inherits.
+    """
+    index = brief.RuleIndex(css)
+    tokens = {decl.prop: decl.value for rule, decl in
+              ((r, d) for r in index.rules if ':root' in r.selectors for d in r.decls)
+              if decl.prop.startswith('--')}
+
+    def family_of(rule):
+        decl = brief.decl_of(rule, 'font-family')
+        if decl is None:
+            return None
+        value = re.sub(r'var\((--[\w-]+)\)', lambda m: tokens.get(m.group(1), ''), decl.value)
+        return next((f for f in families if f in value), None)
+
+    def weight_of(rule):
+        decl = brief.decl_of(rule, 'font-weight')
+        weight = FONT_WEIGHT_NAMES.get(decl.value, decl.value) if decl else 400
+        return int(weight) if str(weight).isdigit() else None
+
+    counts = {}
+    by_selector = {}
+    inherited = None
+    for rule in index.rules:
+        family = family_of(rule)
+        if family is None:
+            continue
+        for selector in rule.selectors:
+            by_selector.setdefault(selector, family)
+        root = any(re.match(r'(?:html|body)\b', s) for s in rule.selectors)
+        if root and inherited is None:
+            inherited = family
+        weight = weight_of(rule)
+        if weight is not None:
+            key = (family, weight)
+            counts[key] = counts.get(key, 0) + (1000 if root else 1)
+    for rule, decl in index.by_prop.get('font-weight', ()):
+        if brief.decl_of(rule, 'font-family') is not None:
+            continue
+        family = next((by_selector[s] for s in rule.selectors if s in by_selector), inherited)
+        weight = weight_of(rule)
+        if family is not None and weight is not None:
+            key = (family, weight)
+            counts[key] = counts.get(key, 0) + 1
+    ranked = {}
+    for (family, weight), count in sorted(counts.items(), key=lambda item: -item[1]):
+        ranked.setdefault(family, []).append(weight)
+    return ranked
+
+
+# ─────────────────────────────────────────────────────────────────
+# LOGO VARIANTS
+# ─────────────────────────────────────────────────────────────────
+# The header and footer logos are ~7600 px wide PNGs shown about 36 px
+# high. Each gets PNG and WebP copies at 1× and 2× the tallest height
+# the stylesheet gives .logo-img, and the <img class="logo-img"> tags
+# become a <picture> choosing among them. Needs Pillow; without it the
+# logos ship as they are.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+LOGO_DIR = 'assets/images/logos/'
+LOGO_DENSITIES = (1, 2)
+DEFAULT_LOGO_HEIGHT = 40
+WEBP_QUALITY = 90
+LOGO_IMG_RE = re.compile(
+    r'<img\b(?=[^>]*\bclass="logo-img")[^>]*\bsrc="/(?P<src>' + re.escape(LOGO_DIR)
+    + r'[^"]+\.png)"[^>]*>')
+
+
+def logo_height(css):
+    """Tallest px height any .logo-img rule sets, or DEFAULT_LOGO_HEIGHT."""
+    heights = [
+        float(decl.value[:-2])
+        for rule, decl in brief.RuleIndex(css).by_prop.get('height', ())
+        if decl.value.endswith('px') and any(s.endswith('.logo-img') for s in rule.selectors)
+    ]
+    return round(max(heights)) if heights else DEFAULT_LOGO_HEIGHT
+
+
+def logo_variants(data, height):
+    """{(density, 'png'|'webp'): bytes} plus the 1× (width, height)."""
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert('RGBA')
+        width = round(image.width * height / image.height)
+        variants = {}
+        for density in LOGO_DENSITIES:
+            scaled = image.resize((width * density, height * density), Image.LANCZOS)
+            for fmt, options in (('png', {'optimize': True}),
+                                 ('webp', {'quality': WEBP_QUALITY, 'method': 6})):
+                out = io.BytesIO()
+                scaled.save(out, fmt.upper(), **options)
+                variants[density, fmt] = out.getvalue()
+    return variants, (width, height)
+
+
+def variant_path(rel, height, density, fmt):
+    return f'{rel[:-len(".png")]}-{height * density}.{fmt}'
+
+
+def logo_picture(tag, rel, height, size):
+    """The <picture> replacing the logo <img> `tag`."""
+    def srcset(fmt):
+        return ', '.join(f'/{variant_path(rel, height, d, fmt)} {d}x' for d in LOGO_DENSITIES)
+
+    img = tag.replace(f'src="/{rel}"', f'src="/{variant_path(rel, height, 1, "png")}" '
+                                       f'srcset="{srcset("png")}" '
+                                       f'width="{size[0]}" height="{size[1]}"')
+    return f'<picture><source type="image/webp" srcset="{srcset("webp")}">{img}</picture>'
+
+
+# ─────────────────────────────────────────────────────────────────
+# REMOTE IMAGES
+# ─────────────────────────────────────────────────────────────────
+# <img>s loading from another origin (the Unsplash photos, the testimonial
+# portrait) are served from the site instead, from originals saved in
+# image-cache/ under the last segment of their URL path
+# (photo-1595867818082-083862f3d630.jpg for
+# https://images.unsplash.com/photo-1595867818082-083862f3d630?w=600).
+# Each original gets JPEG (PNG when it has transparency) and WebP copies at
+# the IMAGE_WIDTHS up to twice the widest ?w= the pages ask for; the tags
+# become <picture>s with srcset, sizes and width/height, lazy-loaded
+# outside the first <section> (the mega menu's city cards come before it
+# but only show once the menu opens). IMAGE_MANIFEST maps each URL to its copies. Needs
+# Pillow, like the logos.
+IMAGE_CACHE_DIR = os.path.join(brief.BASE_DIR, 'image-cache')
+REMOTE_IMAGE_DIR = 'assets/images/remote/'
+IMAGE_MANIFEST = 'image-variants.json'
+IMAGE_WIDTHS = (200, 400, 600, 800, 1200, 1600, 2400)
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.webp')
+JPEG_QUALITY = 82
+
+REMOTE_IMG_RE = re.compile(r'<img\b[^>]*?\bsrc="(?P<url>https?://[^"]+)"[^>]*>')
+_WIDTH_HINT_RE = re.compile(r'[?&]w=(\d+)')
+
+
+def image_cache_key(url):
+    """The cache file name (without suffix) for an image URL."""
+    path = url.split('?', 1)[0].rstrip('/')
+    return path.rpartition('/')[2].rsplit('.', 1)[0]
+
+
+def cached_image(key, cache_dir=IMAGE_CACHE_DIR):
+    """Path of the cached original for `key`, or None."""
+    for suffix in IMAGE_SUFFIXES:
+        path = os.path.join(cache_dir, key + suffix)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def image_widths(source_width, hint):
+    """The variant widths for an original `source_width` px wide whose
+    widest use asks for `hint` px."""
+    limit = min(source_width, 2 * hint)
+    widths = [w for w in IMAGE_WIDTHS if w <= limit]
+    if min(hint, source_width) not in widths:
+        widths.append(min(hint, source_width))
+    return sorted(widths)
+
+
+def image_variants(path, widths):
+    """{(width, fmt): bytes}, the fallback format and the original's size."""
+    with Image.open(path) as image:
+        size = image.size
+        alpha = image.mode in ('RGBA', 'LA', 'P') and image.convert('RGBA').getextrema()[3][0] < 255
+        image = image.convert('RGBA' if alpha else 'RGB')
+        fallback = 'png' if alpha else 'jpg'
+        variants = {}
+        for width in widths:
+            scaled = image.resize((width, round(size[1] * width / size[0])), Image.LANCZOS)
+            for fmt, save, options in ((fallback, 'PNG' if alpha else 'JPEG',
+                                        {'optimize': True} if alpha else
+                                        {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True}),
+                                       ('webp', 'WEBP', {'quality': JPEG_QUALITY, 'method': 6})):
+                out = io.BytesIO()
+                scaled.save(out, save, **options)
+                variants[width, fmt] = out.getvalue()
+    return variants, fallback, size
+
+
+def first_section(html):
+    """(start, end) of the page's first <section>, the hero. Images
+    outside it are below the fold or in closed menus."""
+    start = html.find('<section')
+    end = html.find('</section>', start)
+    return (0, len(html)) if start < 0 or end < 0 else (start, end)
+
+
+def remote_picture(tag, url, entry, lazy):
+    """The <picture> replacing the remote <img> `tag`."""
+    hint = int(_WIDTH_HINT_RE.search(url).group(1)) if _WIDTH_HINT_RE.search(url) else entry['width']
+    sizes = f'(max-width: {hint}px) 100vw, {hint}px'
+
+    def srcset(fmt):
+        return ', '.join(f"{v['path']} {v['width']}w" for v in entry['variants'] if v['format'] == fmt)
+
+    fallback = [v for v in entry['variants'] if v['format'] != 'webp']
+    src = next((v for v in fallback if v['width'] >= hint), fallback[-1])
+    height = round(entry['height'] * src['width'] / entry['width'])
+    extra = f' srcset="{srcset(src["format"])}" sizes="{sizes}" width="{src["width"]}" height="{height}"'
+    if lazy and 'loading=' not in tag:
+        extra += ' loading="lazy" decoding="async"'
+    img = tag.replace(f'src="{url}"', f'src="{src["path"]}"' + extra, 1)
+    return (f'<picture><source type="image/webp" srcset="{srcset("webp")}" sizes="{sizes}">'
+            f'{img}</picture>')
+
+
+# ─────────────────────────────────────────────────────────────────
+# STAGES
+# ─────────────────────────────────────────────────────────────────
+SHARED_LINK_RE = re.compile(
+    r'(?P<indent>[ \t]*)<link\b[^>]*\bhref="/' + re.escape(SHARED_CSS) + r'"[^>]*>')
+
+
+def build_page_css(site, critical=True, prune=True, keep=PRUNE_KEEP):
+    """Per-page stylesheets, pruned of selectors the page cannot match,
+    and critical CSS; rewrite each page's <link>."""
+    print("\n== Page stylesheets ==")
+    shared = site.text(SHARED_CSS)
+    with contextlib.redirect_stdout(io.StringIO()) as log:
+        css = brief.consolidate_css(shared, site.markup)
+    for line in log.getvalue().splitlines():
+        if 'WARNING' in line:
+            print(line)
+    index = brief.RuleIndex(css)
+    saved = 0
+
+    for page in site.markup.pages:
+        html_path = site.page_path(page)
+        html = site.text(html_path)
+        sheet = page_stylesheet(css, page, index)
+        if prune:
+            size = len(sheet.encode('utf-8'))
+            sheet, dropped = prune_stylesheet(sheet, {page: site.markup.elements[page]},
+                                              site.markup.dynamic, keep)
+            pruned = size - len(sheet.encode('utf-8'))
+            saved += pruned
+            print(f"  {page:16s} pruned {len(dropped)} unused selectors ({pruned / 1024:.1f} KB)")
+        href = '/' + PAGE_CSS.format(page=page)
+        site.files[PAGE_CSS.format(page=page)] = sheet
+
+        inline = critical_css(sheet, page, site.markup) if critical else ''
+        m = SHARED_LINK_RE.search(html)
+        if m is None:
+            print(f"  WARNING: {html_path} does not link /{SHARED_CSS}, left as is")
+            continue
+        indent = m.group('indent')
+        if inline:
+            tags = [
+                f'<style>\n{inline}\n{indent}</style>',
+                f'<link rel="preload" href="{href}" as="style" onload="this.onload=null;this.rel=\'stylesheet\'">',
+                f'<noscript><link rel="stylesheet" href="{href}"></noscript>',
+            ]
+        else:
+            tags = [f'<link rel="stylesheet" href="{href}" />']
+        site.files[html_path] = html[:m.start()] + ''.join(
+            indent + tag + '\n' for tag in tags).rstrip('\n') + html[m.end():]
+
+        print(f"  {page:16s} {len(sheet) / 1024:7.1f} KB stylesheet"
+              f" ({len(sheet) / len(shared):4.0%} of shared)"
+              + (f", {len(inline) / 1024:6.1f} KB critical inlined" if inline else ''))
+
+    if prune:
+        # The shared file stays in the output for anything linking it, minus
+        # the selectors no page can match.
+        size = len(shared.encode('utf-8'))
+        shared, dropped = prune_stylesheet(shared, site.markup.elements, site.markup.dynamic, keep)
+        site.files[SHARED_CSS] = shared
+        pruned = size - len(shared.encode('utf-8'))
+        print(f"  {'(shared)':16s} pruned {len(dropped)} selectors no page uses ({pruned / 1024:.1f} KB)")
+        print(f"  Pruning saved {(saved + pruned) / 1024:.1f} KB")
+
+
+SHARED_SCRIPT_RE = re.compile(r'(<script\b[^>]*\bsrc=")/' + re.escape(SHARED_JS) + '(")')
+
+
+def build_page_js(site):
+    """Per-page bundles of the shared script's modules; rewrite each
+    page's <script>."""
+    print("\n== Page scripts ==")
+    modules = script_modules(site.text(SHARED_JS))
+    print(f"  {SHARED_JS}: {len(modules)} modules")
+    bundles = {}        # module numbers -> pages running them, in page order
+    for page in site.markup.pages:
+        html = site.text(site.page_path(page))
+        if not SHARED_SCRIPT_RE.search(html):
+            continue
+        chosen = page_modules(modules, site.markup.elements[page], html)
+        key = tuple(i for i, module in enumerate(modules) if module in chosen)
+        bundles.setdefault(key, []).append(page)
+
+    shared = 0
+    for key, pages in bundles.items():
+        chosen = [modules[i] for i in key]
+        bundle = ''.join(module.text for module in chosen)
+        if len(pages) == 1:
+            rel = PAGE_JS.format(page=pages[0])
+        else:
+            shared += 1
+            rel = BUNDLE_JS.format(number=shared)
+        site.files[rel] = bundle
+        for page in pages:
+            html_path = site.page_path(page)
+            site.files[html_path] = SHARED_SCRIPT_RE.sub(lambda m: f'{m.group(1)}/{rel}{m.group(2)}',
+                                                         site.text(html_path))
+        left_out = [module.name.split(' (')[0] for module in modules if module not in chosen]
+        print(f"  {', '.join(pages)}: {os.path.basename(rel)}, {len(chosen)}/{len(modules)} modules, "
+              f"{len(bundle) / 1024:.1f} KB"
+              + (f"  (without {', '.join(left_out)})" if left_out else ''))
+
+
+_STYLE_RE = re.compile(r'(<style\b[^>]*>)(.*?)(</style>)', re.S)
+
+
+def self_host_fonts(site, source_dir=FONT_SOURCE_DIR):
+    """Subsetted copies of the Google Fonts families from `source_dir`,
+    loaded through inline @font-face rules and preloads instead of the
+    Google Fonts links. Returns the written font files."""
+    print("\n== Fonts ==")
+    if TTFont is None:
+        print("  WARNING: fontTools not installed: pages keep loading Google Fonts")
+        return []
+    families = []
+    for rel in site.pages():
+        families.extend(f for f in google_families(site.text(rel)) if f not in families)
+    sources = font_sources(source_dir)
+    missing = [family for family in families if family not in sources]
+    if missing:
+        print(f"  WARNING: no files for {', '.join(missing)} in "
+              f"{os.path.relpath(source_dir, brief.BASE_DIR)}/: pages keep loading Google Fonts")
+        return []
+
+    css = site.text(SHARED_CSS)
+    ranked = preload_weights(css, families)
+    requested = {}
+    for rel in site.pages():
+        for family, weights in google_weights(site.text(rel)).items():
+            requested.setdefault(family, set()).update(weights)
+    text = ''.join(sorted(site_characters(site)))
+    flavor = 'woff2' if brotli is not None else 'woff'
+    faces = []
+    for family in families:
+        weights = set(ranked.get(family, ()))
+        if family in requested:
+            # Google Fonts served no other weight, so none is needed.
+            weights &= requested[family]
+        for weight in sorted(weights):
+            path = next((p for (lo, hi), p in sources[family] if lo <= weight <= hi), None)
+            if path is None:
+                print(f"  WARNING: {family} has no {weight} weight: the browser synthesizes it")
+                continue
+            rel = f'{FONT_DIR}{font_slug(family)}-{weight}.{flavor}'
+            site.files[rel] = subset_font(path, weight, text, flavor)
+            site.sources[rel] = os.path.getsize(path)
+            faces.append((family, weight, rel))
+            print(f"  {rel:44s} {site.sources[rel] / 1024:8.1f} KB -> "
+                  f"{len(site.files[rel]) / 1024:6.1f} KB")
+
+    preload = {}
+    for family, order in ranked.items():
+        face = next((face for weight in order for face in faces if face[:2] == (family, weight)), None)
+        if face:
+            preload[family] = face
+    hints = [f'<link rel="preload" href="/{rel}" as="font" type="font/{flavor}" crossorigin>'
+             for family, weight, rel in preload.values()]
+    style = '<style>\n' + font_face_css(faces) + '</style>'
+    for rel in site.pages():
+        html = site.text(rel)
+        first = GOOGLE_FONTS_RE.search(html)
+        if first is None:
+            continue
+        indent = re.match(r'[ \t]*', first.group(0)).group(0)
+        head = ''.join(f'{indent}{line}\n' for line in hints + [style])
+        html = html[:first.start()] + head + GOOGLE_FONTS_RE.sub('', html[first.start():])
+        site.files[rel] = html
+    print(f"  {len(faces)} faces, {len(text)} characters, {len(hints)} preloaded: "
+          f"{', '.join(f'{f} {w}' for f, w, _ in preload.values())}")
+    return [rel for _, _, rel in faces]
+
+
+def minify_assets(site):
+    """Minified .min.css/.min.js next to every stylesheet and script, with
+    the pages pointed at them; inline <style> blocks are minified in place."""
+    print("\n== Minify ==")
+    minified = {}
+    for rel in list(site.files):
+        if rel.endswith(('.min.css', '.min.js')):
+            continue
+        if rel.endswith('.css'):
+            target = rel[:-len('.css')] + '.min.css'
+            site.files[target] = minify_css(site.text(rel))
+        elif rel.endswith('.js'):
+            target = rel[:-len('.js')] + '.min.js'
+            site.files[target] = minify_js(site.text(rel))
+        else:
+            continue
+        minified[target] = rel
+        site.sources[target] = len(site.data(rel))
+        print(f"  {target:36s} {site.sources[target] / 1024:8.1f} KB -> "
+              f"{len(site.data(target)) / 1024:7.1f} KB")
+
+    for rel in site.pages():
+        html = site.text(rel)
+        for target, source in minified.items():
+            html = html.replace(f'"/{source}"', f'"/{target}"')
+        html = _STYLE_RE.sub(lambda m: m.group(1) + minify_css(m.group(2)) + m.group(3), html)
+        site.files[rel] = html
+
+
+def optimize_logos(site):
+    """Right-sized PNG/WebP variants of the logos the pages show, with the
+    <img class="logo-img"> tags turned into <picture>s; the originals are
+    dropped once nothing references them."""
+    print("\n== Logos ==")
+    if Image is None:
+        print("  WARNING: Pillow not installed: logos shipped as they are")
+        return {}
+    height = logo_height(site.text(SHARED_CSS))
+    used = sorted({m.group('src') for rel in site.pages()
+                   for m in LOGO_IMG_RE.finditer(site.text(rel))})
+    sizes = {}
+    for rel in used:
+        original = site.data(rel)
+        variants, sizes[rel] = logo_variants(original, height)
+        for (density, fmt), data in variants.items():
+            target = variant_path(rel, height, density, fmt)
+            site.files[target] = data
+            site.sources[target] = len(original)
+        print(f"  {rel:40s} {len(original) / 1024:7.1f} KB -> "
+              + '  '.join(f"{density}x {fmt} {len(data) / 1024:5.1f} KB"
+                          for (density, fmt), data in sorted(variants.items())))
+
+    before = after = 0
+    for rel in site.pages():
+        html = site.text(rel)
+        for m in LOGO_IMG_RE.finditer(html):
+            before += len(site.data(m.group('src')))
+            after += len(site.data(variant_path(m.group('src'), height, max(LOGO_DENSITIES), 'webp')))
+        site.files[rel] = LOGO_IMG_RE.sub(
+            lambda m: logo_picture(m.group(0), m.group('src'), height, sizes[m.group('src')]), html)
+
+    others = [rel for rel in site.files if rel.endswith(('.html', '.css', '.js'))]
+    for rel in used:
+        if not any(f'/{rel}' in site.text(other) for other in others):
+            del site.files[rel]
+    print(f"  {height}px high; logo bytes over all {len(site.pages())} pages: {before / 1024:.1f} KB -> "
+          f"{after / 1024:.1f} KB as {max(LOGO_DENSITIES)}x WebP "
+          f"({(before - after) / 1024:.1f} KB saved)")
+    return sizes
+
+
+def localize_images(site, cache_dir=IMAGE_CACHE_DIR):
+    """Serve the pages' remote <img>s from responsive local copies of the
+    originals in `cache_dir`; writes IMAGE_MANIFEST. Returns the manifest."""
+    print("\n== Remote images ==")
+    if Image is None:
+        print("  WARNING: Pillow not installed: remote images stay remote")
+        return {}
+    uses = {}
+    for rel in site.pages():
+        for m in REMOTE_IMG_RE.finditer(site.text(rel)):
+            uses.setdefault(m.group('url'), set()).add(rel)
+    hints = {}
+    for url in uses:
+        m = _WIDTH_HINT_RE.search(url)
+        key = image_cache_key(url)
+        hints[key] = max(hints.get(key, 0), int(m.group(1)) if m else 0)
+
+    manifest, missing = {}, []
+    by_key = {}
+    for url in sorted(uses):
+        key = image_cache_key(url)
+        path = cached_image(key, cache_dir)
+        if path is None:
+            missing.append(url)
+            continue
+        if key not in by_key:
+            with Image.open(path) as image:
+                width = image.width
+            variants, fallback, size = image_variants(path, image_widths(width, hints[key] or width))
+            entry = {'source': os.path.relpath(path, brief.BASE_DIR).replace(os.sep, '/'),
+                     'width': size[0], 'height': size[1], 'variants': []}
+            for (w, fmt), data in sorted(variants.items(), key=lambda item: (item[0][1] == 'webp', item[0][0])):
+                rel = f'{REMOTE_IMAGE_DIR}{key}-{w}.{fmt}'
+                site.files[rel] = data
+                site.sources[rel] = os.path.getsize(path)
+                entry['variants'].append({'path': f'/{rel}', 'width': w, 'format': fmt, 'bytes': len(data)})
+            by_key[key] = entry
+            print(f"  {key:44s} {size[0]:5d}px {os.path.getsize(path) / 1024:8.1f} KB -> "
+                  + ', '.join(str(w) for w, fmt in variants if fmt == 'webp') + f" px ({fallback}, webp)")
+        manifest[url] = dict(by_key[key], pages=sorted(uses[url]))
+
+    lazy = 0
+    for rel in site.pages():
+        html = site.text(rel)
+        hero = first_section(html)
+        out, last = [], 0
+        for m in REMOTE_IMG_RE.finditer(html):
+            if m.group('url') not in manifest:
+                continue
+            below = not hero[0] <= m.start() < hero[1]
+            lazy += below
+            out.append(html[last:m.start()])
+            out.append(remote_picture(m.group(0), m.group('url'), manifest[m.group('url')], below))
+            last = m.end()
+        site.files[rel] = ''.join(out) + html[last:]
+
+    site.files[IMAGE_MANIFEST] = json.dumps(manifest, indent=1, sort_keys=True) + '\n'
+    for url in missing:
+        print(f"  WARNING: {image_cache_key(url)} not in "
+              f"{os.path.relpath(cache_dir, brief.BASE_DIR)}/: {url} stays remote")
+    print(f"  {len(manifest)} URLs from {len(by_key)} originals, {lazy} tags lazy-loaded, "
+          f"{len(missing)} left remote")
+    return manifest
+
+
+# Fingerprinted names carry the first FINGERPRINT_LENGTH hex digits of the
+# file's SHA-256: assets/shared-styles.min.css →
+# assets/shared-styles.min.<hash>.css. Images and other leaves go first, so
+# the stylesheets and scripts referencing them hash their final content.
+FINGERPRINT_LENGTH = 10
+_TEXT_ASSETS = ('.css', '.js', '.svg', '.json')
+
+
+def fingerprinted(rel, content):
+    folder, _, name = rel.rpartition('/')
+    stem, dot, ext = name.rpartition('.')
+    digest = hashlib.sha256(content).hexdigest()[:FINGERPRINT_LENGTH]
+    name = f'{stem}.{digest}.{ext}' if dot else f'{name}.{digest}'
+    return f'{folder}/{name}' if folder else name
+
+
+def _reference_re(paths):
+    """Regex for the site-absolute references (`/assets/…`) to `paths`,
+    as quoted attribute values, srcset entries or CSS url()s."""
+    alternatives = '|'.join(re.escape(path) for path in sorted(paths, key=len, reverse=True))
+    return re.compile(r'(?<=["\'(\s,])/(' + alternatives + r')(?=["\')\s,?#])')
+
+
+def fingerprint_assets(site):
+    """Rename every file under assets/ to its fingerprinted name and
+    rewrite the references in the pages, stylesheets and scripts."""
+    print("\n== Fingerprint ==")
+    assets = [rel for rel in site.files
+              if rel.startswith('assets/') and not rel.rpartition('/')[2].startswith('.')]
+    renamed = {}
+    for tier in ([rel for rel in assets if not rel.endswith(_TEXT_ASSETS)],
+                 [rel for rel in assets if rel.endswith(_TEXT_ASSETS)]):
+        if renamed:
+            pattern = _reference_re(renamed)
+            for rel in tier:
+                text = site.text(rel)
+                updated = pattern.sub(lambda m: '/' + renamed[m.group(1)], text)
+                if updated != text:
+                    site.files[rel] = updated
+        for rel in tier:
+            target = fingerprinted(rel, site.data(rel))
+            site.sources[target] = site.sources.get(rel, len(site.data(rel)))
+            site.files[target] = site.data(rel) if site.files[rel] is None else site.files[rel]
+            del site.files[rel]
+            renamed[rel] = target
+
+    pattern = _reference_re(renamed)
+    rewritten = 0
+    for rel in site.pages() + [IMAGE_MANIFEST] * (IMAGE_MANIFEST in site.files):
+        html, count = pattern.subn(lambda m: '/' + renamed[m.group(1)], site.text(rel))
+        site.files[rel] = html
+        rewritten += count
+    print(f"  {len(renamed)} assets renamed, {rewritten} references rewritten in "
+          f"{len(site.pages())} pages")
+    for rel in site.referenced():
+        print(f"  {rel}")
+    return renamed
+
+
+def precompress_site(site):
+    """.gz/.br siblings for the pages and the text assets they load, and
+    asset-sizes.json with the sizes before and after. Returns the manifest."""
+    print("\n== Precompress ==")
+    manifest = {'brotli': brotli is not None, 'files': {}}
+    for rel in site.pages() + site.referenced():
+        data = site.data(rel)
+        source = site.sources.get(rel)
+        if source is None:
+            path = os.path.join(site.root, rel)
+            source = os.path.getsize(path) if os.path.exists(path) else len(data)
+        entry = {'source': source, 'output': len(data)}
+        if rel.endswith(PRECOMPRESS_SUFFIXES):
+            for suffix, packed in precompress(data).items():
+                site.files[f'{rel}.{suffix}'] = packed
+                entry[suffix] = len(packed)
+        manifest['files'][rel] = entry
+    totals = {key: sum(entry.get(key, 0) for entry in manifest['files'].values())
+              for key in ('source', 'output', 'gz', 'br')}
+    manifest['totals'] = totals
+    site.files[SIZE_MANIFEST] = json.dumps(manifest, indent=1, sort_keys=True) + '\n'
+
+    for rel, entry in manifest['files'].items():
+        print(f"  {rel:48s} {entry['source'] / 1024:8.1f} KB -> {entry['output'] / 1024:7.1f} KB"
+              + (f"  gz {entry['gz'] / 1024:6.1f} KB" if 'gz' in entry else '')
+              + (f"  br {entry['br'] / 1024:6.1f} KB" if 'br' in entry else ''))
+    print(f"  {'total':48s} {totals['source'] / 1024:8.1f} KB -> {totals['output'] / 1024:7.1f} KB"
+          f"  gz {totals['gz'] / 1024:6.1f} KB"
+          + (f"  br {totals['br'] / 1024:6.1f} KB" if brotli is not None else '  (no brotli module: .br skipped)'))
+    return manifest
+
+
+# ─────────────────────────────────────────────────────────────────
+# MAIN
+# ─────────────────────────────────────────────────────────────────
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--out', default=DEFAULT_OUT,
+                        help=f'output directory, replaced on every build; an existing one must '
+                             f'hold the {BUILD_MARKER} of an earlier build (default: dist/)')
+    parser.add_argument('--no-critical', action='store_true',
+                        help='link the page stylesheets normally instead of inlining critical CSS')
+    parser.add_argument('--no-prune', action='store_true',
+                        help='keep selectors that no element of the page can match')
+    parser.add_argument('--keep', action='append', default=[], metavar='REGEX',
+                        help='never prune selectors matching REGEX (repeatable)')
+    parser.add_argument('--no-split-js', action='store_true',
+                        help='load the whole shared script on every page')
+    parser.add_argument('--fonts', default=FONT_SOURCE_DIR, metavar='DIR',
+                        help='font files to self-host the Google Fonts families from '
+                             '(default: fonts/)')
+    parser.add_argument('--no-minify', action='store_true',
+                        help='ship the stylesheets and scripts as they are')
+    parser.add_argument('--no-logos', action='store_true',
+                        help='ship the full-size logo PNGs')
+    parser.add_argument('--image-cache', default=IMAGE_CACHE_DIR, metavar='DIR',
+                        help='saved originals of the remote images (default: image-cache/)')
+    parser.add_argument('--no-fingerprint', action='store_true',
+                        help='keep the asset file names as they are')
+    args = parser.parse_args(argv)
+
+    site = Site.load()
+    inputs = (args.fonts, args.image_cache)
+    problem = site.check_out(args.out, inputs)
+    if problem:
+        parser.error(f"--out: refusing to build there, {problem}")
+    print(f"Site: {len(site.markup.pages)} pages, {len(site.files)} files")
+    build_page_css(site, critical=not args.no_critical, prune=not args.no_prune,
+                   keep=PRUNE_KEEP + tuple(args.keep))
+    if not args.no_split_js:
+        build_page_js(site)
+    self_host_fonts(site, args.fonts)
+    if not args.no_minify:
+        minify_assets(site)
+    if not args.no_logos:
+        optimize_logos(site)
+    localize_images(site, args.image_cache)
+    if not args.no_fingerprint:
+        fingerprint_assets(site)
+    precompress_site(site)
+
+    count = site.write(args.out, inputs)
+    print(f"\nWrote {count} files to {os.path.relpath(args.out, brief.BASE_DIR)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Page markup and selector matching shared by the Helferportal scripts
+
+_apply_design_brief.py --consolidate uses it to tell which rules may
+style one element, and _build_site.py to prune the selectors no element
+of a page can match and to pick the rules of a page's first screen.
+"""
+
+import os
+import re
+from collections import namedtuple
+from html.parser import HTMLParser
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+JS_PATH = os.path.join(BASE_DIR, 'assets', 'shared-scripts.js')
+
+
+# ─────────────────────────────────────────────────────────────────
+# PAGE MARKUP
+# ─────────────────────────────────────────────────────────────────
+# The elements of each page (tag, id, classes) and each one's parent, read
+# from the HTML pages (html.parser, no dependencies). A page is named after its
+# `body.page-<name>` class. Its first screen ("the fold") is everything up
+# to the end of its first <section>: header, menus and hero. Class names
+# that occur as string literals in the script may be added to any element
+# at run time, so they never rule a match out.
+Element = namedtuple('Element', 'tag id classes')
+PageMarkup = namedtuple('PageMarkup', 'pages elements classes fold dynamic parents')
+# Elements without an end tag.
+VOID_ELEMENTS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+                           'meta', 'source', 'track', 'wbr'))
+
+
+class _ElementCollector(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.page = None
+        self.elements = []
+        self.parents = []
+        self.open = []              # (tag, number) of the open elements
+        self.fold = None
+        self.sections = 0
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = frozenset((attrs.get('class') or '').split())
+        if tag == 'body':
+            page = next((c[len('page-'):] for c in classes if c.startswith('page-')), None)
+            self.page = self.page or page
+        elif tag == 'section':
+            self.sections += 1
+        self.parents.append(self.open[-1][1] if self.open else -1)
+        if tag not in VOID_ELEMENTS:
+            self.open.append((tag, len(self.elements)))
+        self.elements.append(Element(tag, attrs.get('id'), classes))
+
+    def handle_endtag(self, tag):
+        # An end tag also closes the elements left open inside it (<p>, <li>).
+        if any(name == tag for name, _ in self.open):
+            while self.open.pop()[0] != tag:
+                pass
+        if tag == 'section' and self.sections:
+            self.sections -= 1
+            if not self.sections and self.fold is None:
+                self.fold = len(self.elements)
+
+
+def load_page_markup(base_dir=BASE_DIR, js=None):
+    """PageMarkup for the *.html pages in `base_dir`.
+
+    pages: {page: html path}; elements: {page: [Element] in document
+    order}; classes: {page: {class: frozenset of the numbers of the
+    elements carrying it}}; fold: {page: number of elements on the first
+    screen}; dynamic: class-like string literals of `js` (default:
+    shared-scripts.js); parents: {page: [number of each element's parent,
+    -1 for none]}.
+    """
+    pages, elements, classes, fold, parents = {}, {}, {}, {}, {}
+    for name in sorted(os.listdir(base_dir)):
+        if not name.endswith('.html'):
+            continue
+        path = os.path.join(base_dir, name)
+        collector = _ElementCollector()
+        with open(path, 'r', encoding='utf-8') as f:
+            collector.feed(f.read())
+        if collector.page and collector.page not in pages:
+            pages[collector.page] = path
+            elements[collector.page] = collector.elements
+            parents[collector.page] = collector.parents
+            fold[collector.page] = collector.fold or len(collector.elements)
+            carriers = classes[collector.page] = {}
+            for number, element in enumerate(collector.elements):
+                for cls in element.classes:
+                    carriers.setdefault(cls, set()).add(number)
+            for cls, numbers in carriers.items():
+                carriers[cls] = frozenset(numbers)
+    if js is None:
+        with open(JS_PATH, 'r', encoding='utf-8') as f:
+            js = f.read()
+    dynamic = {word for literal in re.findall(r'[\'"`]([\w\s-]+)[\'"`]', js)
+               for word in literal.split()}
+    return PageMarkup(pages, elements, classes, fold, frozenset(dynamic), parents)
+
+
+_COMBINATOR_RE = re.compile(r'\s*[>+~]\s*|\s+')
+_COMBINATOR_SPLIT_RE = re.compile(r'\s*([>+~])\s*|\s+')
+_FUNCTIONAL_RE = re.compile(r'\([^()]*\)')
+
+
+def selector_chain(selector):
+    """[(combinator, Element(tag, id, classes))] for each compound of
+    `selector`, left to right; the combinator joins a compound to the one
+    before it (' ', '>', '+', '~'; None for the first).
+
+    The last compound is the subject. Arguments of functional
+    pseudo-classes are dropped, so the compounds can only be looser than
+    the selector; tag and id are None when a compound names none.
+    """
+    selector = selector.strip()
+    while '(' in selector:
+        stripped = _FUNCTIONAL_RE.sub('', selector)
+        if stripped == selector:
+            break
+        selector = stripped
+    chain = []
+    parts = _COMBINATOR_SPLIT_RE.split(selector)
+    combinator = None
+    for i, compound in enumerate(parts):
+        if i % 2:
+            combinator = compound or ' '
+            continue
+        if not compound:
+            continue
+        tag = re.match(r'[a-zA-Z][\w-]*', compound)
+        element_id = re.search(r'#([\w-]+)', compound)
+        chain.append((combinator if chain else None,
+                      Element(tag.group(0).lower() if tag else None,
+                              element_id.group(1) if element_id else None,
+                              frozenset(re.findall(r'\.([\w-]+)', compound)))))
+    return chain or [(None, Element(None, None, frozenset()))]
+
+
+def selector_compounds(selector):
+    """Element(tag, id, classes) for each compound of `selector`, left to
+    right (see selector_chain)."""
+    return [compound for _, compound in selector_chain(selector)]
+
+
+def subject_compound(selector):
+    """Element(tag, id, classes) the subject (rightmost compound) requires."""
+    return selector_compounds(selector)[-1]
+
+
+def element_matches(element, compound, dynamic=frozenset()):
+    """Whether `element` can be `compound`. Names in `dynamic` (the
+    script's string literals) are assumed present, as it may create or
+    tag elements with them."""
+    return ((compound.tag is None or compound.tag == element.tag or compound.tag in dynamic)
+            and (compound.id is None or compound.id == element.id or compound.id in dynamic)
+            and compound.classes - dynamic <= element.classes)
+
+
+def chain_matches(chain, number, elements, parents, dynamic=frozenset()):
+    """Whether element `number` can be the subject of `chain`
+    (selector_chain), its other compounds matched against its ancestors
+    and earlier siblings. Like element_matches, only looser than CSS."""
+    combinator, compound = chain[-1]
+    if not element_matches(elements[number], compound, dynamic):
+        return False
+    if len(chain) == 1:
+        return True
+    rest = chain[:-1]
+    if combinator in ('+', '~'):
+        parent = parents[number]
+        for other in range(number - 1, -1, -1):
+            if parents[other] != parent:
+                continue
+            if chain_matches(rest, other, elements, parents, dynamic):
+                return True
+            if combinator == '+':
+                return False
+        return False
+    other = parents[number]
+    while other >= 0:
+        if chain_matches(rest, other, elements, parents, dynamic):
+            return True
+        if combinator == '>':
+            return False
+        other = parents[other]
+    return False
+
+
+def _subject_classes(selector):
+    """Classes the subject (rightmost compound) of `selector` requires,
+    or None when it requires none or uses functional pseudo-classes."""
+    compound = _COMBINATOR_RE.split(selector.strip())[-1]
+    if '(' in compound:
+        return None
+    return frozenset(re.findall(r'\.([\w-]+)', compound)) or None
+
+
+def may_share_element(markup, page, selector_a, selector_b):
+    """Whether one element of `page` could match both selectors' subjects."""
+    a, b = _subject_classes(selector_a), _subject_classes(selector_b)
+    if markup is None or a is None or b is None or page not in markup.classes:
+        return True
+    need = (a | b) - markup.dynamic
+    if not need:
+        return True
+    carriers = markup.classes[page]
+    if not all(cls in carriers for cls in need):
+        return False
+    return bool(frozenset.intersection(*(carriers[cls] for cls in need)))
+
+
+# ─────────────────────────────────────────────────────────────────
+# RULE REMOVAL
+# ─────────────────────────────────────────────────────────────────
+# `rule` is any parsed rule with `start` (its first selector) and
+# `body_end` (its closing brace), e.g. a RuleIndex rule of the applier.
+def rule_removal(css, rule):
+    """Edit removing a whole rule, with its line when it is alone on it."""
+    start, end = rule.start, rule.body_end + 1
+    line_start = css.rfind('\n', 0, start) + 1
+    line_end = css.find('\n', end)
+    line_end = len(css) if line_end < 0 else line_end
+    if not css[line_start:start].strip() and not css[end:line_end].strip():
+        return (line_start, min(line_end + 1, len(css)), '')
+    while end < len(css) and css[end] in ' \t':
+        end += 1
+    return (start, end, '')
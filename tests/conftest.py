@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# The scripts live at the repository root and are imported as modules.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import _apply_design_brief as brief  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def rules():
+    """The compiled rule set of the committed brief (not cached to disk)."""
+    return brief.load_brief(brief.BRIEF_PATH, cache_dir=None)
+
+
+@pytest.fixture(scope='session')
+def shared_css():
+    with open(brief.CSS_PATH, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.fixture(scope='session')
+def shared_js():
+    with open(brief.JS_PATH, 'r', encoding='utf-8') as f:
+        return f.read()
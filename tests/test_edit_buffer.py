@@ -0,0 +1,79 @@
+import _apply_design_brief as brief
+
+
+def span(text, part):
+    start = text.index(part)
+    return start, start + len(part)
+
+
+def test_edits_apply_in_source_order():
+    css = 'a { color: red; margin: 0; }'
+    buf = brief.EditBuffer(css)
+    buf.add(*span(css, 'margin: 0'), 'margin: 4px', 'second')
+    buf.add(*span(css, 'red'), 'blue', 'first')
+    assert buf.text() == 'a { color: blue; margin: 4px; }'
+    assert buf.conflicts == []
+
+
+def test_edit_is_trimmed_to_the_changed_characters():
+    css = 'color: #F9A825;'
+    buf = brief.EditBuffer(css)
+    edit = buf.add(0, len(css), 'color: #F9B02C;')
+    assert (edit.start, edit.end, edit.new) == (*span(css, 'A825'), 'B02C')
+    assert buf.add(0, 6, 'color:') is None
+    assert buf.edits == [edit]
+
+
+def test_overlapping_edit_of_a_later_owner_is_dropped():
+    css = 'font-size: 42px;'
+    buf = brief.EditBuffer(css)
+    first = buf.add(*span(css, '42px'), '40px', 'phase 2')
+    second = buf.add(*span(css, '42px'), '28px', 'phase 4')
+    assert buf.resolve() == [first]
+    assert buf.conflicts == [(first, second)]
+    assert buf.text() == 'font-size: 40px;'
+
+
+def test_earlier_edit_wins_when_it_starts_later():
+    buf = brief.EditBuffer('0123456789')
+    first = buf.add(4, 8, 'abcd', 'first')
+    second = buf.add(2, 6, 'wxyz', 'second')
+    assert buf.resolve() == [first]
+    assert buf.conflicts == [(first, second)]
+    assert buf.text() == '0123abcd89'
+
+
+def test_earlier_edit_drops_every_later_edit_it_overlaps():
+    buf = brief.EditBuffer('0123456789')
+    first = buf.add(0, 8, 'abcdefgh', 'first')
+    buf.add(1, 3, 'XX', 'second')
+    buf.add(5, 7, 'YY', 'third')
+    assert buf.resolve() == [first]
+    assert [dropped.owner for _, dropped in buf.conflicts] == ['second', 'third']
+    assert buf.text() == 'abcdefgh89'
+
+
+def test_conflicts_are_rebuilt_on_every_resolve():
+    buf = brief.EditBuffer('0123456789')
+    buf.add(4, 8, 'abcd', 'first')
+    buf.add(2, 6, 'wxyz', 'second')
+    buf.resolve()
+    buf.resolve()
+    assert len(buf.conflicts) == 1
+
+
+def test_same_edit_recorded_twice_is_applied_once():
+    css = 'translateY(-2px)'
+    buf = brief.EditBuffer(css)
+    buf.add(*span(css, '-2px'), '-1px', 'phase 2')
+    buf.add(*span(css, '-2px'), '-1px', 'phase 3')
+    assert buf.text() == 'translateY(-1px)'
+    assert buf.conflicts == []
+
+
+def test_adjacent_edits_do_not_conflict():
+    buf = brief.EditBuffer('abcdef')
+    buf.add(0, 3, 'XYZ', 'left')
+    buf.add(3, 6, 'UVW', 'right')
+    assert buf.text() == 'XYZUVW'
+    assert buf.conflicts == []
@@ -0,0 +1,27 @@
+import contextlib
+import io
+
+import pytest
+
+import _apply_design_brief as brief
+
+
+@pytest.mark.parametrize('override', [False, True], ids=['default', 'override-tokens'])
+def test_css_phases_are_idempotent(rules, shared_css, override):
+    rules = dict(rules, override_tokens=True) if override else rules
+    with contextlib.redirect_stdout(io.StringIO()):
+        once, lines = brief.run_css_phases(shared_css, rules)
+        buf = brief.plan_css_phases(once, rules)
+        edits = buf.resolve()
+    assert lines > 0
+    assert edits == []
+    assert buf.text() == once
+
+
+def test_js_phase_is_idempotent(rules, shared_js):
+    with contextlib.redirect_stdout(io.StringIO()):
+        once = brief.run_js_phase(shared_js, rules)
+        buf = brief.plan_js_phase(once, rules)
+        edits = buf.resolve()
+    assert edits == []
+    assert buf.text() == once
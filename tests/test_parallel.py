@@ -0,0 +1,17 @@
+import contextlib
+import io
+
+import _apply_design_brief as brief
+
+
+def test_parallel_transform_matches_serial(rules, shared_css):
+    with contextlib.redirect_stdout(io.StringIO()):
+        serial, serial_blocks, serial_dirty, serial_lines = brief.transform_css_blocks(
+            shared_css, rules)
+        parallel, parallel_blocks, parallel_dirty, parallel_lines = brief.transform_css_blocks(
+            shared_css, rules, jobs=2)
+    assert len(serial_dirty) > 1        # otherwise jobs=2 runs serially too
+    assert parallel == serial
+    assert parallel_blocks == serial_blocks
+    assert parallel_dirty == serial_dirty
+    assert parallel_lines == serial_lines
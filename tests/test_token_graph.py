@@ -0,0 +1,73 @@
+import _apply_design_brief as brief
+
+PREAMBLE = ':root { --shared: 1px; }\n'
+
+
+def page(name, body):
+    return (f'/* ================================================================\n'
+            f'   PAGE: {name.title()}\n'
+            f'   Scoped to body.page-{name}\n'
+            f'   ================================================================ */\n'
+            f'{body}\n')
+
+
+def graph(css):
+    return brief.TokenGraph(css, brief.RuleIndex(css))
+
+
+def test_blocks_follow_the_page_banners():
+    css = PREAMBLE + page('kontakt', '.page-kontakt a { color: red; }')
+    tokens = graph(css)
+    assert [name for _, name in tokens.blocks] == [brief.PREAMBLE, 'kontakt']
+    assert tokens.block_at(css.index('.page-kontakt')) == 'kontakt'
+    assert tokens.block_at(0) == brief.PREAMBLE
+
+
+def test_undefined_references_resolve_in_the_block_or_the_preamble():
+    css = PREAMBLE + page('kontakt', ':root { --blue: #23679A; }\n'
+                                     '.page-kontakt a { color: var(--blue); margin: var(--shared); '
+                                     'border-color: var(--green); '
+                                     'background: var(--orange, #EC6303); }')
+    tokens = graph(css)
+    assert [use.name for use in tokens.undefined('kontakt')] == ['--green']
+    assert tokens.defined('kontakt', '--shared')
+    assert not tokens.defined('kontakt', '--orange')
+
+
+def test_tokens_of_another_block_do_not_count():
+    css = PREAMBLE + page('kontakt', ':root { --blue: #23679A; }') + page(
+        'muenchen', '.page-muenchen a { color: var(--blue); }')
+    tokens = graph(css)
+    assert tokens.undefined('kontakt') == []
+    assert [use.name for use in tokens.undefined('muenchen')] == ['--blue']
+
+
+def test_cycles_are_found_and_resolve_to_none():
+    css = PREAMBLE + page('kontakt', ':root { --a: var(--b); --b: var(--c); --c: var(--a); '
+                                     '--d: var(--a); --e: 2px; --f: var(--e); }')
+    tokens = graph(css)
+    assert tokens.cycles('kontakt') == [['--a', '--b', '--c', '--a']]
+    values = tokens.resolved('kontakt')
+    assert values['--a'] is None and values['--d'] is None
+    assert values['--f'] == '2px'
+
+
+def test_self_reference_is_a_cycle():
+    css = PREAMBLE + page('kontakt', ':root { --gap: calc(var(--gap) + 1px); }')
+    assert graph(css).cycles('kontakt') == [['--gap', '--gap']]
+
+
+def test_undefined_reference_resolves_to_its_fallback():
+    css = PREAMBLE + page('kontakt', ':root { --a: var(--missing, 4px); --b: var(--missing); }')
+    values = graph(css).resolved('kontakt')
+    assert values['--a'] == '4px'
+    assert values['--b'] is None
+    assert values['--shared'] == '1px'
+
+
+def test_unused_tokens():
+    css = PREAMBLE + page('kontakt', ':root { --a: 1px; --b: var(--a); --c: 3px; }\n'
+                                     '.page-kontakt a { margin: var(--b); }')
+    tokens = graph(css)
+    assert tokens.unused('kontakt') == ['--c']
+    assert tokens.unused(brief.PREAMBLE) == ['--shared']